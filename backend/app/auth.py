@@ -6,20 +6,56 @@ import os
 os.environ.setdefault('PASSLIB_BCRYPT_DISABLE_WRAP_BUG_DETECTION', '1')
 
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
+import hashlib
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from app.database import get_db, AdminUser
 from app.config import settings
+from app.cache import LRUCache, MISSING
 
 # Initialize CryptContext
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 security = HTTPBearer()
 
+class Principal(NamedTuple):
+    """
+    Administrateur authentifié, indépendant de la session SQLAlchemy de la requête
+    """
+    id: int
+    email: str
+
+# Jeton déjà validé (SHA-256) -> (Principal, expiration du jeton) : les requêtes suivantes
+# évitent la vérification de signature et la requête AdminUser
+_principal_cache = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_S)
+
+def invalidate_principals():
+    """
+    Oublier tous les jetons validés (administrateur désactivé, modifié ou supprimé)
+    """
+    _principal_cache.clear()
+
+@event.listens_for(Session, "after_flush")
+def _track_admin_changes(session, flush_context):
+    if any(isinstance(obj, AdminUser) for obj in list(session.dirty) + list(session.deleted)):
+        session.info["admin_users_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_admin_commit(session):
+    # Après le commit : une requête concurrente ne peut plus remettre en cache l'ancien état
+    if session.info.pop("admin_users_changed", False):
+        invalidate_principals()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_admin_changes(session):
+    session.info.pop("admin_users_changed", None)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -36,26 +72,46 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def resolve_principal(token: str, db: Session) -> Optional[Principal]:
+    """
+    Valider un jeton et retrouver l'administrateur actif correspondant (None si refusé)
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _principal_cache.get(key)
+    if cached is not MISSING:
+        principal, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return principal
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    email: str = payload.get("sub")
+    if email is None:
+        return None
     
     user = db.query(AdminUser).filter(AdminUser.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    if user is None or user.is_active is False:
+        return None
+    
+    principal = Principal(id=user.id, email=user.email)
+    _principal_cache.put(key, (principal, payload.get("exp")))
+    return principal
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> Principal:
+    """
+    Dépendance des routes protégées : administrateur authentifié par le jeton Bearer
+    """
+    principal = resolve_principal(credentials.credentials, db)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return principal
 
@@ -0,0 +1,70 @@
+"""
+LRU Cache
+Cache borné en mémoire partagé entre threads (embeddings, décisions de recherche, principals JWT)
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+# Valeur retournée par LRUCache.get pour une clé absente ou expirée
+MISSING = object()
+
+class LRUCache:
+    """
+    Dictionnaire borné partagé entre threads : éviction du moins récemment utilisé,
+    expiration après ttl_seconds (0 = jamais) et compteurs de succès / échecs
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, count: bool = True) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds > 0 and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
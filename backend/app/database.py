@@ -1,16 +1,70 @@
 """
 Database configuration and models
 """
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, Text
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, Text, LargeBinary, BigInteger, PrimaryKeyConstraint, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from typing import Optional
 from app.config import settings
+from app.db_pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
 
-engine = create_engine(settings.DATABASE_URL)
+def _engine_options(url: str, asynchronous: bool = False) -> dict:
+    """
+    Options du pool et de connexion selon Settings (DB_POOL_*, DB_STATEMENT_TIMEOUT_MS)
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        # Base en mémoire : une seule connexion partagée, pool par défaut
+        return {}
+    
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if asynchronous else InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_S,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_S,
+    }
+    if backend == "postgresql" and settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        if asynchronous:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+engine = create_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Moteur asynchrone optionnel : les routes async peuvent l'utiliser via get_async_db
+# sans passer par le pool de threads
+async_engine = None
+AsyncSessionLocal = None
+
+def _async_url() -> Optional[str]:
+    """
+    URL du moteur asynchrone : DB_ASYNC_URL, sinon DATABASE_URL avec asyncpg (PostgreSQL uniquement)
+    """
+    if settings.DB_ASYNC_URL:
+        return settings.DB_ASYNC_URL
+    url = make_url(settings.DATABASE_URL)
+    if url.get_backend_name() != "postgresql":
+        return None
+    return url.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+if settings.DB_ASYNC_ENABLED:
+    async_url = _async_url()
+    if async_url is None:
+        print("Async database engine disabled: set DB_ASYNC_URL for non-PostgreSQL databases")
+    else:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        
+        async_engine = create_async_engine(async_url, **_engine_options(async_url, asynchronous=True))
+        AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 class Employee(Base):
     __tablename__ = "employees"
     
@@ -30,10 +84,14 @@ class EmployeePhoto(Base):
     employee_id = Column(Integer, index=True)
     photo_path = Column(String, nullable=False)
     embedding_path = Column(String)  # Path to FAISS index or separate storage
+    embedding = Column(LargeBinary, nullable=True)  # float32[EMBEDDING_SIZE], évite de relancer le CNN
+    embedding_version = Column(String, nullable=True)  # Version du pipeline ayant produit l'embedding
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class AccessLog(Base):
     __tablename__ = "access_logs"
+    # Pagination par curseur (timestamp, id) dans l'ordre décroissant
+    __table_args__ = (Index("idx_access_logs_timestamp_id", "timestamp", "id"),)
     
     id = Column(Integer, primary_key=True, index=True)
     employee_id = Column(Integer, index=True, nullable=True)
@@ -43,6 +101,17 @@ class AccessLog(Base):
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     image_path = Column(String, nullable=True)
 
+class AccessLogRollup(Base):
+    __tablename__ = "access_log_rollups"
+    __table_args__ = (PrimaryKeyConstraint("granularity", "bucket", "employee_id", "decision"),)
+    
+    # Compteurs pré-agrégés des AccessLog, mis à jour à chaque écriture de logs
+    granularity = Column(String, nullable=False)  # "hour", "day" ou "state" (marqueur de construction initiale)
+    bucket = Column(DateTime, nullable=False)  # Début de l'intervalle (UTC)
+    employee_id = Column(Integer, nullable=False)  # 0 = tous les employés (et tentatives non reconnues)
+    decision = Column(String, nullable=False)
+    count = Column(BigInteger, nullable=False, default=0)
+
 class AdminUser(Base):
     __tablename__ = "admin_users"
     
@@ -52,6 +121,15 @@ class AdminUser(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class IndexState(Base):
+    __tablename__ = "index_state"
+    
+    # Une seule ligne (id = 1) : version de l'index FAISS publiée par le dernier écrivain
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)  # Génération du snapshot
+    wal_size = Column(BigInteger, nullable=False, default=0)  # Octets du journal appliqués
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -59,3 +137,17 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine is disabled (DB_ASYNC_ENABLED=false or no async URL)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_engines():
+    """
+    Fermer les connexions des pools à l'arrêt
+    """
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
+
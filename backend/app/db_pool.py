@@ -0,0 +1,72 @@
+"""
+Database connection pool
+Pools SQLAlchemy instrumentés : connexions empruntées, attentes et latence d'emprunt
+"""
+import time
+import threading
+from typing import Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+class PoolMetricsMixin:
+    """
+    Compte les appels en cours d'emprunt (waiters), leur durée et les expirations de
+    DB_POOL_TIMEOUT_S. Une latence élevée ou des waiters non nuls indiquent un pool trop petit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.waiters = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        with self._metrics_lock:
+            self.waiters += 1
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._metrics_lock:
+                self.waiters -= 1
+                self.checkouts += 1
+                self.checkout_time_total += elapsed
+                self.checkout_time_max = max(self.checkout_time_max, elapsed)
+
+    def metrics(self) -> Dict[str, float]:
+        with self._metrics_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "overflow": max(0, self.overflow()),
+                "waiters": self.waiters,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "checkout_avg_ms": round(1000 * self.checkout_time_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "checkout_max_ms": round(1000 * self.checkout_time_max, 3),
+            }
+
+class InstrumentedQueuePool(PoolMetricsMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(PoolMetricsMixin, AsyncAdaptedQueuePool):
+    pass
+
+def pool_metrics(engine) -> Dict[str, float]:
+    """
+    Métriques du pool d'un moteur (synchrone ou asynchrone)
+    """
+    pool = engine.pool
+    if isinstance(pool, PoolMetricsMixin):
+        return pool.metrics()
+    # Pool non instrumenté (SQLite en mémoire) : état seul
+    return {"status": pool.status()}
@@ -0,0 +1,503 @@
+"""
+Bulk enrollment
+Enrôlement en masse à partir d'un répertoire ou d'une archive zip et d'un manifeste CSV
+"""
+import io
+import os
+import csv
+import time
+import uuid
+import hashlib
+import zipfile
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.database import SessionLocal, Employee, EmployeePhoto
+from app.ml_module.face_recognition import (
+    FaceRecognitionService, embedding_to_bytes, embeddings_from_bytes, EMBEDDING_VERSION
+)
+
+MANIFEST_NAME = "manifest.csv"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# Lignes traitées par requête IN (employés, photos)
+QUERY_CHUNK_SIZE = 500
+
+# Erreurs conservées dans le rapport
+MAX_REPORTED_ERRORS = 100
+
+class ManifestRow(NamedTuple):
+    employee_id: str
+    name: str
+    email: Optional[str]
+    role: str
+    photos: List[str]  # Chemins relatifs à la source ; vide = répertoire <employee_id>/
+
+def read_manifest(text: str) -> List[ManifestRow]:
+    """
+    Colonnes : employee_id, name (obligatoires), email, role, photos (chemins séparés par ';').
+    Un employee_id répété ajoute ses photos à la première ligne.
+    """
+    reader = csv.DictReader(io.StringIO(text.lstrip("\ufeff")))
+    missing = {"employee_id", "name"} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+
+    rows: Dict[str, ManifestRow] = {}
+    for line, record in enumerate(reader, start=2):
+        employee_id = (record.get("employee_id") or "").strip()
+        name = (record.get("name") or "").strip()
+        if not employee_id or not name:
+            raise ValueError(f"Manifest line {line}: employee_id and name are required")
+        photos = [path.strip() for path in (record.get("photos") or "").split(";") if path.strip()]
+        if employee_id in rows:
+            rows[employee_id].photos.extend(photos)
+            continue
+        rows[employee_id] = ManifestRow(
+            employee_id=employee_id,
+            name=name,
+            email=(record.get("email") or "").strip() or None,
+            role=(record.get("role") or "").strip() or "employee",
+            photos=photos
+        )
+    return list(rows.values())
+
+class EnrollmentSource(ABC):
+    """
+    Photos (et manifeste) d'un enrôlement, lues par chemin relatif.
+    Les chemins viennent du manifeste : absolus ou remontant hors de la source, ils sont refusés.
+    """
+
+    @staticmethod
+    def relative_path(path: str) -> PurePosixPath:
+        """
+        Chemin relatif normalisé (séparateurs '/'), PermissionError s'il sort de la source
+        """
+        relative = PurePosixPath(path.replace("\\", "/"))
+        if relative.is_absolute() or ".." in relative.parts or (relative.parts and ":" in relative.parts[0]):
+            raise PermissionError(f"Path outside the enrollment source: {path}")
+        return relative
+
+    @abstractmethod
+    def read(self, path: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def list_photos(self, folder: str) -> List[str]:
+        ...
+
+    def close(self):
+        pass
+
+class DirectorySource(EnrollmentSource):
+    def __init__(self, root: Path):
+        self.root = Path(root).resolve()
+
+    def _resolve(self, path: str) -> Path:
+        # Liens symboliques compris : le chemin résolu doit rester sous la racine
+        resolved = (self.root / self.relative_path(path)).resolve()
+        if not resolved.is_relative_to(self.root):
+            raise PermissionError(f"Path outside the enrollment source: {path}")
+        return resolved
+
+    def read(self, path: str) -> bytes:
+        return self._resolve(path).read_bytes()
+
+    def list_photos(self, folder: str) -> List[str]:
+        directory = self._resolve(folder)
+        if not directory.is_dir():
+            return []
+        return sorted(
+            str(path.relative_to(self.root)) for path in directory.iterdir()
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        )
+
+class ZipSource(EnrollmentSource):
+    def __init__(self, path: Path, max_files: Optional[int] = None, max_file_bytes: Optional[int] = None):
+        """
+        max_files, max_file_bytes : bornes vérifiées sur l'annuaire de l'archive, avant toute
+        décompression (archives reçues par l'API) ; ValueError si elles sont dépassées
+        """
+        self.archive = zipfile.ZipFile(path)
+        files = [info for info in self.archive.infolist() if not info.is_dir()]
+        try:
+            if max_files is not None and len(files) > max_files:
+                raise ValueError(f"Archive has {len(files)} files (maximum {max_files})")
+            if max_file_bytes is not None:
+                for info in files:
+                    # Taille déclarée : la lecture d'une entrée s'arrête à file_size octets
+                    if info.file_size > max_file_bytes:
+                        raise ValueError(f"File too large: {info.filename} (maximum {max_file_bytes} bytes)")
+        except ValueError:
+            self.archive.close()
+            raise
+        self.names = {info.filename for info in files}
+
+    def read(self, path: str) -> bytes:
+        return self.archive.read(str(self.relative_path(path)))
+
+    def list_photos(self, folder: str) -> List[str]:
+        prefix = str(self.relative_path(folder)) + "/"
+        return sorted(
+            name for name in self.names
+            if name.startswith(prefix) and "/" not in name[len(prefix):]
+            and PurePosixPath(name).suffix.lower() in IMAGE_EXTENSIONS
+        )
+
+    def close(self):
+        self.archive.close()
+
+def open_source(path: Path, max_files: Optional[int] = None, max_file_bytes: Optional[int] = None) -> EnrollmentSource:
+    path = Path(path)
+    if path.is_file() and zipfile.is_zipfile(path):
+        return ZipSource(path, max_files, max_file_bytes)
+    if path.is_dir():
+        return DirectorySource(path)
+    raise ValueError(f"Enrollment source must be a directory or a zip archive: {path}")
+
+class EnrollmentProgress:
+    """
+    Avancement d'un enrôlement, mis à jour après chaque lot
+    """
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.status = "running"
+        self.employees_total = 0
+        self.employees_created = 0
+        self.photos_total = 0
+        self.photos_processed = 0
+        self.photos_added = 0
+        self.photos_skipped: Counter = Counter()
+        self.errors: List[str] = []
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self._started = time.monotonic()
+        self._elapsed: Optional[float] = None
+
+    @property
+    def photos_per_second(self) -> float:
+        elapsed = self._elapsed if self._elapsed is not None else time.monotonic() - self._started
+        return round(self.photos_processed / elapsed, 2) if elapsed > 0 else 0.0
+
+    def error(self, message: str):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def finish(self, status: str):
+        self._elapsed = time.monotonic() - self._started
+        self.status = status
+        self.finished_at = datetime.utcnow()
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "employees_total": self.employees_total,
+            "employees_created": self.employees_created,
+            "photos_total": self.photos_total,
+            "photos_processed": self.photos_processed,
+            "photos_added": self.photos_added,
+            "photos_skipped": dict(self.photos_skipped),
+            "photos_per_second": self.photos_per_second,
+            "errors": list(self.errors),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def run_enrollment(
+    face_service: FaceRecognitionService,
+    source: EnrollmentSource,
+    rows: List[ManifestRow],
+    batch_size: Optional[int] = None,
+    progress: Optional[EnrollmentProgress] = None,
+    on_progress: Optional[Callable[[EnrollmentProgress], None]] = None
+) -> EnrollmentProgress:
+    """
+    Enrôler les employés du manifeste et leurs photos.
+
+    1. Employés créés (ou retrouvés par employee_id) par transactions groupées
+    2. Photos analysées par lots de batch_size (détection en parallèle dans le pool
+       d'inférence, un passage FaceNet par lot) ; fichiers et lignes EmployeePhoto d'un lot
+       validés dans une seule transaction
+    3. Tous les vecteurs ajoutés à l'index en une opération, suivie d'un seul snapshot
+
+    Reprise : les photos déjà enregistrées (même chemin de destination, dérivé du chemin
+    source) sont ignorées et
+    les photos en base absentes de l'index (exécution interrompue) y sont ajoutées.
+    """
+    batch_size = batch_size or settings.ENROLLMENT_BATCH_SIZE
+    progress = progress or EnrollmentProgress()
+    progress.employees_total = len(rows)
+    db = SessionLocal()
+    try:
+        employees = _upsert_employees(db, rows, progress)
+
+        # Photos restant à traiter : (employé, chemin source, chemin de destination)
+        tasks = []
+        for chunk in _chunks([row for row in rows if row.employee_id in employees], QUERY_CHUNK_SIZE):
+            ids = [employees[row.employee_id].id for row in chunk]
+            enrolled = {
+                path for (path,) in db.query(EmployeePhoto.photo_path)
+                .filter(EmployeePhoto.employee_id.in_(ids)).all()
+            }
+            planned = set()
+            for row in chunk:
+                employee = employees[row.employee_id]
+                employee_dir = Path(settings.UPLOAD_DIR) / f"employee_{employee.id}"
+                try:
+                    source_paths = row.photos or source.list_photos(row.employee_id)
+                except PermissionError as e:
+                    progress.error(f"Employee {row.employee_id}: {e}")
+                    continue
+                for source_path in source_paths:
+                    try:
+                        source.relative_path(source_path)
+                    except PermissionError as e:
+                        progress.photos_skipped["outside_source"] += 1
+                        progress.error(str(e))
+                        continue
+                    target = employee_dir / _target_name(source_path)
+                    if str(target) in enrolled:
+                        progress.photos_skipped["already_enrolled"] += 1
+                        continue
+                    if str(target) in planned:
+                        progress.photos_skipped["duplicate_in_manifest"] += 1
+                        continue
+                    planned.add(str(target))
+                    tasks.append((employee.id, source_path, target))
+        progress.photos_total = len(tasks)
+        if on_progress:
+            on_progress(progress)
+
+        for chunk in _chunks(tasks, batch_size):
+            _enroll_photos(db, face_service, source, chunk, progress)
+            if on_progress:
+                on_progress(progress)
+
+        # Un seul ajout à l'index pour tout l'enrôlement, puis un seul snapshot
+        active_ids = [employee.id for employee in employees.values() if employee.is_active]
+        _index_pending_photos(db, face_service, active_ids)
+        progress.finish("completed")
+    except Exception as e:
+        db.rollback()
+        progress.error(str(e))
+        progress.finish("failed")
+    finally:
+        db.close()
+    if on_progress:
+        on_progress(progress)
+    return progress
+
+class _Enrolled(NamedTuple):
+    id: int
+    is_active: bool
+
+def _upsert_employees(db, rows: List[ManifestRow], progress: EnrollmentProgress) -> Dict[str, _Enrolled]:
+    # Identifiants relevés avant chaque commit (pas de rechargement des objets expirés)
+    employees: Dict[str, _Enrolled] = {}
+    for chunk in _chunks(rows, QUERY_CHUNK_SIZE):
+        existing = db.query(Employee.employee_id, Employee.id, Employee.is_active).filter(
+            Employee.employee_id.in_([row.employee_id for row in chunk])
+        ).all()
+        employees.update({
+            employee_id: _Enrolled(id, is_active is not False) for employee_id, id, is_active in existing
+        })
+
+        new_rows = [row for row in chunk if row.employee_id not in employees]
+        new_employees = [
+            Employee(employee_id=row.employee_id, name=row.name, email=row.email, role=row.role)
+            for row in new_rows
+        ]
+        try:
+            db.add_all(new_employees)
+            db.flush()
+            created = {employee.employee_id: _Enrolled(employee.id, True) for employee in new_employees}
+            db.commit()
+        except IntegrityError:
+            # Conflit (email déjà utilisé...) : reprendre ligne par ligne pour isoler les fautives
+            db.rollback()
+            created = {}
+            for row in new_rows:
+                employee = Employee(employee_id=row.employee_id, name=row.name, email=row.email, role=row.role)
+                try:
+                    db.add(employee)
+                    db.flush()
+                    created[row.employee_id] = _Enrolled(employee.id, True)
+                    db.commit()
+                except IntegrityError as e:
+                    db.rollback()
+                    created.pop(row.employee_id, None)
+                    progress.error(f"Employee {row.employee_id}: {e.orig}")
+        employees.update(created)
+        progress.employees_created += len(created)
+    return employees
+
+def _target_name(source_path: str) -> str:
+    """
+    Nom du fichier enregistré : empreinte du chemin source + nom d'origine, pour que
+    deux photos de même nom dans des dossiers différents (front/1.jpg, side/1.jpg)
+    ne se confondent pas et que la reprise reconnaisse chaque photo
+    """
+    path = PurePosixPath(source_path.replace("\\", "/"))
+    digest = hashlib.sha1(path.as_posix().encode("utf-8")).hexdigest()[:8]
+    return f"{digest}_{path.name}"
+
+def _enroll_photos(db, face_service: FaceRecognitionService, source: EnrollmentSource, tasks: list, progress: EnrollmentProgress):
+    contents = []
+    readable = []
+    for task in tasks:
+        try:
+            contents.append(source.read(task[1]))
+            readable.append(task)
+        except (OSError, KeyError) as e:
+            progress.photos_skipped["unreadable"] += 1
+            progress.error(f"{task[1]}: {e}")
+    progress.photos_processed += len(tasks) - len(readable)
+
+    analyses = face_service.analyze_photos(contents)
+
+    written = []
+    try:
+        for (employee_id, source_path, target), data, photo in zip(readable, contents, analyses):
+            if photo.error is not None:
+                progress.photos_skipped["invalid_image"] += 1
+                continue
+            if photo.embedding is None:
+                progress.photos_skipped["no_face"] += 1
+                continue
+            if photo.face_count > 1:
+                progress.photos_skipped["multiple_faces"] += 1
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+            written.append(target)
+            db.add(EmployeePhoto(
+                employee_id=employee_id,
+                photo_path=str(target),
+                embedding_path=None,  # Stocké dans FAISS
+                embedding=embedding_to_bytes(photo.embedding),
+                embedding_version=EMBEDDING_VERSION
+            ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        for path in written:
+            if path.exists():
+                os.remove(path)
+        raise
+    progress.photos_added += len(written)
+    progress.photos_processed += len(readable)
+
+def _index_pending_photos(db, face_service: FaceRecognitionService, employee_ids: List[int]):
+    """
+    Ajouter à l'index les photos de ces employés qui n'y sont pas encore
+    """
+    pending = []
+    for chunk in _chunks(employee_ids, QUERY_CHUNK_SIZE):
+        photos = db.query(EmployeePhoto.id, EmployeePhoto.employee_id).filter(
+            EmployeePhoto.employee_id.in_(chunk),
+            EmployeePhoto.embedding.isnot(None)
+        ).all()
+        if photos:
+            ids = np.array([photo_id for photo_id, _ in photos], dtype=np.int64)
+            missing = face_service.id_map.lookup(ids) < 0
+            pending.extend(photo for photo, is_missing in zip(photos, missing) if is_missing)
+    if not pending:
+        return
+
+    photo_ids, employee_ids_, blobs = [], [], []
+    for chunk in _chunks(pending, QUERY_CHUNK_SIZE):
+        rows = db.query(EmployeePhoto.id, EmployeePhoto.employee_id, EmployeePhoto.embedding).filter(
+            EmployeePhoto.id.in_([photo_id for photo_id, _ in chunk])
+        ).all()
+        for photo_id, employee_id, blob in rows:
+            photo_ids.append(photo_id)
+            employee_ids_.append(employee_id)
+            blobs.append(blob)
+
+    face_service.add_photos(photo_ids, employee_ids_, embeddings_from_bytes(blobs), publish=False)
+    face_service.save_index()
+    # Version publiée après le snapshot : les autres processus rechargent la nouvelle génération
+    face_service.publish_version()
+
+# Enrôlements lancés par l'API (par processus), oubliés ENROLLMENT_JOB_TTL_S après leur fin
+_jobs: Dict[str, EnrollmentProgress] = {}
+_jobs_lock = threading.Lock()
+
+def _expire_jobs():
+    """
+    Retirer les enrôlements terminés depuis plus de ENROLLMENT_JOB_TTL_S (appelé sous _jobs_lock)
+    """
+    now = datetime.utcnow()
+    expired = [
+        job_id for job_id, progress in _jobs.items()
+        if progress.finished_at is not None
+        and (now - progress.finished_at).total_seconds() > settings.ENROLLMENT_JOB_TTL_S
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def start_enrollment_job(
+    face_service: FaceRecognitionService,
+    source_path: Path,
+    manifest_text: Optional[str],
+    delete_source: bool = False
+) -> EnrollmentProgress:
+    """
+    Lancer un enrôlement en arrière-plan ; l'avancement est consultable par job_id.
+    L'archive vient d'un client : nombre et taille de ses fichiers sont bornés.
+    """
+    source = None
+    try:
+        source = open_source(
+            source_path,
+            max_files=settings.ENROLLMENT_MAX_ARCHIVE_FILES,
+            max_file_bytes=settings.RECOGNITION_BATCH_MAX_IMAGE_BYTES
+        )
+        if manifest_text is None:
+            try:
+                manifest_text = source.read(MANIFEST_NAME).decode("utf-8")
+            except (KeyError, OSError):
+                raise ValueError(f"No manifest provided and no {MANIFEST_NAME} in the source")
+        rows = read_manifest(manifest_text)
+    except Exception:
+        if source is not None:
+            source.close()
+        if delete_source:
+            os.remove(source_path)
+        raise
+
+    progress = EnrollmentProgress()
+    with _jobs_lock:
+        _expire_jobs()
+        _jobs[progress.job_id] = progress
+
+    def run():
+        try:
+            run_enrollment(face_service, source, rows, progress=progress)
+        finally:
+            source.close()
+            if delete_source:
+                os.remove(source_path)
+
+    threading.Thread(target=run, name=f"enrollment-{progress.job_id[:8]}", daemon=True).start()
+    return progress
+
+def get_enrollment_job(job_id: str) -> Optional[EnrollmentProgress]:
+    with _jobs_lock:
+        _expire_jobs()
+        return _jobs.get(job_id)
@@ -0,0 +1,151 @@
+"""
+Access log rollups
+Compteurs par heure / jour, employé et décision, mis à jour avec chaque lot de logs :
+statistiques et histogrammes sans parcourir access_logs
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import select, update, insert, delete, func, text
+from sqlalchemy.orm import Session
+
+from app.database import AccessLog, AccessLogRollup
+
+GRANULARITIES = ("hour", "day")
+
+# employee_id des lignes agrégées sur tous les employés
+ALL_EMPLOYEES = 0
+
+# Ligne marqueur (hors des granularités) : construction initiale terminée, count = logs agrégés
+BACKFILL_MARKER = {
+    "granularity": "state", "bucket": datetime(1970, 1, 1), "employee_id": ALL_EMPLOYEES, "decision": "backfilled"
+}
+
+RollupKey = Tuple[str, datetime, int, str]  # (granularité, début, employé, décision)
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def rollup_deltas(rows: Iterable[dict]) -> Dict[RollupKey, int]:
+    """
+    Incrément de chaque ligne de rollup touchée par ces logs
+    """
+    deltas: Dict[RollupKey, int] = defaultdict(int)
+    for row in rows:
+        timestamp = row.get("timestamp") or datetime.utcnow()
+        employees = [ALL_EMPLOYEES]
+        if row.get("employee_id"):
+            employees.append(row["employee_id"])
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(timestamp, granularity)
+            for employee_id in employees:
+                deltas[(granularity, bucket, employee_id, row["decision"])] += 1
+    return deltas
+
+def apply_rollups(db: Session, rows: Iterable[dict]):
+    """
+    Ajouter ces logs aux rollups, dans la transaction de leur insertion
+    """
+    _add_deltas(db, rollup_deltas(rows))
+
+def _add_deltas(db: Session, deltas: Dict[RollupKey, int]):
+    if not deltas:
+        return
+    # Ordre de clés stable : deux écrivains concurrents verrouillent les lignes dans le même ordre
+    values = [
+        {
+            "granularity": key[0], "bucket": key[1], "employee_id": key[2], "decision": key[3],
+            "count": delta
+        }
+        for key, delta in sorted(deltas.items())
+    ]
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(AccessLogRollup)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["granularity", "bucket", "employee_id", "decision"],
+                set_={"count": AccessLogRollup.count + statement.excluded["count"]}
+            ),
+            values
+        )
+        return
+
+    # Autres bases : mise à jour, puis insertion des lignes absentes
+    for value in values:
+        result = db.execute(
+            update(AccessLogRollup)
+            .where(
+                AccessLogRollup.granularity == value["granularity"],
+                AccessLogRollup.bucket == value["bucket"],
+                AccessLogRollup.employee_id == value["employee_id"],
+                AccessLogRollup.decision == value["decision"]
+            )
+            .values(count=AccessLogRollup.count + value["count"])
+        )
+        if result.rowcount == 0:
+            db.execute(insert(AccessLogRollup), [value])
+
+def backfill_rollups(db: Session, chunk_size: int = 10000) -> int:
+    """
+    Construire les rollups à partir des logs existants, une seule fois par base ;
+    retourne le nombre de logs agrégés (0 si la construction était déjà faite).
+
+    Le marqueur est validé dans la même transaction que les compteurs. Sans marqueur
+    (première mise en service, construction interrompue), les rollups sont recalculés
+    entièrement : des processus qui démarrent ensemble ou une nouvelle tentative après
+    un échec ne comptent jamais un log deux fois.
+    """
+    if _backfilled(db):
+        return 0
+    try:
+        _lock_rollups(db)
+        # Un autre processus a pu terminer la construction pendant l'attente du verrou
+        if _backfilled(db):
+            db.rollback()
+            return 0
+
+        db.execute(delete(AccessLogRollup))
+        # Un seul parcours des logs (curseur côté serveur) ; seuls les compteurs restent en mémoire
+        rows = db.execute(
+            select(AccessLog.employee_id, AccessLog.decision, AccessLog.timestamp)
+            .execution_options(yield_per=chunk_size)
+        )
+        deltas = rollup_deltas(row._asdict() for row in rows)
+        _add_deltas(db, deltas)
+
+        total = int(sum(
+            delta for key, delta in deltas.items()
+            if key[0] == "day" and key[2] == ALL_EMPLOYEES
+        ))
+        db.execute(insert(AccessLogRollup), [dict(BACKFILL_MARKER, count=total)])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return total
+
+def _backfilled(db: Session) -> bool:
+    return db.scalar(
+        select(func.count()).select_from(AccessLogRollup).where(
+            *(getattr(AccessLogRollup, column) == value for column, value in BACKFILL_MARKER.items())
+        )
+    ) > 0
+
+def _lock_rollups(db: Session):
+    """
+    PostgreSQL : bloquer les écrivains de rollups jusqu'à la fin de la construction.
+    Les logs validés avant le verrou sont relus ; ceux d'une transaction en attente
+    ajouteront leurs incréments aux compteurs reconstruits. Les lectures restent possibles.
+    (SQLite : la suppression prend le verrou d'écriture de la base.)
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {AccessLogRollup.__tablename__} IN EXCLUSIVE MODE"))
@@ -0,0 +1,168 @@
+"""
+Access log writer
+Écriture groupée des AccessLog en arrière-plan, hors du chemin critique de la reconnaissance
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.database import SessionLocal, AccessLog
+from app.log_rollups import apply_rollups, backfill_rollups
+
+# Marqueur d'arrêt déposé dans la file
+_STOP = object()
+
+class AccessLogWriter:
+    """
+    Les logs sont mis en file puis insérés par lots (un seul INSERT multi-lignes par lot)
+    quand le lot atteint batch_size ou que flush_interval_ms s'est écoulé. Les rollups
+    (app.log_rollups) sont mis à jour dans la même transaction.
+
+    Durabilité par décision : pour les décisions de sync_decisions (par exemple "denied"),
+    write() retourne un Future résolu une fois la ligne validée en base, et le lot est
+    écrit sans attendre l'intervalle. Les autres décisions ne sont pas attendues.
+    """
+
+    def __init__(self, batch_size: int, flush_interval_ms: float, sync_decisions: Iterable[str]):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.sync_decisions: Set[str] = set(sync_decisions)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Écrire les logs encore en file puis arrêter le thread
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def write(self, row: dict) -> Optional[Future]:
+        """
+        Mettre un log en file ; retourne un Future si sa décision exige une écriture durable
+        """
+        return self.write_many([row])[0]
+
+    def write_many(self, rows: List[dict]) -> List[Optional[Future]]:
+        items = []
+        for row in rows:
+            # L'horodatage est celui de la tentative, pas celui de l'insertion
+            row.setdefault("timestamp", datetime.utcnow())
+            future = Future() if row["decision"] in self.sync_decisions else None
+            items.append((row, future))
+
+        if self._thread is None:
+            # Écrivain arrêté (démarrage, arrêt, scripts) : écriture immédiate
+            self._flush(items)
+        else:
+            for item in items:
+                self._queue.put(item)
+        return [future for _, future in items]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            durable = item[1] is not None
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                # Une écriture durable attendue : ne prendre que ce qui est déjà en file
+                timeout = 0 if durable else deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                durable = durable or item[1] is not None
+
+            self._flush(batch)
+
+        # Vider la file avant l'arrêt
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            self._flush(remaining[start:start + self.batch_size])
+
+    def _flush(self, batch: List[Tuple[dict, Optional[Future]]]):
+        rows = [row for row, _ in batch]
+        db = SessionLocal()
+        try:
+            db.execute(insert(AccessLog), rows)
+            apply_rollups(db, rows)
+            db.commit()
+            self.written += len(rows)
+        except Exception as e:
+            db.rollback()
+            self.failed += len(rows)
+            print(f"Error writing {len(rows)} access logs: {e}")
+            for _, future in batch:
+                if future is not None:
+                    future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        for _, future in batch:
+            if future is not None:
+                future.set_result(None)
+
+# Instance unique du processus, démarrée et arrêtée dans lifespan
+_log_writer: Optional[AccessLogWriter] = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer() -> AccessLogWriter:
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = AccessLogWriter(
+                settings.LOG_FLUSH_BATCH_SIZE,
+                settings.LOG_FLUSH_INTERVAL_MS,
+                [decision.strip() for decision in settings.LOG_SYNC_DECISIONS.split(",") if decision.strip()]
+            )
+    return _log_writer
+
+def start_log_writer():
+    # Rollups construits une fois à partir des logs déjà présents, avant les nouvelles écritures
+    # (en cas d'échec, reconstruits entièrement au prochain démarrage)
+    db = SessionLocal()
+    try:
+        backfilled = backfill_rollups(db)
+        if backfilled:
+            print(f"Access log rollups built from {backfilled} logs")
+    except Exception as e:
+        print(f"Error building access log rollups: {e}")
+    finally:
+        db.close()
+    get_log_writer().start()
+
+def stop_log_writer():
+    get_log_writer().stop()
@@ -0,0 +1,106 @@
+"""
+Micro-batching scheduler
+Regroupe les visages alignés des requêtes concurrentes pour un seul passage FaceNet
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+class BatchScheduler:
+    """
+    File d'attente d'inférence : chaque appelant soumet un élément et reçoit son propre Future.
+    Un thread dédié regroupe jusqu'à `max_batch_size` éléments, en attendant au plus
+    `max_wait_ms` après le premier, puis appelle `batch_fn` une seule fois pour tout le lot.
+    Les lots ne se forment que si les appelants soumettent en parallèle : les routes
+    exécutent l'inférence dans le pool ML (run_ml), jamais dans la boucle d'événements.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        name: str = "inference-batcher"
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """
+        Ajouter un élément au prochain lot
+        """
+        if self._stopped:
+            raise RuntimeError("BatchScheduler is stopped")
+
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def stop(self):
+        """
+        Traiter les éléments en attente puis arrêter le thread
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            entry = self._queue.get()
+            if entry is None:
+                break
+
+            # Collecter le lot jusqu'à la taille maximale ou l'expiration du délai
+            batch = [entry]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    running = False
+                    break
+                batch.append(entry)
+
+            self._process(batch)
+
+        # Vider la file après l'arrêt pour ne laisser aucun Future en suspens
+        pending = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                pending.append(entry)
+        for start in range(0, len(pending), self.max_batch_size):
+            self._process(pending[start:start + self.max_batch_size])
+
+    def _process(self, batch: list):
+        # Ignorer les requêtes annulées entre-temps
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            results = self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
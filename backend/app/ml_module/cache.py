@@ -0,0 +1,51 @@
+"""
+Embedding Cache
+Cache LRU borné, adressé par le contenu des images, devant l'extraction des embeddings
+"""
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.cache import LRUCache
+
+def content_key(contents: bytes) -> bytes:
+    """
+    Empreinte SHA-256 du contenu brut d'une image
+    """
+    return hashlib.sha256(contents).digest()
+
+class EmbeddingCache:
+    """
+    Embeddings (ou absence de visage, stockée comme None) indexés par le SHA-256 de l'image.
+
+    Seul un contenu identique octet pour octet est servi depuis le cache. Les embeddings
+    ne dépendent pas de l'index : seules les décisions doivent être invalidées quand la
+    galerie change (voir FaceRecognitionService).
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float = 0.0):
+        self.entries = LRUCache(max_entries, ttl_seconds)
+
+    @property
+    def enabled(self) -> bool:
+        return self.entries.max_entries > 0
+
+    def lookup(self, contents: bytes) -> Tuple[Any, bytes]:
+        """
+        Retourne (embedding ou MISSING, clé de contenu pour l'insertion)
+        """
+        key = content_key(contents)
+        return self.entries.get(key), key
+
+    def store(self, key: bytes, embedding: Optional[np.ndarray]):
+        if embedding is not None:
+            embedding = np.array(embedding, dtype=np.float32)
+            embedding.setflags(write=False)
+        self.entries.put(key, embedding)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.entries.stats()
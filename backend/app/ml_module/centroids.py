@@ -0,0 +1,67 @@
+"""
+Centroid Index
+Un centroïde normalisé par employé pour une première passe de recherche rapide
+"""
+import numpy as np
+import faiss
+from typing import Iterable, Tuple
+
+from app.ml_module.id_map import IdMap
+
+class CentroidIndex:
+    """
+    Index exact sur les centroïdes des employés, adressé par employee_id.
+    Les vecteurs des photos sont relus dans l'index principal (reconstruct) :
+    aucune copie supplémentaire de la galerie n'est gardée en mémoire.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def rebuild(self, photo_index: faiss.Index, id_map: IdMap):
+        """
+        Recalculer tous les centroïdes à partir de l'index des photos
+        """
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+        if len(id_map) == 0:
+            return
+
+        photo_ids = np.array(id_map.photo_ids, dtype=np.int64)
+        employee_ids = np.array(id_map.employee_ids, dtype=np.int64)
+        vectors = photo_index.reconstruct_batch(photo_ids)
+
+        # Moyenne par employé en une passe (np.add.at sur les indices de groupe)
+        unique_employees, groups = np.unique(employee_ids, return_inverse=True)
+        sums = np.zeros((len(unique_employees), self.dimension), dtype=np.float32)
+        np.add.at(sums, groups, vectors)
+        self.index.add_with_ids(self._normalize(sums), unique_employees)
+
+    def refresh(self, photo_index: faiss.Index, id_map: IdMap, employee_ids: Iterable[int]):
+        """
+        Mettre à jour les centroïdes des employés dont les photos ont changé
+        """
+        employee_ids = np.unique(np.asarray(list(employee_ids), dtype=np.int64))
+        employee_ids = employee_ids[employee_ids >= 0]
+        if len(employee_ids) == 0:
+            return
+
+        self.index.remove_ids(employee_ids)
+        for employee_id in employee_ids.tolist():
+            photo_ids = id_map.photos_of(employee_id)
+            if len(photo_ids) == 0:
+                continue
+            centroid = photo_index.reconstruct_batch(np.asarray(photo_ids, dtype=np.int64)).sum(axis=0, keepdims=True)
+            self.index.add_with_ids(self._normalize(centroid), np.array([employee_id], dtype=np.int64))
+
+    def search(self, embeddings: np.ndarray, candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index.search(embeddings, min(candidates, self.index.ntotal))
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12), dtype=np.float32)
@@ -0,0 +1,71 @@
+"""
+ML Executor
+Pool borné de threads pour l'inférence (MTCNN, FaceNet, FAISS), hors de la boucle d'événements
+"""
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import torch
+
+from app.config import settings
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def inference_processes() -> int:
+    """
+    Nombre de processus d'inférence dédiés (0 = inférence dans le processus API)
+    """
+    if settings.INFERENCE_PROCESSES < 0:
+        return os.cpu_count() or 1
+    return settings.INFERENCE_PROCESSES
+
+def ml_workers() -> int:
+    if settings.ML_WORKERS > 0:
+        return settings.ML_WORKERS
+    if inference_processes():
+        # Les threads ne font qu'attendre les processus : de quoi tous les occuper
+        return 2 * inference_processes()
+    return max(1, min(4, os.cpu_count() or 1))
+
+def configure_torch_threads():
+    """
+    Répartir les cœurs entre les workers ML : chaque inférence utilise au plus
+    TORCH_NUM_THREADS threads intra-op (par défaut cœurs / ML_WORKERS), pour éviter
+    que des inférences concurrentes ne se disputent tous les cœurs
+    """
+    threads = settings.TORCH_NUM_THREADS
+    if threads <= 0:
+        threads = max(1, (os.cpu_count() or 1) // ml_workers())
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Déjà fixé : ne peut être modifié qu'avant le premier calcul parallèle
+        pass
+
+def get_ml_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ml_workers(), thread_name_prefix="ml-worker")
+    return _executor
+
+async def run_ml(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Exécuter un appel bloquant (inférence, recherche FAISS) dans le pool ML et l'attendre
+    sans bloquer la boucle d'événements
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_ml_executor(), functools.partial(func, *args, **kwargs))
+
+def shutdown_ml_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
@@ -3,22 +3,61 @@ Face Recognition Service
 Utilise MTCNN pour la détection et FaceNet pour l'embedding
 """
 import os
+import io
+import hashlib
+import threading
 import numpy as np
 import cv2
 from PIL import Image
 import torch
 from facenet_pytorch import MTCNN, InceptionResnetV1
 import faiss
-import pickle
 from pathlib import Path
-from typing import Optional, Dict, List
+from datetime import datetime
+from typing import Callable, Optional, Dict, List, NamedTuple, Tuple, Union
 from sqlalchemy.orm import Session
+from fastapi import HTTPException, status
 
 from app.config import settings
-from app.database import Employee, EmployeePhoto
+from app.database import SessionLocal, Employee, EmployeePhoto, IndexState
+from app.ml_module.batching import BatchScheduler
+from app.ml_module.index_store import IndexStore, IndexFileLock, OP_ADD, OP_REMOVE
+from app.ml_module.id_map import IdMap
+from app.ml_module.centroids import CentroidIndex
+from app.ml_module.gallery import Gallery
+from app.cache import LRUCache, MISSING
+from app.ml_module.cache import EmbeddingCache
+from app.ml_module.executor import configure_torch_threads, inference_processes
+from app.ml_module.worker_pool import InferencePool
+
+# Version du pipeline d'embedding : les embeddings stockés avec une autre version sont recalculés
+EMBEDDING_VERSION = "mtcnn-facenet-vggface2-v2"
+
+# Une image peut être un chemin, le contenu brut d'un fichier, un tableau RGB ou une image PIL
+ImageInput = Union[str, Path, bytes, np.ndarray, Image.Image]
+
+class DetectedFace(NamedTuple):
+    tensor: torch.Tensor  # (3, 160, 160) aligné et normalisé, prêt pour FaceNet
+    box: np.ndarray  # [x1, y1, x2, y2] du visage retenu
+    landmarks: Optional[np.ndarray]  # 5 points de repère (yeux, nez, bouche)
+    probability: float
+    boxes: np.ndarray  # Toutes les boîtes détectées dans l'image
+
+class FrameFaces(NamedTuple):
+    image: Image.Image  # Image à la résolution de détection
+    scale: float  # Facteur résolution d'origine / résolution de détection
+    load_original: Callable[[], Image.Image]  # Pixels d'origine, décodés à la demande
+    boxes: np.ndarray  # Boîtes [x1, y1, x2, y2] dans les coordonnées d'origine
+    probs: np.ndarray
+    landmarks: Optional[np.ndarray]
+
+class PhotoFaces(NamedTuple):
+    embedding: Optional[np.ndarray]  # Embedding du visage principal (None sans visage)
+    face_count: int  # Visages détectés avec une probabilité >= PHOTO_MIN_FACE_PROBABILITY
+    error: Optional[str] = None  # Image illisible
 
 class FaceRecognitionService:
-    def __init__(self):
+    def __init__(self, load_gallery: bool = True):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
         # Initialiser MTCNN pour la détection
@@ -32,63 +71,232 @@ class FaceRecognitionService:
             device=self.device
         )
         
-        # Initialiser FaceNet pour l'embedding
-        self.resnet = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
+        # Détection et embeddings dans des processus dédiés (INFERENCE_PROCESSES)
+        processes = inference_processes() if load_gallery else 0
+        
+        # Initialiser FaceNet pour l'embedding. Avec le pool, seuls ses processus l'exécutent :
+        # pas de copie des poids dans le processus API (MTCNN, léger, y reste pour les flux)
+        self.resnet = None
+        if not processes:
+            self.resnet = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
+        
+        if not load_gallery:
+            # Processus d'inférence du pool : les modèles suffisent
+            self.pool = None
+            return
         
-        # Initialiser FAISS index
-        self.index_path = Path(settings.MODELS_DIR) / "faiss_index.index"
-        self.metadata_path = Path(settings.MODELS_DIR) / "faiss_metadata.pkl"
+        self.pool = InferencePool(processes, settings.TORCH_NUM_THREADS or 1) if processes else None
+        
+        # Regrouper les visages des requêtes concurrentes (et des flux) en un seul passage
+        # FaceNet, exécuté dans les processus du pool s'il existe
+        self.batcher = BatchScheduler(
+            self.embed_faces if self.pool is None else self.pool.embed_faces,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE * max(processes, 1),
+            max_wait_ms=settings.INFERENCE_MAX_WAIT_MS
+        )
+        # Avec le pool : images entières des requêtes concurrentes, réparties en un lot par processus
+        self.image_batcher = None if self.pool is None else BatchScheduler(
+            self.pool.embed,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE * processes,
+            max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+            name="inference-pool-batcher"
+        )
+        
+        # Embeddings par contenu d'image, décisions de recherche par embedding (vidées à chaque mutation de l'index)
+        self.embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_TTL_S)
+        self.result_cache = LRUCache(settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_TTL_S)
+        
+        # Initialiser FAISS index (snapshots atomiques + journal des mutations), partagé
+        # par tous les processus : les écritures sont sérialisées par un verrou de fichier
         os.makedirs(settings.MODELS_DIR, exist_ok=True)
+        self._index_dir = Path(settings.MODELS_DIR)
+        self._file_lock = IndexFileLock(self._index_dir / IndexStore.LOCK_NAME)
+        self.gallery: Optional[Gallery] = None
         
-        self.index = None
-        self.metadata = {}  # {index_id: employee_id}
+        # Le service est partagé entre les requêtes : l'index est protégé par un verrou
+        self._lock = threading.RLock()
+        self.ready = False
+        self._stop_watcher = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._unreachable_version: Optional[Tuple[int, int]] = None  # Version publiée absente du disque local
         self.load_index()
     
-    def detect_face(self, image_path: str) -> Optional[np.ndarray]:
+    def warmup(self):
         """
-        Détecter et aligner un visage dans une image
+        Exécuter une inférence à blanc pour que la première vraie requête ne soit pas lente
         """
         try:
-            img = Image.open(image_path).convert('RGB')
+            dummy = Image.fromarray(np.zeros((160, 160, 3), dtype=np.uint8))
+            self.mtcnn.detect(dummy, landmarks=False)
             
-            # Détecter le visage avec MTCNN
-            boxes, probs = self.mtcnn.detect(img, landmarks=False)
+            embedding = self.batcher.submit(torch.zeros(3, 160, 160)).result()
+            self.search_in_index(embedding)
             
-            if boxes is None or len(boxes) == 0:
+            if self.pool is not None:
+                self.pool.warmup()
+        except Exception as e:
+            print(f"Error during warm-up: {e}")
+        
+        self.ready = True
+    
+    def close(self):
+        """
+        Arrêter le scheduler d'inférence
+        """
+        self.ready = False
+        self._stop_watcher.set()
+        self.batcher.stop()
+        if self.pool is not None:
+            self.image_batcher.stop()
+            self.pool.shutdown()
+        
+        # Compacter le journal avant l'arrêt
+        with self._file_lock.exclusive():
+            with self._lock:
+                self._catch_up()
+                if self.store.wal_records:
+                    self.save_index()
+    
+    # L'état de l'index est porté par la galerie courante, remplacée d'un bloc au rechargement
+    @property
+    def store(self) -> IndexStore:
+        return self.gallery.store
+    
+    @property
+    def index(self) -> Optional[faiss.Index]:
+        return self.gallery.index
+    
+    @property
+    def id_map(self) -> IdMap:
+        return self.gallery.id_map
+    
+    @property
+    def centroids(self) -> Optional[CentroidIndex]:
+        return self.gallery.centroids
+    
+    @property
+    def needs_rebuild(self) -> bool:
+        return self.gallery.needs_rebuild
+    
+    def load_image(self, image: ImageInput) -> Image.Image:
+        """
+        Décoder une image en mémoire (octets, ndarray RGB, PIL) ou depuis le disque
+        """
+        if isinstance(image, Image.Image):
+            return image.convert('RGB')
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return Image.open(io.BytesIO(image)).convert('RGB')
+        if isinstance(image, np.ndarray):
+            return Image.fromarray(image.astype(np.uint8, copy=False)).convert('RGB')
+        return Image.open(image).convert('RGB')
+    
+    def detection_scale(self, width: int, height: int) -> float:
+        """
+        Facteur de réduction pour la détection : aucune réduction tant que le plus grand
+        côté ne dépasse pas DETECTION_MAX_SIZE ; au-delà, réduction vers cette taille,
+        bornée pour que le plus petit visage attendu (DETECTION_MIN_FACE_SIZE dans l'image
+        d'origine) mesure encore DETECTION_TARGET_FACE_SIZE pixels dans l'image réduite
+        """
+        limit = settings.DETECTION_MIN_FACE_SIZE / max(settings.DETECTION_TARGET_FACE_SIZE, 1)
+        excess = max(width, height) / max(settings.DETECTION_MAX_SIZE, 1)
+        return max(1.0, min(limit, excess))
+    
+    def load_for_detection(self, image: ImageInput) -> Tuple[Image.Image, float, Callable[[], Image.Image]]:
+        """
+        Décoder une image à la résolution de détection.
+        
+        Les JPEG trop grands sont décodés directement réduits (mise à l'échelle DCT 1/2,
+        1/4 ou 1/8 de libjpeg via Image.draft) : une image 4K n'est jamais décompressée
+        en pleine résolution pour la seule détection. Retourne l'image réduite, le facteur
+        original / réduit et une fonction qui fournit les pixels d'origine (décodés une
+        seule fois, à la demande).
+        """
+        if isinstance(image, (Image.Image, np.ndarray)):
+            # Déjà décodée : seule la détection travaille sur une copie réduite
+            original = self.load_image(image)
+            full_width, full_height = original.size
+            scale = self.detection_scale(full_width, full_height)
+            img = original
+        else:
+            source = io.BytesIO(image) if isinstance(image, (bytes, bytearray, memoryview)) else image
+            img = Image.open(source)
+            full_width, full_height = img.size
+            scale = self.detection_scale(full_width, full_height)
+            if scale > 1 and img.format == 'JPEG':
+                # draft() choisit la plus forte réduction DCT qui reste >= la taille demandée
+                img.draft('RGB', (int(full_width / scale), int(full_height / scale)))
+            img = img.convert('RGB')
+            # Image décodée en pleine résolution : c'est déjà l'original
+            original = img if img.size == (full_width, full_height) else None
+        
+        # Compléter la réduction (le DCT ne réduit que par puissances de 2)
+        target = (max(1, round(full_width / scale)), max(1, round(full_height / scale)))
+        if img.width > target[0] * 1.1:
+            img = img.resize(target, Image.BILINEAR)
+        
+        def load_original() -> Image.Image:
+            nonlocal original
+            if original is None:
+                original = self.load_image(image)
+            return original
+        
+        return img, full_width / img.width, load_original
+    
+    def detect_faces(self, image: ImageInput) -> Optional[FrameFaces]:
+        """
+        Détecter tous les visages d'une image sans les recadrer.
+        
+        La pyramide MTCNN ne tourne qu'une fois, sur l'image réduite à la résolution de
+        détection ; les boîtes sont ramenées dans les coordonnées de l'image d'origine.
+        Retourne None si aucun visage n'est trouvé.
+        """
+        img, scale, load_original = self.load_for_detection(image)
+        
+        # Détecter les visages (boîtes, probabilités et points de repère) avec MTCNN
+        boxes, probs, landmarks = self.mtcnn.detect(img, landmarks=True)
+        
+        if boxes is None or len(boxes) == 0:
+            return None
+        
+        return FrameFaces(
+            image=img,
+            scale=scale,
+            load_original=load_original,
+            boxes=np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * scale,
+            probs=np.asarray(probs, dtype=np.float32).reshape(-1),
+            landmarks=None if landmarks is None else np.asarray(landmarks, dtype=np.float32) * scale
+        )
+    
+    def align_face(self, frame: FrameFaces, box: np.ndarray) -> torch.Tensor:
+        """
+        Recadrer un visage détecté (boîte en coordonnées d'origine) en tenseur FaceNet,
+        toujours dans les pixels d'origine : l'embedding ne dépend pas de la réduction
+        appliquée pour la détection
+        """
+        return self._align(frame.load_original(), box)
+    
+    def detect_face(self, image: ImageInput) -> Optional[DetectedFace]:
+        """
+        Détecter, aligner et normaliser le visage principal d'une image.
+        
+        Le recadrage est converti directement en tenseur normalisé prêt pour FaceNet,
+        sans aller-retour tenseur / ndarray.
+        """
+        try:
+            frame = self.detect_faces(image)
+            if frame is None:
                 return None
             
             # Prendre le visage avec la plus haute probabilité
-            best_idx = np.argmax(probs)
-            box = boxes[best_idx]
-            
-            # S'assurer que box est un array 1D avec 4 éléments [x1, y1, x2, y2]
-            box = np.array(box, dtype=np.float32).flatten()
-            if len(box) != 4:
-                return None
+            best_idx = int(np.argmax(frame.probs))
             
-            # Extraire et aligner le visage - extract attend un array de shape (N, 4)
-            # où N est le nombre de visages
-            box_array = box.reshape(1, 4)
-            face = self.mtcnn.extract(img, box_array, save_path=None)
-            
-            if face is None:
-                return None
-            
-            # Convertir en numpy array si c'est un tensor
-            if torch.is_tensor(face):
-                face = face.cpu().numpy()
-            
-            # extract retourne un tensor/array de shape (N, C, H, W) où N=1
-            # On veut retourner (C, H, W) donc on prend le premier élément
-            if isinstance(face, np.ndarray):
-                if face.ndim == 4:  # (1, C, H, W)
-                    face = face[0]  # (C, H, W)
-                elif face.ndim == 3:  # (C, H, W) déjà bon
-                    pass
-                else:
-                    return None
-            
-            return face
+            return DetectedFace(
+                tensor=self.align_face(frame, frame.boxes[best_idx]),
+                box=frame.boxes[best_idx],
+                landmarks=None if frame.landmarks is None else frame.landmarks[best_idx],
+                probability=float(frame.probs[best_idx]),
+                boxes=frame.boxes
+            )
         
         except Exception as e:
             print(f"Error detecting face: {e}")
@@ -96,127 +304,673 @@ class FaceRecognitionService:
             traceback.print_exc()
             return None
     
-    def get_embedding(self, image_path: str) -> Optional[np.ndarray]:
+    def _align(self, img: Image.Image, box: np.ndarray) -> torch.Tensor:
+        """
+        Recadrer la boîte, la redimensionner en 160x160 et la normaliser pour FaceNet
+        """
+        width, height = img.size
+        crop_box = (
+            int(max(box[0], 0)),
+            int(max(box[1], 0)),
+            int(min(box[2], width)),
+            int(min(box[3], height))
+        )
+        size = self.mtcnn.image_size
+        face = img.crop(crop_box).resize((size, size), Image.BILINEAR)
+        
+        # Une seule copie : uint8 HWC -> float32 CHW, normalisée en place
+        face_tensor = torch.from_numpy(np.asarray(face)).permute(2, 0, 1).float()
+        return face_tensor.sub_(127.5).div_(128.0)
+    
+    def _cache_source(self, image: ImageInput) -> Optional[bytes]:
         """
-        Extraire l'embedding facial d'une image
+        Contenu brut servant de clé de cache (None pour les images déjà décodées)
         """
-        face = self.detect_face(image_path)
-        if face is None:
+        if not self.embedding_cache.enabled:
             return None
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return bytes(image)
+        if isinstance(image, (str, Path)):
+            try:
+                return Path(image).read_bytes()
+            except OSError:
+                return None
+        return None
+    
+    def get_embedding(self, image: ImageInput) -> Optional[np.ndarray]:
+        """
+        Extraire l'embedding facial d'une image (servi par le cache si la même image
+        a déjà été vue)
+        """
+        contents = self._cache_source(image)
+        if contents is not None:
+            cached, key = self.embedding_cache.lookup(contents)
+            if cached is not MISSING:
+                return cached
+            image = contents
         
-        try:
-            # Normaliser l'image
-            face_tensor = torch.FloatTensor(face).unsqueeze(0).to(self.device)
-            face_tensor = (face_tensor - 127.5) / 128.0
-            
-            # Générer l'embedding
-            with torch.no_grad():
-                embedding = self.resnet(face_tensor)
-            
-            # Normaliser l'embedding
-            embedding = embedding.cpu().numpy()
-            embedding = embedding / np.linalg.norm(embedding)
+        if self.pool is not None:
+            try:
+                # L'image rejoint le prochain lot réparti entre les processus du pool
+                embedding = self.image_batcher.submit(image).result()
+            except Exception as e:
+                print(f"Error in inference worker pool: {e}")
+                return None
+        else:
+            face = self.detect_face(image)
+            if face is None:
+                embedding = None
+            else:
+                try:
+                    # Le visage rejoint le prochain lot du scheduler
+                    embedding = self.batcher.submit(face.tensor).result()
+                except Exception as e:
+                    print(f"Error generating embedding: {e}")
+                    return None
+        
+        if contents is not None:
+            self.embedding_cache.store(key, embedding)
+        return embedding
+    
+    def embed_faces(self, faces: List[torch.Tensor]) -> np.ndarray:
+        """
+        Générer les embeddings d'un lot de visages alignés et normalisés (C, H, W) en un seul passage
+        """
+        face_tensor = torch.stack(faces).to(self.device)
+        
+        # Générer les embeddings
+        with torch.no_grad():
+            embeddings = self.resnet(face_tensor)
+        
+        # Normaliser chaque embedding
+        embeddings = embeddings.cpu().numpy()
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        
+        return embeddings
+    
+    def get_embeddings(self, images: List[ImageInput]) -> List[Optional[np.ndarray]]:
+        """
+        Extraire les embeddings de plusieurs images : les images absentes du cache sont
+        calculées en un lot, réparti entre les processus du pool d'inférence s'il existe
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(images)
+        to_compute = {}  # Indice -> image à calculer
+        pending = {}  # Indice -> clé de cache des images à calculer
+        
+        for i, image in enumerate(images):
+            contents = self._cache_source(image)
+            if contents is not None:
+                cached, key = self.embedding_cache.lookup(contents)
+                if cached is not MISSING:
+                    results[i] = cached
+                    continue
+                pending[i] = key
+                image = contents
+            to_compute[i] = image
+        
+        if to_compute:
+            try:
+                if self.pool is not None:
+                    embeddings = self.pool.embed(list(to_compute.values()))
+                else:
+                    embeddings = self.compute_embeddings(list(to_compute.values()))
+            except Exception as e:
+                print(f"Error generating embeddings: {e}")
+                return results
             
-            return embedding[0]
+            for i, embedding in zip(to_compute, embeddings):
+                results[i] = embedding
         
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            return None
+        for i, key in pending.items():
+            self.embedding_cache.store(key, results[i])
+        return results
     
-    def load_index(self):
+    def compute_embeddings(self, images: List[ImageInput]) -> List[Optional[np.ndarray]]:
         """
-        Charger l'index FAISS depuis le disque
+        Détection image par image puis un seul passage FaceNet pour tous les visages
+        trouvés (sans cache ; exécuté aussi dans les processus du pool d'inférence)
+        """
+        faces = [self.detect_face(image) for image in images]
+        found = [i for i, face in enumerate(faces) if face is not None]
+        
+        results: List[Optional[np.ndarray]] = [None] * len(images)
+        if found:
+            embeddings = self.embed_faces([faces[i].tensor for i in found])
+            for i, embedding in zip(found, embeddings):
+                results[i] = embedding
+        return results
+    
+    def analyze_photos(self, images: List[ImageInput]) -> List[PhotoFaces]:
         """
-        if self.index_path.exists() and self.metadata_path.exists():
+        Photos d'enrôlement : embedding du visage principal et nombre de visages de chaque
+        photo, calculés en un lot (réparti entre les processus du pool d'inférence s'il existe)
+        """
+        if not images:
+            return []
+        if self.pool is not None:
+            return self.pool.analyze(images)
+        return self.compute_photo_faces(images)
+    
+    def compute_photo_faces(self, images: List[ImageInput]) -> List[PhotoFaces]:
+        """
+        Détection de chaque photo puis un seul passage FaceNet pour tous les visages principaux
+        """
+        detections = []
+        for image in images:
             try:
-                self.index = faiss.read_index(str(self.index_path))
-                with open(self.metadata_path, 'rb') as f:
-                    self.metadata = pickle.load(f)
+                detections.append(self.detect_faces(image))
             except Exception as e:
-                print(f"Error loading index: {e}")
-                self._create_new_index()
-        else:
-            self._create_new_index()
+                detections.append(e)
+        return self.embed_photo_faces(detections)
     
-    def _create_new_index(self):
+    def embed_photo_faces(self, detections: List[Union[FrameFaces, Exception, None]]) -> List[PhotoFaces]:
         """
-        Créer un nouvel index FAISS vide
+        Un seul passage FaceNet pour le visage principal de chaque détection
+        (exception = image illisible, None = aucun visage)
         """
-        # Créer un index L2 (distance euclidienne)
-        dimension = settings.EMBEDDING_SIZE
-        self.index = faiss.IndexFlatL2(dimension)
-        self.metadata = {}
+        results: List[PhotoFaces] = [PhotoFaces(None, 0)] * len(detections)
+        frames = {}
+        for i, detection in enumerate(detections):
+            if isinstance(detection, Exception):
+                results[i] = PhotoFaces(None, 0, str(detection))
+            elif detection is not None:
+                frames[i] = detection
+        
+        if frames:
+            faces = []
+            for frame in frames.values():
+                faces.append(self.align_face(frame, frame.boxes[int(np.argmax(frame.probs))]))
+            embeddings = self.embed_faces(faces)
+            for (i, frame), embedding in zip(frames.items(), embeddings):
+                face_count = int((frame.probs >= settings.PHOTO_MIN_FACE_PROBABILITY).sum())
+                results[i] = PhotoFaces(embedding, max(face_count, 1))
+        return results
     
-    def save_index(self):
+    def _new_store(self) -> IndexStore:
+        return IndexStore(self._index_dir, fsync=settings.INDEX_WAL_FSYNC, embedding_version=EMBEDDING_VERSION)
+    
+    def load_index(self):
+        """
+        Charger le dernier snapshot de l'index FAISS puis rejouer le journal des mutations
+        """
+        with self._file_lock.exclusive():
+            gallery = Gallery.load(self._new_store(), truncate=True)
+        with self._lock:
+            self._swap(gallery)
+    
+    def _swap(self, gallery: Gallery):
+        self.gallery = gallery
+        self._index_changed()
+    
+    def reload_index(self) -> bool:
         """
-        Sauvegarder l'index FAISS sur le disque
+        Charger en arrière-plan la version publiée par un autre processus, puis l'échanger
+        d'un coup : les recherches continuent sur l'ancienne galerie pendant le chargement
         """
+        with self._file_lock.shared():
+            gallery = Gallery.load(self._new_store(), truncate=False)
+        
+        with self._lock:
+            # Une mutation locale a pu avancer la galerie pendant le chargement
+            if gallery.version <= self.gallery.version:
+                return False
+            self._swap(gallery)
+        print(f"Index reloaded at version {gallery.version}")
+        return True
+    
+    def _catch_up(self):
+        """
+        Avant d'écrire (verrou de fichier exclusif détenu) : recharger les mutations
+        écrites par d'autres processus pour ne jamais journaliser ni compacter un état périmé
+        """
+        if self.store.disk_version() != self.gallery.version:
+            self._swap(Gallery.load(self._new_store(), truncate=True))
+    
+    def publish_version(self):
+        """
+        Publier la version courante en base pour les autres processus et nœuds
+        """
+        generation, wal_size = self.gallery.version
+        db = SessionLocal()
         try:
-            faiss.write_index(self.index, str(self.index_path))
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
+            db.merge(IndexState(id=1, generation=generation, wal_size=wal_size, updated_at=datetime.utcnow()))
+            db.commit()
         except Exception as e:
-            print(f"Error saving index: {e}")
+            print(f"Error publishing index version: {e}")
+        finally:
+            db.close()
+    
+    def _published_version(self) -> Optional[Tuple[int, int]]:
+        db = SessionLocal()
+        try:
+            state = db.query(IndexState).filter(IndexState.id == 1).first()
+            return (state.generation, state.wal_size) if state else None
+        except Exception as e:
+            print(f"Error reading index version: {e}")
+            return None
+        finally:
+            db.close()
+    
+    def start_watcher(self):
+        """
+        Surveiller la version publiée (base de données et répertoire de l'index)
+        et recharger la galerie quand un autre processus l'a modifiée
+        """
+        if settings.INDEX_RELOAD_INTERVAL_S <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+    
+    def _watch(self):
+        while not self._stop_watcher.wait(settings.INDEX_RELOAD_INTERVAL_S):
+            try:
+                # Seul le disque peut fournir une version plus récente : la version publiée
+                # en base n'est qu'un signal (une version absente du disque local, répertoire
+                # effacé ou volume propre à chaque nœud, ne doit pas relancer un chargement)
+                if self.store.disk_version() > self.gallery.version:
+                    self.reload_index()
+                    continue
+                published = self._published_version()
+                if published is not None and published > self.gallery.version \
+                        and published != self._unreachable_version:
+                    print(f"Index version {published} published but not found in {self._index_dir}")
+                    self._unreachable_version = published
+            except Exception as e:
+                print(f"Error reloading index: {e}")
+    
+    def save_index(self):
+        """
+        Sauvegarder un snapshot compact de l'index FAISS (le journal repart à zéro)
+        """
+        with self._file_lock.exclusive():
+            with self._lock:
+                try:
+                    self.gallery.snapshot()
+                except Exception as e:
+                    print(f"Error saving index: {e}")
+    
+    def _maybe_snapshot(self):
+        """
+        Compacter le journal dans un snapshot lorsqu'il devient long ou ancien
+        """
+        if self.gallery.snapshot_due():
+            self.save_index()
+    
+    def _index_changed(self):
+        """
+        Toute mutation de la galerie invalide les décisions en cache (appelé sous le verrou)
+        """
+        self.result_cache.clear()
+    
+    def add_to_index(self, employee_id: int, embedding: np.ndarray, photo_id: int):
+        """
+        Ajouter l'embedding d'une photo à l'index FAISS
+        """
+        self.add_photos([photo_id], [employee_id], embedding.reshape(1, -1))
     
-    def add_to_index(self, employee_id: int, embedding: np.ndarray):
+    def add_photos(self, photo_ids: List[int], employee_ids: List[int], embeddings: np.ndarray, publish: bool = True):
         """
-        Ajouter un embedding à l'index FAISS
+        Ajouter (ou remplacer) les embeddings de plusieurs photos en un seul appel.
+        publish=False : l'appelant publie la version (publish_version) après avoir validé
+        sa transaction, qui peut verrouiller la table de version (SQLite)
         """
-        if self.index is None:
-            self._create_new_index()
+        if len(photo_ids) == 0:
+            return
         
-        # Ajouter l'embedding à l'index
-        index_id = self.index.ntotal
-        embedding = embedding.reshape(1, -1).astype('float32')
-        self.index.add(embedding)
+        ids = np.asarray(photo_ids, dtype=np.int64)
+        employee_ids = np.asarray(employee_ids, dtype=np.int64)
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32').reshape(len(ids), -1)
         
-        # Sauvegarder le mapping
-        self.metadata[index_id] = employee_id
-        self.save_index()
+        with self._file_lock.exclusive():
+            with self._lock:
+                self._catch_up()
+                
+                # Journaliser avant d'appliquer en mémoire
+                self.store.append(OP_ADD, ids, employee_ids, embeddings)
+                self._index_changed()
+                self.gallery.apply_add(ids, employee_ids, embeddings)
+                self._maybe_snapshot()
+            if publish:
+                self.publish_version()
+    
+    def remove_photos(self, photo_ids: List[int]) -> int:
+        """
+        Retirer des photos de l'index (coût proportionnel aux photos concernées)
+        """
+        if len(photo_ids) == 0:
+            return 0
+        
+        ids = np.asarray(photo_ids, dtype=np.int64)
+        
+        with self._file_lock.exclusive():
+            with self._lock:
+                self._catch_up()
+                
+                self.store.append(OP_REMOVE, ids)
+                self._index_changed()
+                removed = self.gallery.apply_remove(ids)
+                self._maybe_snapshot()
+            self.publish_version()
+        
+        return removed
+    
+    def remove_employee(self, employee_id: int) -> int:
+        """
+        Retirer toutes les photos d'un employé de l'index
+        """
+        with self._file_lock.exclusive():
+            with self._lock:
+                self._catch_up()
+                photo_ids = self.id_map.photos_of(employee_id)
+            return self.remove_photos(photo_ids)
     
-    def search_in_index(self, embedding: np.ndarray, k: int = 1) -> Optional[Dict]:
+    def add_employee(self, db: Session, employee_id: int) -> int:
+        """
+        (Ré)ajouter les photos d'un employé à partir des embeddings stockés
+        """
+        photos = (
+            db.query(EmployeePhoto)
+            .filter(EmployeePhoto.employee_id == employee_id)
+            .order_by(EmployeePhoto.id)
+            .all()
+        )
+        self.refresh_embeddings(db, photos)
+        
+        photos = [
+            photo for photo in photos
+            if photo.embedding is not None and photo.embedding_version == EMBEDDING_VERSION
+        ]
+        if photos:
+            self.add_photos(
+                [photo.id for photo in photos],
+                [photo.employee_id for photo in photos],
+                embeddings_from_bytes([photo.embedding for photo in photos])
+            )
+        return len(photos)
+    
+    def search_in_index(self, embedding: np.ndarray, k: Optional[int] = None) -> Optional[Dict]:
         """
         Rechercher le visage le plus proche dans l'index
         """
-        if self.index is None or self.index.ntotal == 0:
-            return None
+        return self.search_batch(embedding.reshape(1, -1), k)[0]
+    
+    def search_batch(self, embeddings: np.ndarray, k: Optional[int] = None) -> List[Optional[Dict]]:
+        """
+        Identifier l'employé le plus proche pour chaque ligne de la matrice d'embeddings.
+        
+        - stratégie "nearest" : un seul index.search sur les k photos les plus proches,
+          puis agrégation des distances par employé ;
+        - stratégie "centroid" : recherche des CENTROID_CANDIDATES employés les plus proches
+          parmi les centroïdes, puis re-classement sur les photos de ces seuls employés.
+        
+        'distance' est la distance agrégée (moyenne des AGGREGATE_TOP_PHOTOS meilleures
+        photos de l'employé), 'photo_distance' celle de la photo la plus proche.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32').reshape(-1, settings.EMBEDDING_SIZE)
+        k = settings.SEARCH_TOP_K if k is None else k
+        
+        with self._lock:
+            if self.index is None or self.index.ntotal == 0 or len(embeddings) == 0:
+                return [None] * len(embeddings)
+            
+            # Le cache est vidé sous ce même verrou à chaque mutation : une décision
+            # servie depuis le cache correspond toujours à l'index courant
+            keys = [(hashlib.sha256(row.tobytes()).digest(), k) for row in embeddings]
+            results = [self.result_cache.get(key) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is MISSING]
+            if not missing:
+                return [dict(result) if result else result for result in results]
+            queries = embeddings[missing]
+            
+            if self.centroids is not None and self.centroids.ntotal > 0:
+                found = self._search_by_centroids(queries)
+            else:
+                distances, indices = self.index.search(queries, max(1, k))
+                
+                found = []
+                for row_distances, row_indices in zip(distances, indices):
+                    valid = row_indices >= 0
+                    found.append(self._aggregate(
+                        row_indices[valid],
+                        self.id_map.lookup(row_indices[valid]),
+                        row_distances[valid]
+                    ))
+            
+            for i, result in zip(missing, found):
+                self.result_cache.put(keys[i], result)
+                results[i] = result
         
-        embedding = embedding.reshape(1, -1).astype('float32')
-        distances, indices = self.index.search(embedding, k)
+        return [dict(result) if result else result for result in results]
+    
+    def _search_by_centroids(self, embeddings: np.ndarray) -> List[Optional[Dict]]:
+        _, candidates = self.centroids.search(embeddings, settings.CENTROID_CANDIDATES)
         
-        if len(indices[0]) == 0:
+        results = []
+        for embedding, row_candidates in zip(embeddings, candidates):
+            row_candidates = row_candidates[row_candidates >= 0]
+            photo_ids = [self.id_map.photos_of(employee_id) for employee_id in row_candidates.tolist()]
+            photo_ids = np.concatenate(photo_ids) if photo_ids else np.empty(0, dtype=np.int64)
+            if len(photo_ids) == 0:
+                results.append(None)
+                continue
+            
+            # Re-classement exact sur les photos des employés candidats uniquement
+            vectors = self.index.reconstruct_batch(np.ascontiguousarray(photo_ids, dtype=np.int64))
+            photo_distances = ((vectors - embedding) ** 2).sum(axis=1)
+            results.append(self._aggregate(photo_ids, self.id_map.lookup(photo_ids), photo_distances))
+        
+        return results
+    
+    def _aggregate(self, photo_ids: np.ndarray, employee_ids: np.ndarray, distances: np.ndarray) -> Optional[Dict]:
+        """
+        Regrouper les photos candidates par employé et retenir le meilleur score agrégé.
+        Un employé avec moins de AGGREGATE_TOP_PHOTOS candidates est complété par la pire
+        distance des candidates : sinon sa seule meilleure photo l'avantagerait face à la
+        moyenne de plusieurs photos d'un employé mieux enrôlé
+        """
+        if len(photo_ids) == 0:
             return None
         
-        idx = indices[0][0]
-        distance = float(distances[0][0])
-        employee_id = self.metadata.get(idx)
+        top_photos = max(1, settings.AGGREGATE_TOP_PHOTOS)
+        padding = float(distances.max())
+        best = None
+        for employee_id in np.unique(employee_ids).tolist():
+            mask = employee_ids == employee_id
+            employee_distances = distances[mask]
+            order = np.argsort(employee_distances)
+            top = employee_distances[order[:top_photos]]
+            aggregated = float((top.sum() + padding * (top_photos - len(top))) / top_photos)
+            
+            if best is None or aggregated < best['distance']:
+                photo_id = int(photo_ids[mask][order[0]])
+                best = {
+                    'employee_id': employee_id if employee_id >= 0 else None,
+                    'distance': aggregated,
+                    'photo_distance': float(employee_distances[order[0]]),
+                    'index': photo_id,
+                    'photo_id': photo_id
+                }
         
+        return best
+    
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Compteurs des caches d'embeddings et de décisions
+        """
         return {
-            'employee_id': employee_id,
-            'distance': distance,
-            'index': idx
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
         }
     
-    def rebuild_index(self, db: Session):
+    def refresh_embeddings(self, db: Session, photos: List[EmployeePhoto], chunk_size: int = 64) -> int:
         """
-        Reconstruire l'index FAISS à partir de la base de données
+        Calculer et stocker l'embedding des photos dont l'embedding est absent ou périmé
         """
-        self._create_new_index()
+        stale = [
+            photo for photo in photos
+            if (photo.embedding is None or photo.embedding_version != EMBEDDING_VERSION)
+            and os.path.exists(photo.photo_path)
+        ]
         
-        # Récupérer tous les employés actifs
-        employees = db.query(Employee).filter(Employee.is_active == True).all()
+        for start in range(0, len(stale), chunk_size):
+            chunk = stale[start:start + chunk_size]
+            embeddings = self.get_embeddings([photo.photo_path for photo in chunk])
+            for photo, embedding in zip(chunk, embeddings):
+                if embedding is not None:
+                    photo.embedding = embedding_to_bytes(embedding)
+                    photo.embedding_version = EMBEDDING_VERSION
+            db.commit()
         
-        for employee in employees:
-            # Récupérer les photos de l'employé
-            photos = db.query(EmployeePhoto).filter(
-                EmployeePhoto.employee_id == employee.id
-            ).all()
-            
-            for photo in photos:
-                if os.path.exists(photo.photo_path):
-                    embedding = self.get_embedding(photo.photo_path)
-                    if embedding is not None:
-                        self.add_to_index(employee.id, embedding)
+        return len(stale)
+    
+    def rebuild_index(self, db: Session):
+        """
+        Reconstruire l'index FAISS à partir des embeddings stockés en base,
+        en ne recalculant que les embeddings manquants ou périmés
+        """
+        # Le CNN ne tourne que pour les photos sans embedding à jour (hors verrou)
+        self.refresh_embeddings(db, self._active_photos(db))
         
-        self.save_index()
+        with self._file_lock.exclusive():
+            # Photos relues sous le verrou : aucune mutation ne peut être journalisée
+            # entre cette lecture et la bascule vers la nouvelle génération
+            photos = [
+                photo for photo in self._active_photos(db)
+                if photo.embedding is not None and photo.embedding_version == EMBEDDING_VERSION
+            ]
+            
+            # Entraînement et ajout vectorisé depuis les embeddings stockés
+            vectors = embeddings_from_bytes([photo.embedding for photo in photos])
+            ids = np.array([photo.id for photo in photos], dtype=np.int64)
+            employee_ids = np.array([photo.employee_id for photo in photos], dtype=np.int64)
+            gallery = Gallery.from_vectors(self._new_store(), vectors, ids, employee_ids)
+            self._replay_uncommitted(gallery, ids)
+            
+            # Le nouveau snapshot succède à la dernière génération écrite, quel que soit l'écrivain
+            gallery.store.generation = gallery.store.read_manifest_generation() or 0
+            
+            with self._lock:
+                self._swap(gallery)
+                self.save_index()
+            self.publish_version()
+    
+    def _active_photos(self, db: Session) -> List[EmployeePhoto]:
+        # Récupérer les photos de tous les employés actifs
+        return (
+            db.query(EmployeePhoto)
+            .join(Employee, Employee.id == EmployeePhoto.employee_id)
+            .filter(Employee.is_active == True)
+            .order_by(EmployeePhoto.id)
+            .all()
+        )
+    
+    def _replay_uncommitted(self, gallery: Gallery, known_ids: np.ndarray):
+        """
+        Rejouer les mutations du journal courant portant sur des photos absentes de la base :
+        upload_photos indexe ses vecteurs avant de valider sa transaction, ces photos
+        seraient perdues avec l'ancienne génération (verrou de fichier exclusif détenu)
+        """
+        current = self._new_store()
+        manifest = current.read_manifest()
+        # Sans manifest, le journal de la génération 0 a été écrit par ce pipeline
+        if manifest is not None:
+            if manifest.get("embedding_version", "") != EMBEDDING_VERSION:
+                return
+            current.generation = int(manifest["generation"])
+        for record in current.read_wal(truncate=False):
+            pending = ~np.isin(record.photo_ids, known_ids)
+            if not pending.any():
+                continue
+            if record.op == OP_ADD:
+                gallery.apply_add(record.photo_ids[pending], record.employee_ids[pending], record.embeddings[pending])
+            else:
+                gallery.apply_remove(record.photo_ids[pending])
+
+
+def embedding_to_bytes(embedding: np.ndarray) -> bytes:
+    """
+    Sérialiser un embedding en float32 pour la colonne EmployeePhoto.embedding
+    """
+    return np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes()
+
+def embeddings_from_bytes(blobs: List[bytes]) -> np.ndarray:
+    """
+    Reconstituer une matrice (N, EMBEDDING_SIZE) float32 à partir des embeddings stockés
+    """
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, settings.EMBEDDING_SIZE)
+
+# Instance unique partagée par tout le processus (chargée au démarrage dans lifespan)
+_face_service: Optional[FaceRecognitionService] = None
+_face_service_error: Optional[str] = None  # Échec du dernier chargement
+_face_service_lock = threading.Lock()
+
+def init_face_service() -> FaceRecognitionService:
+    """
+    Créer le service partagé (modèles + index) et le préchauffer, une seule fois par processus
+    """
+    global _face_service, _face_service_error
+    with _face_service_lock:
+        if _face_service is None:
+            try:
+                configure_torch_threads()
+                service = FaceRecognitionService()
+            except Exception as e:
+                # Modèles ou index illisibles : signalé par /health/ready et get_face_service
+                _face_service_error = str(e) or type(e).__name__
+                print(f"Error loading face recognition service: {_face_service_error}")
+                raise
+            if service.needs_rebuild:
+                db = SessionLocal()
+                try:
+                    service.rebuild_index(db)
+                except Exception as e:
+                    print(f"Error rebuilding index: {e}")
+                finally:
+                    db.close()
+            service.warmup()
+            service.start_watcher()
+            _face_service = service
+            _face_service_error = None
+    return _face_service
+
+def get_face_service() -> FaceRecognitionService:
+    """
+    Dépendance FastAPI : retourne le service partagé, ou 503 tant que le chargement
+    (lancé au démarrage) n'est pas terminé. Attendre ici bloquerait un thread du pool
+    AnyIO, partagé avec toutes les routes synchrones. Après un échec du chargement,
+    le 503 le signale, sans Retry-After.
+    """
+    if _face_service is None and _face_service_error is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Face recognition service failed to load: {_face_service_error}"
+        )
+    if not is_face_service_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Face recognition service is loading",
+            headers={"Retry-After": "5"}
+        )
+    return _face_service
+
+def shutdown_face_service():
+    """
+    Libérer le service partagé à l'arrêt de l'application
+    """
+    global _face_service
+    with _face_service_lock:
+        if _face_service is not None:
+            _face_service.close()
+            _face_service = None
+
+def is_face_service_ready() -> bool:
+    """
+    Sonde de disponibilité : modèles chargés, index chargé et warm-up terminé
+    """
+    return _face_service is not None and _face_service.ready
 
+def face_service_error() -> Optional[str]:
+    """
+    Erreur du chargement du service partagé (None s'il est chargé ou en cours de chargement)
+    """
+    return None if _face_service is not None else _face_service_error
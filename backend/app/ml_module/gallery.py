@@ -0,0 +1,190 @@
+"""
+Gallery
+État en mémoire de la galerie (index FAISS, mapping photo -> employé, centroïdes)
+correspondant à une version du répertoire de persistance
+"""
+import time
+import numpy as np
+import faiss
+from typing import Optional, Tuple
+
+from app.config import settings
+from app.ml_module.index_store import IndexStore, OP_ADD
+from app.ml_module.id_map import IdMap
+from app.ml_module.centroids import CentroidIndex
+from app.ml_module.index_factory import (
+    build_index, index_kind, resolve_index_kind, supports_remove, apply_search_params
+)
+
+class Gallery:
+    """
+    Une galerie est construite entièrement (snapshot + journal) avant d'être publiée :
+    le service peut en charger une nouvelle en arrière-plan et l'échanger d'un coup.
+    Les mutations sont appliquées en place par le service, sous son verrou.
+    """
+
+    def __init__(self, store: IndexStore):
+        self.store = store
+        self.index: Optional[faiss.Index] = None
+        self.id_map = IdMap()  # photo_id -> employee_id
+        self.mmapped = False  # Index mappé en lecture seule depuis le snapshot
+        self.centroids: Optional[CentroidIndex] = None  # Première passe (SEARCH_STRATEGY=centroid)
+        self.needs_rebuild = False  # Index absent, ancien format (positions au lieu des ids de photo) ou embeddings périmés
+        self.last_snapshot = time.monotonic()
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        return self.store.version
+
+    @classmethod
+    def load(cls, store: IndexStore, truncate: bool = True) -> "Gallery":
+        """
+        Charger le dernier snapshot de l'index FAISS puis rejouer le journal des mutations
+        """
+        gallery = cls(store)
+        try:
+            snapshot = store.load_snapshot(mmap=settings.INDEX_MMAP)
+        except Exception as e:
+            print(f"Error loading index: {e}")
+            snapshot = None
+
+        if snapshot is None:
+            # Aucun snapshot : rejouer tout de même le journal de la génération 0 (mutations
+            # écrites avant le premier snapshot) ; la reconstruction depuis la base les conserve
+            gallery.create_empty()
+            gallery.replay_wal(truncate)
+            gallery.needs_rebuild = True
+            return gallery
+
+        gallery.index, gallery.id_map = snapshot
+        gallery.mmapped = settings.INDEX_MMAP
+
+        # Les anciens index sont indexés par position : il faut les reconstruire
+        if index_kind(gallery.index) is None:
+            gallery.create_empty()
+            gallery.needs_rebuild = True
+            return gallery
+
+        gallery.replay_wal(truncate)
+
+        # Vecteurs calculés par une autre version du pipeline d'embedding : recalculer
+        if store.stale_embeddings:
+            gallery.needs_rebuild = True
+
+        # Changer de backend si la taille de la galerie (ou INDEX_TYPE) l'exige
+        if index_kind(gallery.index) != resolve_index_kind(settings.INDEX_TYPE, gallery.index.ntotal):
+            gallery.needs_rebuild = True
+        apply_search_params(gallery.index)
+        gallery.build_centroids()
+        return gallery
+
+    def replay_wal(self, truncate: bool = True) -> bool:
+        """
+        Rejouer le journal des mutations de la génération courante (needs_rebuild en cas d'échec)
+        """
+        try:
+            for record in self.store.read_wal(truncate=truncate):
+                if record.op == OP_ADD:
+                    self.apply_add(record.photo_ids, record.employee_ids, record.embeddings)
+                else:
+                    self.apply_remove(record.photo_ids)
+        except Exception as e:
+            print(f"Error replaying index log: {e}")
+            self.needs_rebuild = True
+            return False
+        return True
+
+    @classmethod
+    def from_vectors(cls, store: IndexStore, vectors: np.ndarray, ids: np.ndarray, employee_ids: np.ndarray) -> "Gallery":
+        """
+        Construire une galerie complète à partir des embeddings stockés (entraînement et ajout vectorisés)
+        """
+        gallery = cls(store)
+        gallery.index = build_index(settings.INDEX_TYPE, vectors, ids)
+        gallery.id_map = IdMap(ids, employee_ids)
+        gallery.build_centroids()
+        return gallery
+
+    def create_empty(self):
+        """
+        Créer un nouvel index FAISS vide
+        """
+        # Index L2 (distance euclidienne) adressé par EmployeePhoto.id, backend selon INDEX_TYPE
+        self.index = build_index(
+            settings.INDEX_TYPE,
+            np.empty((0, settings.EMBEDDING_SIZE), dtype=np.float32),
+            np.empty(0, dtype=np.int64)
+        )
+        self.id_map = IdMap()
+        self.mmapped = False
+        self.build_centroids()
+
+    def build_centroids(self):
+        """
+        Construire l'index des centroïdes par employé si la stratégie de recherche l'utilise
+        """
+        if settings.SEARCH_STRATEGY != "centroid":
+            self.centroids = None
+            return
+        self.centroids = CentroidIndex(settings.EMBEDDING_SIZE)
+        self.centroids.rebuild(self.index, self.id_map)
+
+    def ensure_writable(self):
+        """
+        Un index mappé est en lecture seule : en faire une copie en mémoire avant la première mutation
+        """
+        if self.mmapped:
+            # Aucune mutation n'a été appliquée depuis le chargement : le snapshot est à jour
+            self.index = self.store.read_snapshot_index()
+            apply_search_params(self.index)
+            self.mmapped = False
+
+    def apply_add(self, photo_ids: np.ndarray, employee_ids, embeddings: np.ndarray):
+        self.ensure_writable()
+        # Éviter les doublons si une photo est déjà présente
+        existing = photo_ids[self.id_map.lookup(photo_ids) >= 0]
+        if len(existing):
+            self.apply_remove(existing)
+        self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype='float32'), photo_ids)
+        self.id_map.set_many(photo_ids, employee_ids)
+
+        if self.centroids is not None:
+            self.centroids.refresh(self.index, self.id_map, employee_ids)
+
+    def apply_remove(self, photo_ids: np.ndarray) -> int:
+        self.ensure_writable()
+        affected_employees = self.id_map.lookup(photo_ids)
+
+        if not supports_remove(self.index):
+            # HNSW ne supporte pas la suppression : reconstruire à partir des vecteurs restants
+            before = self.index.ntotal
+            self.id_map.remove_many(photo_ids)
+            remaining = np.array(self.id_map.photo_ids, dtype=np.int64)
+            vectors = np.empty((0, settings.EMBEDDING_SIZE), dtype=np.float32)
+            if len(remaining):
+                vectors = self.index.reconstruct_batch(remaining)
+            self.index = build_index(index_kind(self.index), vectors, remaining)
+            removed = before - self.index.ntotal
+        else:
+            removed = int(self.index.remove_ids(photo_ids))
+            self.id_map.remove_many(photo_ids)
+
+        if self.centroids is not None:
+            self.centroids.refresh(self.index, self.id_map, affected_employees)
+        return removed
+
+    def snapshot(self):
+        """
+        Écrire un snapshot compact (le journal repart à zéro)
+        """
+        self.store.write_snapshot(self.index, self.id_map)
+        self.last_snapshot = time.monotonic()
+
+    def snapshot_due(self) -> bool:
+        """
+        Le journal est devenu long ou ancien : il faut le compacter dans un snapshot
+        """
+        if self.store.wal_records == 0:
+            return False
+        return (self.store.wal_records >= settings.INDEX_SNAPSHOT_EVERY
+                or time.monotonic() - self.last_snapshot >= settings.INDEX_SNAPSHOT_INTERVAL_S)
@@ -0,0 +1,106 @@
+"""
+Id Map
+Correspondance compacte photo_id -> employee_id stockée dans deux tableaux numpy triés
+"""
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+# Format binaire versionné : en-tête de 16 octets puis photo_ids int64[n] et employee_ids int64[n]
+ID_MAP_MAGIC = b"FRIDMAP1"
+ID_MAP_VERSION = 1
+ID_MAP_HEADER = struct.Struct("<8sII")
+
+class IdMap:
+    """
+    Remplace le dict pickle {photo_id: employee_id} : pas d'overhead par entrée,
+    recherche vectorisée par np.searchsorted et chargement par memory-map
+    """
+
+    def __init__(self, photo_ids: Optional[np.ndarray] = None, employee_ids: Optional[np.ndarray] = None):
+        self.photo_ids = np.empty(0, dtype=np.int64) if photo_ids is None else photo_ids
+        self.employee_ids = np.empty(0, dtype=np.int64) if employee_ids is None else employee_ids
+
+    @classmethod
+    def from_dict(cls, mapping: dict) -> "IdMap":
+        id_map = cls()
+        if mapping:
+            id_map.set_many(
+                np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping)),
+                np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+            )
+        return id_map
+
+    def __len__(self) -> int:
+        return len(self.photo_ids)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.photo_ids.tolist(), self.employee_ids.tolist())
+
+    def get(self, photo_id: int, default: Optional[int] = None) -> Optional[int]:
+        employee_id = int(self.lookup(np.array([photo_id], dtype=np.int64))[0])
+        return default if employee_id < 0 else employee_id
+
+    def lookup(self, photo_ids: np.ndarray) -> np.ndarray:
+        """
+        Employés correspondant à un tableau de photo_ids (-1 si inconnu)
+        """
+        photo_ids = np.asarray(photo_ids, dtype=np.int64)
+        result = np.full(photo_ids.shape, -1, dtype=np.int64)
+        if len(self.photo_ids) == 0:
+            return result
+
+        positions = np.searchsorted(self.photo_ids, photo_ids)
+        positions = np.minimum(positions, len(self.photo_ids) - 1)
+        found = self.photo_ids[positions] == photo_ids
+        result[found] = self.employee_ids[positions[found]]
+        return result
+
+    def photos_of(self, employee_id: int) -> np.ndarray:
+        return self.photo_ids[self.employee_ids == employee_id]
+
+    def set_many(self, photo_ids: np.ndarray, employee_ids: np.ndarray):
+        """
+        Ajouter ou remplacer des entrées (les tableaux restent triés par photo_id)
+        """
+        photo_ids = np.asarray(photo_ids, dtype=np.int64)
+        employee_ids = np.asarray(employee_ids, dtype=np.int64)
+        keep = ~np.isin(self.photo_ids, photo_ids)
+
+        merged_photos = np.concatenate([self.photo_ids[keep], photo_ids])
+        merged_employees = np.concatenate([self.employee_ids[keep], employee_ids])
+        order = np.argsort(merged_photos, kind="stable")
+        self.photo_ids = merged_photos[order]
+        self.employee_ids = merged_employees[order]
+
+    def remove_many(self, photo_ids: np.ndarray):
+        keep = ~np.isin(self.photo_ids, np.asarray(photo_ids, dtype=np.int64))
+        self.photo_ids = self.photo_ids[keep]
+        self.employee_ids = self.employee_ids[keep]
+
+    def save(self, path: Path):
+        with open(path, 'wb') as f:
+            f.write(ID_MAP_HEADER.pack(ID_MAP_MAGIC, ID_MAP_VERSION, len(self.photo_ids)))
+            f.write(np.ascontiguousarray(self.photo_ids, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(self.employee_ids, dtype=np.int64).tobytes())
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False) -> "IdMap":
+        """
+        Charger le mapping ; avec mmap=True les pages sont partagées entre processus
+        (les tableaux en lecture seule sont recopiés à la première modification)
+        """
+        with open(path, 'rb') as f:
+            magic, version, count = ID_MAP_HEADER.unpack(f.read(ID_MAP_HEADER.size))
+        if magic != ID_MAP_MAGIC or version != ID_MAP_VERSION:
+            raise ValueError(f"Unsupported id map format in {path}")
+
+        if count == 0:
+            return cls()
+
+        if mmap:
+            data = np.memmap(path, dtype=np.int64, mode='r', offset=ID_MAP_HEADER.size, shape=(2, count))
+        else:
+            data = np.fromfile(path, dtype=np.int64, offset=ID_MAP_HEADER.size, count=2 * count).reshape(2, count)
+        return cls(data[0], data[1])
@@ -0,0 +1,201 @@
+"""
+Index Factory
+Construction des index FAISS (flat, HNSW, IVF-Flat, IVF-PQ) selon la taille de la galerie
+"""
+import math
+import time
+import numpy as np
+import faiss
+from typing import Dict, List, Optional, Sequence
+
+from app.config import settings
+
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# Nombre minimal de points d'entraînement par centroïde recommandé par FAISS
+MIN_POINTS_PER_CENTROID = 39
+
+def choose_index_kind(ntotal: int) -> str:
+    """
+    Choisir automatiquement le backend : recherche exacte pour les petites galeries,
+    IVF au-delà, compression PQ pour les très grandes. HNSW ne supporte pas la
+    suppression de vecteurs, il n'est donc utilisé que s'il est demandé explicitement.
+    """
+    if ntotal < settings.INDEX_AUTO_FLAT_MAX:
+        return "flat"
+    if ntotal < settings.INDEX_AUTO_IVF_FLAT_MAX:
+        return "ivf_flat"
+    return "ivf_pq"
+
+def resolve_index_kind(kind: str, ntotal: int) -> str:
+    """
+    Résoudre INDEX_TYPE ("auto" ou un backend) pour une galerie de `ntotal` vecteurs,
+    en retombant sur un backend plus simple si les données ne suffisent pas à l'entraînement
+    """
+    kind = choose_index_kind(ntotal) if kind == "auto" else kind
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index type: {kind}")
+
+    if kind == "ivf_pq" and ntotal < (1 << settings.INDEX_PQ_NBITS) * MIN_POINTS_PER_CENTROID:
+        kind = "ivf_flat"
+    if kind == "ivf_flat" and ntotal < _nlist_for(ntotal) * MIN_POINTS_PER_CENTROID:
+        kind = "flat"
+    return kind
+
+def _nlist_for(ntotal: int) -> int:
+    if settings.INDEX_IVF_NLIST > 0:
+        return settings.INDEX_IVF_NLIST
+    return max(1, int(4 * math.sqrt(max(ntotal, 1))))
+
+def create_index(kind: str, dimension: int, ntotal: int = 0) -> faiss.Index:
+    """
+    Créer un index vide adressé par EmployeePhoto.id.
+
+    Flat et HNSW sont enveloppés dans IndexIDMap2 ; les index IVF gèrent eux-mêmes les
+    ids (IndexIDMap ne sait pas retirer des vecteurs d'un IVF) avec une direct map en
+    table de hachage pour permettre suppression et reconstruction par id.
+    """
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+
+    if kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dimension, settings.INDEX_HNSW_M)
+        hnsw.hnsw.efConstruction = settings.INDEX_HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+
+    nlist = _nlist_for(ntotal)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if kind == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    elif kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, settings.INDEX_PQ_M, settings.INDEX_PQ_NBITS)
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+def index_kind(index: faiss.Index) -> Optional[str]:
+    """
+    Identifier le backend d'un index chargé (None pour un format inconnu ou ancien)
+    """
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(inner, faiss.IndexFlat):
+            return "flat"
+    return None
+
+def supports_remove(index: faiss.Index) -> bool:
+    return index_kind(index) in ("flat", "ivf_flat", "ivf_pq")
+
+def train_index(index: faiss.Index, vectors: np.ndarray):
+    """
+    Entraîner l'index (IVF) sur les embeddings stockés
+    """
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+def apply_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Appliquer les paramètres de recherche (nprobe pour IVF, efSearch pour HNSW)
+    """
+    nprobe = settings.INDEX_IVF_NPROBE if nprobe is None else nprobe
+    ef_search = settings.INDEX_HNSW_EF_SEARCH if ef_search is None else ef_search
+
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = ef_search
+
+def build_index(kind: str, vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    """
+    Construire, entraîner et remplir un index en un seul ajout vectorisé
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    kind = resolve_index_kind(kind, len(vectors))
+    index = create_index(kind, settings.EMBEDDING_SIZE, len(vectors))
+    if len(vectors):
+        train_index(index, vectors)
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype=np.int64))
+    apply_search_params(index)
+    return index
+
+def compare_backends(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    kinds: Sequence[str] = INDEX_KINDS,
+    k: int = 1
+) -> List[Dict]:
+    """
+    Comparer rappel@k et latence de chaque backend à la recherche exacte
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64)
+
+    exact = build_index("flat", vectors, ids)
+    _, truth = exact.search(queries, k)
+
+    report = []
+    for kind in kinds:
+        start = time.perf_counter()
+        index = build_index(kind, vectors, ids)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_s = time.perf_counter() - start
+
+        recall = np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)])
+        report.append({
+            "kind": kind,
+            "effective_kind": index_kind(index),
+            "recall": float(recall),
+            "build_seconds": build_s,
+            "latency_ms_per_query": search_s * 1000 / max(len(queries), 1),
+        })
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare FAISS backends against exact search")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N random unit vectors instead of the database")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = np.random.default_rng(0).standard_normal((args.synthetic, settings.EMBEDDING_SIZE)).astype(np.float32)
+    else:
+        from app.database import SessionLocal, EmployeePhoto
+        from app.ml_module.face_recognition import embeddings_from_bytes
+
+        db = SessionLocal()
+        try:
+            blobs = [row[0] for row in db.query(EmployeePhoto.embedding).filter(EmployeePhoto.embedding != None).all()]
+        finally:
+            db.close()
+        vectors = embeddings_from_bytes(blobs)
+
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # Requêtes : photos de la galerie légèrement bruitées, comme une nouvelle capture
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = queries + rng.normal(0, 0.02, queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for row in compare_backends(vectors, queries, k=args.k):
+        print(
+            f"{row['kind']:>9} ({row['effective_kind']}): recall@{args.k}={row['recall']:.4f} "
+            f"build={row['build_seconds']:.2f}s latency={row['latency_ms_per_query']:.3f}ms/query"
+        )
@@ -0,0 +1,324 @@
+"""
+Index Store
+Persistance de l'index FAISS : journal des mutations (WAL) en ajout seul
+et snapshots compacts écrits de manière atomique
+"""
+import os
+import json
+import pickle
+import struct
+import threading
+import zlib
+import numpy as np
+import faiss
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou entre processus
+    fcntl = None
+
+from app.ml_module.id_map import IdMap
+
+# En-tête d'un enregistrement du journal : magic, opération, nombre de vecteurs, dimension
+WAL_MAGIC = b"FWAL"
+WAL_HEADER = struct.Struct("<4sBII")
+WAL_CRC = struct.Struct("<I")
+
+OP_ADD = 1
+OP_REMOVE = 2
+
+# Lecture de l'index par memory-map (pages partagées entre processus) ; les versions
+# de FAISS sans IO_FLAG_MMAP_IFC ne mappent que les listes inversées IVF
+INDEX_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+class WalRecord(NamedTuple):
+    op: int
+    photo_ids: np.ndarray
+    employee_ids: Optional[np.ndarray]
+    embeddings: Optional[np.ndarray]
+
+class IndexFileLock:
+    """
+    Verrou fcntl sur un fichier du répertoire de l'index, partagé par tous les processus
+    (et les nœuds qui montent le même volume) : exclusif pour les écritures (journal,
+    snapshot), partagé pour relire un état cohérent. Le verrou exclusif est réentrant
+    dans un même processus.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    @contextmanager
+    def exclusive(self):
+        with self._thread_lock:
+            if self._depth == 0:
+                self._file = open(self.path, 'a+b')
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    # Fermer le descripteur libère le verrou
+                    self._file.close()
+                    self._file = None
+
+    @contextmanager
+    def shared(self):
+        with open(self.path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            yield
+
+class IndexStore:
+    """
+    Répertoire de persistance de l'index.
+
+    Chaque snapshot porte un numéro de génération : `faiss_index.<g>.index`,
+    `faiss_ids.<g>.bin` (voir IdMap) et le journal `index_wal.<g>.log` des mutations postérieures.
+    Le manifeste `index_manifest.json`, remplacé atomiquement en dernier, désigne la
+    génération courante : un crash pendant l'écriture d'un snapshot laisse toujours
+    un couple index/mapping cohérent, complété par son journal.
+    """
+
+    MANIFEST_NAME = "index_manifest.json"
+    LOCK_NAME = "index.lock"
+    LEGACY_INDEX_NAME = "faiss_index.index"
+    LEGACY_METADATA_NAME = "faiss_metadata.pkl"
+
+    def __init__(self, directory: Path, fsync: bool = True, embedding_version: str = ""):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.embedding_version = embedding_version  # Pipeline d'embedding des vecteurs écrits
+        self.stale_embeddings = False  # Snapshot chargé calculé par un autre pipeline
+        self.generation = 0
+        self.wal_records = 0  # Mutations journalisées depuis le dernier snapshot
+        self.wal_size = 0  # Octets du journal déjà appliqués
+        self._snapshot_index_path: Optional[Path] = None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / self.MANIFEST_NAME
+
+    @property
+    def lock_path(self) -> Path:
+        return self.directory / self.LOCK_NAME
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """
+        Version de l'état chargé : (génération du snapshot, taille du journal appliqué).
+        L'ordre lexicographique suit l'ordre des mutations.
+        """
+        return self.generation, self.wal_size
+
+    def disk_version(self) -> Tuple[int, int]:
+        """
+        Version la plus récente sur le disque (éventuellement écrite par un autre processus)
+        """
+        # Sans manifest, les mutations vont dans le journal de la génération 0
+        generation = self.read_manifest_generation() or 0
+        try:
+            return generation, self.wal_path(generation).stat().st_size
+        except FileNotFoundError:
+            return generation, 0
+
+    def read_manifest(self) -> Optional[dict]:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def read_manifest_generation(self) -> Optional[int]:
+        manifest = self.read_manifest()
+        return None if manifest is None else int(manifest["generation"])
+
+    def index_path(self, generation: int) -> Path:
+        return self.directory / f"faiss_index.{generation}.index"
+
+    def ids_path(self, generation: int) -> Path:
+        return self.directory / f"faiss_ids.{generation}.bin"
+
+    def metadata_path(self, generation: int) -> Path:
+        # Mapping pickle des versions précédentes
+        return self.directory / f"faiss_metadata.{generation}.pkl"
+
+    def wal_path(self, generation: int) -> Path:
+        return self.directory / f"index_wal.{generation}.log"
+
+    def load_snapshot(self, mmap: bool = False) -> Optional[Tuple[faiss.Index, IdMap]]:
+        """
+        Charger le snapshot courant ; None si aucun index n'a encore été sauvegardé.
+        Avec mmap=True, l'index et le mapping sont mappés en lecture seule.
+        """
+        manifest = self.read_manifest()
+        if manifest is not None:
+            self.generation = int(manifest["generation"])
+            self.stale_embeddings = manifest.get("embedding_version", "") != self.embedding_version
+            index_path = self.index_path(self.generation)
+            ids_path = self.ids_path(self.generation)
+            metadata_path = self.metadata_path(self.generation)
+        else:
+            # Ancien format : fichiers à nom fixe, sans journal
+            self.generation = 0
+            index_path = self.directory / self.LEGACY_INDEX_NAME
+            ids_path = None
+            metadata_path = self.directory / self.LEGACY_METADATA_NAME
+            if not (index_path.exists() and metadata_path.exists()):
+                return None
+
+        index = faiss.read_index(str(index_path), INDEX_MMAP_FLAGS if mmap else 0)
+        self._snapshot_index_path = index_path
+        if ids_path is not None and ids_path.exists():
+            id_map = IdMap.load(ids_path, mmap=mmap)
+        else:
+            with open(metadata_path, 'rb') as f:
+                id_map = IdMap.from_dict(pickle.load(f))
+        return index, id_map
+
+    def read_snapshot_index(self) -> faiss.Index:
+        """
+        Relire l'index du snapshot chargé entièrement en mémoire (copie modifiable)
+        """
+        return faiss.read_index(str(self._snapshot_index_path))
+
+    def read_wal(self, truncate: bool = True) -> Iterator[WalRecord]:
+        """
+        Relire le journal de la génération courante ; s'arrête au premier
+        enregistrement incomplet ou corrompu (écriture interrompue par un crash).
+        La fin incomplète n'est coupée que par le processus qui détient le verrou exclusif.
+        """
+        path = self.wal_path(self.generation)
+        self.wal_records = 0
+        self.wal_size = 0
+        if not path.exists():
+            return
+
+        valid_size = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(WAL_HEADER.size)
+                if len(header) < WAL_HEADER.size:
+                    break
+                magic, op, count, dim = WAL_HEADER.unpack(header)
+                if magic != WAL_MAGIC or op not in (OP_ADD, OP_REMOVE):
+                    break
+
+                payload_size = count * 8 + (count * 8 + count * dim * 4 if op == OP_ADD else 0)
+                payload = f.read(payload_size)
+                crc = f.read(WAL_CRC.size)
+                if len(payload) < payload_size or len(crc) < WAL_CRC.size:
+                    break
+                if WAL_CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                    break
+
+                photo_ids = np.frombuffer(payload, dtype=np.int64, count=count)
+                employee_ids = None
+                embeddings = None
+                if op == OP_ADD:
+                    employee_ids = np.frombuffer(payload, dtype=np.int64, count=count, offset=count * 8)
+                    embeddings = np.frombuffer(
+                        payload, dtype=np.float32, count=count * dim, offset=count * 16
+                    ).reshape(count, dim)
+
+                valid_size = f.tell()
+                self.wal_records += 1
+                self.wal_size = valid_size
+                yield WalRecord(op, photo_ids, employee_ids, embeddings)
+
+        # Couper la fin incomplète pour que les prochains ajouts restent lisibles
+        if truncate and path.stat().st_size > valid_size:
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def append(
+        self,
+        op: int,
+        photo_ids: np.ndarray,
+        employee_ids: Optional[np.ndarray] = None,
+        embeddings: Optional[np.ndarray] = None
+    ):
+        """
+        Ajouter une mutation au journal (durable avant d'être appliquée en mémoire)
+        """
+        photo_ids = np.ascontiguousarray(photo_ids, dtype=np.int64)
+        count = len(photo_ids)
+        dim = 0
+        payload = photo_ids.tobytes()
+        if op == OP_ADD:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(count, -1)
+            dim = embeddings.shape[1]
+            payload += np.ascontiguousarray(employee_ids, dtype=np.int64).tobytes() + embeddings.tobytes()
+
+        header = WAL_HEADER.pack(WAL_MAGIC, op, count, dim)
+        record = header + payload + WAL_CRC.pack(zlib.crc32(header + payload))
+
+        with open(self.wal_path(self.generation), 'ab') as f:
+            f.write(record)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.wal_size = f.tell()
+        self.wal_records += 1
+
+    def write_snapshot(self, index: faiss.Index, id_map: IdMap):
+        """
+        Écrire un snapshot complet (index + mapping) puis basculer le manifeste
+        """
+        generation = self.generation + 1
+
+        self._write_atomic(self.index_path(generation), lambda path: faiss.write_index(index, str(path)))
+        self._write_atomic(self.ids_path(generation), id_map.save)
+        self.wal_path(generation).touch()
+
+        manifest = json.dumps({"generation": generation, "embedding_version": self.embedding_version})
+        self._write_atomic(self.manifest_path, lambda path: path.write_text(manifest, encoding="utf-8"))
+        self._fsync_directory()
+
+        previous = self.generation
+        self.generation = generation
+        self._snapshot_index_path = self.index_path(generation)
+        self.wal_records = 0
+        self.wal_size = 0
+        self._cleanup(previous)
+
+    def _write_atomic(self, path: Path, write):
+        tmp_path = path.with_name(path.name + ".tmp")
+        write(tmp_path)
+        if self.fsync:
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _fsync_directory(self):
+        if not self.fsync or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(self.directory, os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _cleanup(self, generation: int):
+        paths: List[Path] = [
+            self.index_path(generation),
+            self.ids_path(generation),
+            self.metadata_path(generation),
+            self.wal_path(generation),
+        ]
+        if generation == 0:
+            paths += [self.directory / self.LEGACY_INDEX_NAME, self.directory / self.LEGACY_METADATA_NAME]
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,121 @@
+"""
+Face Tracking
+Suivi des visages d'un flux vidéo par recouvrement des boîtes (IoU) d'une image à l'autre
+"""
+import numpy as np
+from typing import List, Optional, Tuple
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Matrice IoU entre deux ensembles de boîtes [x1, y1, x2, y2]
+    """
+    boxes_a = boxes_a.reshape(-1, 1, 4)
+    boxes_b = boxes_b.reshape(1, -1, 4)
+    width = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    height = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-6)
+
+class Track:
+    """
+    Un visage suivi et la dernière décision de reconnaissance qui lui est associée
+    """
+
+    def __init__(self, track_id: int, box: np.ndarray, probability: float, frame: int):
+        self.track_id = track_id
+        self.box = box
+        self.probability = probability
+        self.last_seen = frame
+        self.embedded_at: Optional[int] = None  # Image du dernier passage FaceNet
+        self.unstable = False  # Détection peu fiable depuis le dernier embedding
+
+        self.employee_id: Optional[int] = None
+        self.employee_name: Optional[str] = None
+        self.confidence_score: Optional[float] = None
+        self.decision: Optional[str] = None
+        self.logged_decision: Optional[Tuple[Optional[int], str]] = None
+
+class FaceTracker:
+    """
+    Associe les visages détectés à chaque image aux pistes existantes (appariement
+    glouton par IoU décroissant) et indique quelles pistes doivent repasser par FaceNet :
+    nouvelle piste, retour d'une détection fiable après une baisse de confiance,
+    ou nouvel essai périodique pour une piste refusée.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = 0.3,
+        max_missed_frames: int = 10,
+        min_confidence: float = 0.9,
+        retry_interval: int = 5
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_missed_frames = max_missed_frames
+        self.min_confidence = min_confidence
+        self.retry_interval = retry_interval
+        self.tracks: List[Track] = []
+        self.frame = 0
+        self._next_id = 1
+
+    def update(self, boxes: np.ndarray, probs: np.ndarray) -> Tuple[List[Track], List[Tuple[Track, int]]]:
+        """
+        Intégrer les détections d'une nouvelle image.
+
+        Retourne les pistes visibles dans cette image et la liste (piste, indice de la
+        détection) des visages à ré-identifier.
+        """
+        self.frame += 1
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        probs = np.asarray(probs, dtype=np.float32).reshape(-1)
+
+        assigned = [None] * len(boxes)
+        if self.tracks and len(boxes):
+            iou = box_iou(np.stack([track.box for track in self.tracks]), boxes)
+            matched_tracks = set()
+            for flat in np.argsort(-iou, axis=None):
+                t, d = np.unravel_index(flat, iou.shape)
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if t in matched_tracks or assigned[d] is not None:
+                    continue
+                matched_tracks.add(t)
+                assigned[d] = self.tracks[t]
+
+        visible = []
+        to_embed = []
+        for d, track in enumerate(assigned):
+            probability = float(probs[d])
+            if track is None:
+                track = Track(self._next_id, boxes[d], probability, self.frame)
+                self._next_id += 1
+                self.tracks.append(track)
+            else:
+                track.box = boxes[d]
+                track.probability = probability
+                track.last_seen = self.frame
+
+            if probability < self.min_confidence:
+                # Visage de profil, flou ou partiellement masqué : attendre une meilleure vue
+                track.unstable = True
+            elif self._needs_embedding(track):
+                to_embed.append((track, d))
+            visible.append(track)
+
+        # Oublier les pistes disparues depuis trop longtemps
+        self.tracks = [
+            track for track in self.tracks
+            if self.frame - track.last_seen <= self.max_missed_frames
+        ]
+        return visible, to_embed
+
+    def _needs_embedding(self, track: Track) -> bool:
+        if track.embedded_at is None or track.unstable:
+            return True
+        return track.decision != "granted" and self.frame - track.embedded_at >= self.retry_interval
+
+    def mark_embedded(self, track: Track):
+        track.embedded_at = self.frame
+        track.unstable = False
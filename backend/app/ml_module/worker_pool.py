@@ -0,0 +1,91 @@
+"""
+Inference Worker Pool
+Processus d'inférence dédiés (décodage, détection, alignement, FaceNet) alimentés
+par la file IPC d'un ProcessPoolExecutor
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+# Service du processus worker : modèles seuls, sans index (la recherche reste dans
+# le processus API, sur le snapshot mappé en mémoire partagé par le cache de pages)
+_worker_service = None
+
+def _init_worker(torch_threads: int):
+    global _worker_service
+    torch.set_num_threads(torch_threads)
+    from app.ml_module.face_recognition import FaceRecognitionService
+    _worker_service = FaceRecognitionService(load_gallery=False)
+
+def _embed_in_worker(images: list) -> List[Optional[np.ndarray]]:
+    return _worker_service.compute_embeddings(images)
+
+def _analyze_in_worker(images: list) -> list:
+    return _worker_service.compute_photo_faces(images)
+
+def _embed_faces_in_worker(faces: List[np.ndarray]) -> List[np.ndarray]:
+    return list(_worker_service.embed_faces([torch.from_numpy(face) for face in faces]))
+
+class InferencePool:
+    """
+    Un processus par cœur, chacun avec ses modèles et un seul thread intra-op :
+    le débit de reconnaissance croît avec le nombre de cœurs au lieu d'être limité
+    par le GIL et par un seul passage FaceNet à la fois.
+    """
+
+    def __init__(self, processes: int, torch_threads: int = 1):
+        self.processes = processes
+        # spawn : pas de fork d'un processus qui a déjà démarré les threads de torch
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(torch_threads,)
+        )
+
+    def warmup(self):
+        """
+        Démarrer les processus et attendre que leurs modèles soient chargés
+        """
+        futures = [self._executor.submit(_embed_in_worker, []) for _ in range(self.processes)]
+        for future in futures:
+            future.result()
+
+    def embed(self, images: list) -> List[Optional[np.ndarray]]:
+        """
+        Calculer les embeddings de plusieurs images, réparties entre les processus
+        """
+        return self._map(_embed_in_worker, images)
+
+    def embed_faces(self, faces: List[torch.Tensor]) -> List[np.ndarray]:
+        """
+        Embeddings de visages déjà alignés (tenseurs FaceNet), répartis entre les processus
+        """
+        return self._map(_embed_faces_in_worker, [face.numpy() for face in faces])
+
+    def analyze(self, images: list) -> list:
+        """
+        Embedding du visage principal et nombre de visages de chaque photo (PhotoFaces)
+        """
+        return self._map(_analyze_in_worker, images)
+
+    def _map(self, func, images: list) -> list:
+        # Un morceau par processus : chacun traite le sien en un seul passage FaceNet
+        if not images:
+            return []
+        chunk_size = -(-len(images) // self.processes)
+        futures = [
+            self._executor.submit(func, images[start:start + chunk_size])
+            for start in range(0, len(images), chunk_size)
+        ]
+
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -2,7 +2,7 @@
 Pydantic models for request/response
 """
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # Auth Models
@@ -40,10 +40,31 @@ class EmployeeResponse(EmployeeBase):
         from_attributes = True
 
 # Photo Models
+class BulkEnrollmentStatus(BaseModel):
+    job_id: str
+    status: str  # running, completed ou failed
+    employees_total: int
+    employees_created: int
+    photos_total: int
+    photos_processed: int
+    photos_added: int
+    photos_skipped: Dict[str, int]  # Par raison : no_face, multiple_faces, invalid_image, already_enrolled...
+    photos_per_second: float
+    errors: List[str]
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+
+class PhotoUploadResult(BaseModel):
+    filename: str
+    status: str  # added, duplicate, no_face, multiple_faces, invalid_image
+    photo_id: Optional[int] = None
+    detail: Optional[str] = None
+
 class PhotoUploadResponse(BaseModel):
     message: str
     employee_id: int
     photos_uploaded: int
+    results: List[PhotoUploadResult] = []
 
 # Recognition Models
 class RecognitionRequest(BaseModel):
@@ -58,6 +79,25 @@ class RecognitionResponse(BaseModel):
     decision: str  # "granted" or "denied"
     message: str
 
+class BatchRecognitionItem(RecognitionResponse):
+    filename: str
+
+class BatchRecognitionResponse(BaseModel):
+    total: int
+    granted: int
+    denied: int
+    results: List[BatchRecognitionItem]
+
+class StreamFace(RecognitionResponse):
+    track_id: int
+    box: List[float]  # [x1, y1, x2, y2] dans l'image envoyée
+
+class StreamFrameResponse(BaseModel):
+    frame: int
+    dropped_frames: int = 0  # Images ignorées car une image plus récente était arrivée
+    faces: List[StreamFace]
+    error: Optional[str] = None
+
 # Log Models
 class AccessLogResponse(BaseModel):
     id: int
@@ -70,6 +110,19 @@ class AccessLogResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class StatsBucket(BaseModel):
+    bucket: datetime
+    total: int
+    granted: int
+    denied: int
+
+class StatsHistogramResponse(BaseModel):
+    interval: str
+    start_date: datetime
+    end_date: datetime
+    employee_id: Optional[int] = None
+    buckets: List[StatsBucket]
+
 class LogsFilter(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
@@ -0,0 +1,222 @@
+"""
+Probe image store
+Images des tentatives de reconnaissance : recompressées, réduites, rangées par jour
+et par décision, puis supprimées ou archivées par une tâche de rétention
+"""
+import io
+import uuid
+import shutil
+import threading
+from datetime import datetime, timedelta, date
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import update, func
+
+from app.config import settings
+from app.database import SessionLocal, AccessLog
+
+class ProbeImageStore:
+    """
+    Arborescence : <root>/AAAA/MM/JJ/<décision>/HHMMSS_ffffff_<id>.jpg (dates UTC, comme
+    AccessLog.timestamp). Un répertoire par jour et par décision garde les répertoires
+    petits et permet à la rétention d'expirer un jour entier sans lister chaque fichier.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        archive_root: Path,
+        max_size: int = 640,
+        quality: int = 75,
+        face_only: bool = False,
+        thumbnail_size: int = 160,
+        retention_days: Optional[Dict[str, int]] = None,
+        action: str = "delete"
+    ):
+        self.root = root
+        self.archive_root = archive_root
+        self.max_size = max_size
+        self.quality = quality
+        self.face_only = face_only
+        self.thumbnail_size = thumbnail_size
+        self.retention_days = {decision: days for decision, days in (retention_days or {}).items() if days > 0}
+        self.action = action
+        self._stop_sweeper = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def reserve(self, decision: str, timestamp: datetime) -> Path:
+        """
+        Chemin de l'image d'une tentative, connu avant son écriture (pour AccessLog.image_path)
+        """
+        name = f"{timestamp:%H%M%S_%f}_{uuid.uuid4().hex[:8]}.jpg"
+        return self.root / f"{timestamp:%Y}" / f"{timestamp:%m}" / f"{timestamp:%d}" / decision / name
+
+    def save(self, path: Path, contents: bytes, detect: Optional[Callable[[bytes], object]] = None) -> bool:
+        """
+        Écrire l'image réduite et recompressée en JPEG (hors du chemin critique).
+        En mode face_only, detect (FaceRecognitionService.detect_faces) fournit le visage
+        à conserver ; sans visage détecté, l'image réduite est gardée.
+        Retourne False si l'image n'a pas pu être écrite.
+        """
+        try:
+            img = None
+            if self.face_only and detect is not None:
+                img = self._face_thumbnail(detect(contents))
+            if img is None:
+                img = Image.open(io.BytesIO(contents))
+                # Décodage JPEG directement à l'échelle réduite
+                img.draft('RGB', (self.max_size, self.max_size))
+                img = img.convert('RGB')
+                img.thumbnail((self.max_size, self.max_size), Image.BILINEAR)
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            img.save(path, "JPEG", quality=self.quality, optimize=True)
+        except Exception as e:
+            print(f"Error saving probe image: {e}")
+            return False
+        return True
+
+    def _face_thumbnail(self, frame) -> Optional[Image.Image]:
+        if frame is None or not len(frame.boxes):
+            return None
+        x1, y1, x2, y2 = frame.boxes[int(np.argmax(frame.probs))]
+        # Marge de 20 % autour du visage détecté
+        margin = 0.2 * max(x2 - x1, y2 - y1)
+        original = frame.load_original()
+        face = original.crop((
+            max(0, int(x1 - margin)), max(0, int(y1 - margin)),
+            min(original.width, int(x2 + margin)), min(original.height, int(y2 + margin))
+        ))
+        face.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.BILINEAR)
+        return face
+
+    def sweep(self, now: Optional[datetime] = None) -> int:
+        """
+        Supprimer ou archiver les jours dont toutes les images ont dépassé la rétention
+        de leur décision ; retourne le nombre de répertoires traités
+        """
+        if not self.retention_days or not self.root.exists():
+            return 0
+        now = now or datetime.utcnow()
+        expired = 0
+
+        for day_dir in sorted(self.root.glob("[0-9]*/[0-9]*/[0-9]*")):
+            if not day_dir.is_dir():
+                continue
+            try:
+                day = date(*(int(part) for part in day_dir.relative_to(self.root).parts))
+            except ValueError:
+                continue
+            day_start = datetime.combine(day, datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+
+            for decision_dir in list(day_dir.iterdir()):
+                days = self.retention_days.get(decision_dir.name)
+                if not days or not decision_dir.is_dir() or day_end > now - timedelta(days=days):
+                    continue
+                try:
+                    self._expire(decision_dir, decision_dir.name, day_start, day_end)
+                    expired += 1
+                except Exception as e:
+                    print(f"Error expiring probe images {decision_dir}: {e}")
+
+            # Retirer les répertoires de jour, mois et année devenus vides
+            for directory in (day_dir, day_dir.parent, day_dir.parent.parent):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    break
+        return expired
+
+    def _expire(self, decision_dir: Path, decision: str, day_start: datetime, day_end: datetime):
+        if self.action == "archive":
+            target = self.archive_root / decision_dir.relative_to(self.root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.exists():
+                # Archive déjà commencée (balayage interrompu) : fusionner
+                for source in decision_dir.iterdir():
+                    shutil.move(str(source), str(target / source.name))
+                decision_dir.rmdir()
+            else:
+                shutil.move(str(decision_dir), str(target))
+            new_path = func.replace(AccessLog.image_path, str(decision_dir), str(target))
+        else:
+            shutil.rmtree(decision_dir)
+            new_path = None
+
+        # Mettre à jour les logs du jour (index sur timestamp) qui pointent vers ces images
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(AccessLog)
+                .where(
+                    AccessLog.timestamp >= day_start,
+                    AccessLog.timestamp < day_end,
+                    AccessLog.decision == decision,
+                    AccessLog.image_path.like(f"{decision_dir}%")
+                )
+                .values(image_path=new_path)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def start_sweeper(self, interval_s: float):
+        if self._sweeper is not None or not self.retention_days or interval_s <= 0:
+            return
+        self._stop_sweeper.clear()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, args=(interval_s,), name="probe-image-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def _sweep_loop(self, interval_s: float):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping probe images: {e}")
+            if self._stop_sweeper.wait(interval_s):
+                return
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._stop_sweeper.set()
+            self._sweeper.join()
+            self._sweeper = None
+
+# Instance unique du processus
+_probe_store: Optional[ProbeImageStore] = None
+_probe_store_lock = threading.Lock()
+
+def get_probe_store() -> ProbeImageStore:
+    global _probe_store
+    with _probe_store_lock:
+        if _probe_store is None:
+            _probe_store = ProbeImageStore(
+                Path(settings.PROBE_DIR or Path(settings.UPLOAD_DIR) / "probes"),
+                Path(settings.PROBE_ARCHIVE_DIR or Path(settings.UPLOAD_DIR) / "probe_archive"),
+                max_size=settings.PROBE_MAX_SIZE,
+                quality=settings.PROBE_JPEG_QUALITY,
+                face_only=settings.PROBE_FACE_ONLY,
+                thumbnail_size=settings.PROBE_THUMBNAIL_SIZE,
+                retention_days={
+                    "granted": settings.PROBE_RETENTION_DAYS_GRANTED,
+                    "denied": settings.PROBE_RETENTION_DAYS_DENIED,
+                },
+                action=settings.PROBE_RETENTION_ACTION
+            )
+    return _probe_store
+
+def start_probe_sweeper():
+    get_probe_store().start_sweeper(settings.PROBE_SWEEP_INTERVAL_S)
+
+def stop_probe_sweeper():
+    get_probe_store().stop_sweeper()
@@ -12,7 +12,7 @@ from datetime import timedelta
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
-async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
+def login(login_data: LoginRequest, db: Session = Depends(get_db)):
     """
     Authentification de l'administrateur
     """
@@ -2,17 +2,27 @@
 Employee management routes
 """
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import os
-import shutil
+import asyncio
+import uuid
+import numpy as np
 from pathlib import Path
 
 from app.database import get_db, Employee, EmployeePhoto
-from app.models import EmployeeCreate, EmployeeUpdate, EmployeeResponse, PhotoUploadResponse
+from app.models import (
+    EmployeeCreate, EmployeeUpdate, EmployeeResponse, PhotoUploadResponse, PhotoUploadResult, BulkEnrollmentStatus
+)
 from app.auth import get_current_user
 from app.config import settings
-from app.ml_module.face_recognition import FaceRecognitionService
+from app.ml_module.face_recognition import (
+    FaceRecognitionService, PhotoFaces, get_face_service, embedding_to_bytes, embeddings_from_bytes,
+    EMBEDDING_VERSION
+)
+from app.ml_module.executor import run_ml
+from app.enrollment import start_enrollment_job, get_enrollment_job
 
 router = APIRouter()
 
@@ -20,7 +30,7 @@ router = APIRouter()
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
 @router.post("/", response_model=EmployeeResponse, status_code=status.HTTP_201_CREATED)
-async def create_employee(
+def create_employee(
     employee: EmployeeCreate,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -43,8 +53,72 @@ async def create_employee(
     
     return db_employee
 
+@router.post("/bulk", response_model=BulkEnrollmentStatus, status_code=status.HTTP_202_ACCEPTED)
+async def bulk_enroll(
+    archive: UploadFile = File(...),
+    manifest: Optional[UploadFile] = File(None),
+    current_user = Depends(get_current_user),
+    face_service: FaceRecognitionService = Depends(get_face_service)
+):
+    """
+    Enrôler en masse les employés d'une archive zip (photos dans <employee_id>/ ou listées
+    dans la colonne photos du manifeste CSV, manifest.csv de l'archive si aucun n'est fourni).
+    
+    Le traitement continue en arrière-plan : suivre l'avancement avec GET /bulk/{job_id}.
+    """
+    manifest_text = (await manifest.read()).decode("utf-8-sig") if manifest else None
+    archive_path = await run_in_threadpool(_store_bulk_archive, archive)
+    
+    try:
+        progress = await run_in_threadpool(start_enrollment_job, face_service, archive_path, manifest_text, True)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    return BulkEnrollmentStatus(**progress.as_dict())
+
+@router.get("/bulk/{job_id}", response_model=BulkEnrollmentStatus)
+def get_bulk_enrollment(
+    job_id: str,
+    current_user = Depends(get_current_user)
+):
+    """
+    Avancement d'un enrôlement en masse (photos traitées, photos par seconde, photos ignorées)
+    """
+    progress = get_enrollment_job(job_id)
+    if progress is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Enrollment job not found"
+        )
+    return BulkEnrollmentStatus(**progress.as_dict())
+
+def _store_bulk_archive(archive: UploadFile) -> Path:
+    # Copie sur disque : l'archive est lue après la fin de la requête
+    bulk_dir = Path(settings.UPLOAD_DIR) / "bulk"
+    bulk_dir.mkdir(parents=True, exist_ok=True)
+    archive_path = bulk_dir / f"{uuid.uuid4().hex}.zip"
+    max_bytes = settings.ENROLLMENT_MAX_ARCHIVE_BYTES
+    size = 0
+    with open(archive_path, "wb") as buffer:
+        while True:
+            chunk = archive.file.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                buffer.close()
+                os.remove(archive_path)
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Archive too large (maximum {max_bytes} bytes)"
+                )
+            buffer.write(chunk)
+    return archive_path
+
 @router.get("/", response_model=List[EmployeeResponse])
-async def get_employees(
+def get_employees(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
@@ -57,7 +131,7 @@ async def get_employees(
     return employees
 
 @router.get("/{employee_id}", response_model=EmployeeResponse)
-async def get_employee(
+def get_employee(
     employee_id: int,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -74,7 +148,7 @@ async def get_employee(
     return employee
 
 @router.put("/{employee_id}", response_model=EmployeeResponse)
-async def update_employee(
+def update_employee(
     employee_id: int,
     employee_update: EmployeeUpdate,
     db: Session = Depends(get_db),
@@ -90,19 +164,35 @@ async def update_employee(
             detail="Employee not found"
         )
     
+    was_active = employee.is_active
     update_data = employee_update.dict(exclude_unset=True)
+    
+    # Seul un changement de statut touche l'index : le service n'est requis (503 pendant
+    # son chargement) que dans ce cas, et avant toute écriture
+    face_service = None
+    if "is_active" in update_data and bool(update_data["is_active"]) != bool(was_active):
+        face_service = get_face_service()
+    
     for field, value in update_data.items():
         setattr(employee, field, value)
     
     db.commit()
     db.refresh(employee)
+    
+    # Désactivation / réactivation : mise à jour incrémentale de l'index FAISS
+    if was_active and not employee.is_active:
+        face_service.remove_employee(employee.id)
+    elif not was_active and employee.is_active:
+        face_service.add_employee(db, employee.id)
+    
     return employee
 
 @router.delete("/{employee_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_employee(
+def delete_employee(
     employee_id: int,
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    face_service: FaceRecognitionService = Depends(get_face_service)
 ):
     """
     Supprimer un employé et ses photos
@@ -116,6 +206,7 @@ async def delete_employee(
     
     # Supprimer les photos associées
     photos = db.query(EmployeePhoto).filter(EmployeePhoto.employee_id == employee_id).all()
+    photo_ids = [photo.id for photo in photos]
     for photo in photos:
         if os.path.exists(photo.photo_path):
             os.remove(photo.photo_path)
@@ -125,9 +216,38 @@ async def delete_employee(
     db.delete(employee)
     db.commit()
     
-    # Mettre à jour l'index FAISS
-    face_service = FaceRecognitionService()
-    face_service.rebuild_index(db)
+    # Retirer uniquement les vecteurs de cet employé de l'index FAISS
+    face_service.remove_photos(photo_ids)
+    
+    return None
+
+@router.delete("/{employee_id}/photos/{photo_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_photo(
+    employee_id: int,
+    photo_id: int,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user),
+    face_service: FaceRecognitionService = Depends(get_face_service)
+):
+    """
+    Supprimer une photo d'un employé
+    """
+    photo = db.query(EmployeePhoto).filter(
+        EmployeePhoto.id == photo_id,
+        EmployeePhoto.employee_id == employee_id
+    ).first()
+    if not photo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Photo not found"
+        )
+    
+    if os.path.exists(photo.photo_path):
+        os.remove(photo.photo_path)
+    db.delete(photo)
+    db.commit()
+    
+    face_service.remove_photos([photo_id])
     
     return None
 
@@ -136,66 +256,169 @@ async def upload_photos(
     employee_id: int,
     files: List[UploadFile] = File(...),
     db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    face_service: FaceRecognitionService = Depends(get_face_service)
 ):
     """
-    Uploader des photos pour un employé et générer les embeddings
+    Uploader des photos pour un employé : détection de tous les fichiers en parallèle,
+    un seul passage FaceNet, puis lignes et vecteurs de l'index validés ensemble
+    """
+    employee = await run_in_threadpool(_get_employee_or_404, db, employee_id)
+    
+    if len(files) > 10:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Maximum 10 photos per employee"
+        )
+    
+    filenames = [file.filename or "photo.jpg" for file in files]
+    contents = [await file.read() for file in files]
+    analyses = await _analyze_uploads(face_service, contents)
+    
+    # Fichiers, base de données et index dans le pool de threads
+    try:
+        results = await run_in_threadpool(
+            _save_photos, db, face_service, employee, filenames, contents, analyses
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error saving photos: {str(e)}"
+        )
+    
+    uploaded = sum(1 for result in results if result.status == "added")
+    return PhotoUploadResponse(
+        message=f"Successfully uploaded {uploaded} of {len(files)} photos",
+        employee_id=employee_id,
+        photos_uploaded=uploaded,
+        results=results
+    )
+
+async def _analyze_uploads(face_service: FaceRecognitionService, contents: List[bytes]) -> List[PhotoFaces]:
+    """
+    Décoder et détecter les fichiers en parallèle (processus du pool d'inférence, ou
+    threads du pool ML), puis embedding des visages principaux en un seul lot
     """
+    if face_service.pool is not None:
+        return await run_ml(face_service.analyze_photos, contents)
+    detections = await asyncio.gather(
+        *(run_ml(face_service.detect_faces, data) for data in contents),
+        return_exceptions=True
+    )
+    return await run_ml(face_service.embed_photo_faces, list(detections))
+
+def _get_employee_or_404(db: Session, employee_id: int) -> Employee:
     employee = db.query(Employee).filter(Employee.id == employee_id).first()
     if not employee:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Employee not found"
         )
+    return employee
+
+def _save_photos(
+    db: Session,
+    face_service: FaceRecognitionService,
+    employee: Employee,
+    filenames: List[str],
+    contents: List[bytes],
+    analyses: List[PhotoFaces]
+) -> List[PhotoUploadResult]:
+    """
+    Statut de chaque fichier ; les photos retenues (un seul visage, pas de doublon) sont
+    écrites, puis leurs lignes EmployeePhoto et leurs vecteurs sont validés ensemble
+    """
+    # Embeddings déjà enregistrés pour l'employé, complétés au fil du lot
+    stored = db.query(EmployeePhoto.id, EmployeePhoto.embedding).filter(
+        EmployeePhoto.employee_id == employee.id,
+        EmployeePhoto.embedding_version == EMBEDDING_VERSION,
+        EmployeePhoto.embedding.isnot(None)
+    ).all()
+    known_labels = [f"photo {photo_id}" for photo_id, _ in stored]
+    known_embeddings = list(embeddings_from_bytes([embedding for _, embedding in stored]))
     
-    if len(files) > 10:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Maximum 10 photos per employee"
-        )
+    results = []
+    accepted = []  # (résultat, contenu, embedding)
+    for filename, data, photo in zip(filenames, contents, analyses):
+        if photo.error is not None:
+            results.append(PhotoUploadResult(filename=filename, status="invalid_image", detail=photo.error))
+            continue
+        if photo.embedding is None:
+            results.append(PhotoUploadResult(filename=filename, status="no_face", detail="No face detected"))
+            continue
+        if photo.face_count > 1:
+            results.append(PhotoUploadResult(
+                filename=filename, status="multiple_faces", detail=f"{photo.face_count} faces detected"
+            ))
+            continue
+        
+        if known_embeddings:
+            distances = np.linalg.norm(np.stack(known_embeddings) - photo.embedding, axis=1)
+            closest = int(np.argmin(distances))
+            if distances[closest] < settings.DUPLICATE_PHOTO_DISTANCE:
+                results.append(PhotoUploadResult(
+                    filename=filename, status="duplicate", detail=f"Same photo as {known_labels[closest]}"
+                ))
+                continue
+        known_labels.append(filename)
+        known_embeddings.append(photo.embedding)
+        
+        result = PhotoUploadResult(filename=filename, status="added")
+        results.append(result)
+        accepted.append((result, data, photo.embedding))
+    
+    if not accepted:
+        return results
     
     # Créer le dossier pour l'employé
-    employee_dir = Path(settings.UPLOAD_DIR) / f"employee_{employee_id}"
+    employee_dir = Path(settings.UPLOAD_DIR) / f"employee_{employee.id}"
     employee_dir.mkdir(parents=True, exist_ok=True)
     
-    face_service = FaceRecognitionService()
-    photos_uploaded = 0
-    
-    for file in files:
-        # Sauvegarder le fichier
-        file_path = employee_dir / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    written = []
+    indexed = []
+    try:
+        db_photos = []
+        for result, data, embedding in accepted:
+            # Préfixe unique : un fichier du même nom ne remplace pas une photo existante
+            file_path = employee_dir / f"{uuid.uuid4().hex[:8]}_{Path(result.filename).name}"
+            file_path.write_bytes(data)
+            written.append(file_path)
+            
+            db_photo = EmployeePhoto(
+                employee_id=employee.id,
+                photo_path=str(file_path),
+                embedding_path=None,  # Stocké dans FAISS
+                embedding=embedding_to_bytes(embedding),
+                embedding_version=EMBEDDING_VERSION
+            )
+            db.add(db_photo)
+            db_photos.append(db_photo)
+        db.flush()  # Obtenir les ids des photos, clés des vecteurs dans l'index
         
-        # Générer l'embedding
-        try:
-            embedding = face_service.get_embedding(str(file_path))
-            if embedding is not None:
-                # Sauvegarder dans la base de données
-                db_photo = EmployeePhoto(
-                    employee_id=employee_id,
-                    photo_path=str(file_path),
-                    embedding_path=None  # Stocké dans FAISS
-                )
-                db.add(db_photo)
-                
-                # Ajouter à l'index FAISS
-                face_service.add_to_index(employee_id, embedding)
-                photos_uploaded += 1
-            else:
-                # Supprimer le fichier si pas de visage détecté
-                os.remove(file_path)
-        except Exception as e:
-            # Supprimer le fichier en cas d'erreur
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            continue
+        # Vecteurs ajoutés avant la validation (les employés désactivés n'y figurent pas) :
+        # un échec de l'index annule la transaction, un échec de la validation retire les vecteurs
+        if employee.is_active:
+            indexed = [db_photo.id for db_photo in db_photos]
+            face_service.add_photos(
+                indexed,
+                [employee.id] * len(indexed),
+                np.stack([embedding for _, _, embedding in accepted]),
+                publish=False
+            )
+        db.commit()
+    except Exception as e:
+        print(f"Error saving photos: {e}")
+        db.rollback()
+        if indexed:
+            face_service.remove_photos(indexed)
+        for path in written:
+            if path.exists():
+                os.remove(path)
+        raise
     
-    db.commit()
+    if indexed:
+        face_service.publish_version()
     
-    return PhotoUploadResponse(
-        message=f"Successfully uploaded {photos_uploaded} photos",
-        employee_id=employee_id,
-        photos_uploaded=photos_uploaded
-    )
-
+    for (result, _, _), db_photo in zip(accepted, db_photos):
+        result.photo_id = db_photo.id
+    return results
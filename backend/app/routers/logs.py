@@ -1,57 +1,172 @@
 """
 Access logs routes
 """
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, HTTPException, status, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
-from datetime import datetime
+from sqlalchemy import desc, select, func, and_, or_
+from typing import Iterator, List, Optional
+from datetime import datetime, timedelta, timezone
+import io
+import csv
+import json
+import base64
 
-from app.database import get_db, AccessLog
-from app.models import AccessLogResponse
+from app.database import get_db, SessionLocal, AccessLog, AccessLogRollup
+from app.models import AccessLogResponse, StatsBucket, StatsHistogramResponse
 from app.auth import get_current_user
+from app.log_rollups import ALL_EMPLOYEES, bucket_start
+
+# Nombre maximal d'intervalles retournés par /stats/histogram
+MAX_HISTOGRAM_BUCKETS = 10000
+
+# Lignes lues par aller-retour du curseur côté serveur lors d'un export
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = ["id", "employee_id", "employee_name", "recognition_score", "decision", "timestamp"]
 
 router = APIRouter()
 
 @router.get("/", response_model=List[AccessLogResponse])
-async def get_logs(
+def get_logs(
+    response: Response,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     employee_id: Optional[int] = Query(None),
     decision: Optional[str] = Query(None),
     limit: int = Query(100, le=1000),
     skip: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
-    Récupérer les logs d'accès avec filtres
+    Récupérer les logs d'accès avec filtres, du plus récent au plus ancien.
+    
+    Pagination par curseur : quand la page est complète, l'en-tête X-Next-Cursor contient
+    le curseur à passer pour la page suivante (skip reste accepté mais parcourt tout le début).
     """
-    query = db.query(AccessLog)
+    query = db.query(AccessLog).filter(*_log_filters(start_date, end_date, employee_id, decision))
+    
+    if cursor:
+        # Reprendre strictement après le dernier log de la page précédente (timestamp, id)
+        cursor_timestamp, cursor_id = _decode_cursor(cursor)
+        query = query.filter(or_(
+            AccessLog.timestamp < cursor_timestamp,
+            and_(AccessLog.timestamp == cursor_timestamp, AccessLog.id < cursor_id)
+        ))
     
+    logs = query.order_by(desc(AccessLog.timestamp), desc(AccessLog.id)).offset(skip).limit(limit).all()
+    
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(logs[-1])
+    return logs
+
+def _log_filters(
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    employee_id: Optional[int],
+    decision: Optional[str]
+) -> list:
+    filters = []
     if start_date:
-        query = query.filter(AccessLog.timestamp >= start_date)
+        filters.append(AccessLog.timestamp >= start_date)
     if end_date:
-        query = query.filter(AccessLog.timestamp <= end_date)
+        filters.append(AccessLog.timestamp <= end_date)
     if employee_id:
-        query = query.filter(AccessLog.employee_id == employee_id)
+        filters.append(AccessLog.employee_id == employee_id)
     if decision:
-        query = query.filter(AccessLog.decision == decision)
-    
-    logs = query.order_by(desc(AccessLog.timestamp)).offset(skip).limit(limit).all()
-    return logs
+        filters.append(AccessLog.decision == decision)
+    return filters
+
+def _encode_cursor(log: AccessLog) -> str:
+    return base64.urlsafe_b64encode(f"{log.timestamp.isoformat()}|{log.id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+@router.get("/export")
+def export_logs(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    employee_id: Optional[int] = Query(None),
+    decision: Optional[str] = Query(None),
+    current_user = Depends(get_current_user)
+):
+    """
+    Exporter les logs filtrés (ordre chronologique) en NDJSON ou CSV : la réponse est
+    produite par morceaux depuis un curseur côté serveur, en mémoire constante
+    """
+    filters = _log_filters(start_date, end_date, employee_id, decision)
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(
+        _export_chunks(filters, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="access_logs.{format}"'}
+    )
+
+def _export_chunks(filters: list, format: str) -> Iterator[str]:
+    # Session propre au flux : elle vit aussi longtemps que la réponse
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            select(*(getattr(AccessLog, column) for column in EXPORT_COLUMNS))
+            .where(*filters)
+            .order_by(AccessLog.timestamp, AccessLog.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if format == "csv":
+            writer.writerow(EXPORT_COLUMNS)
+        
+        for rows in result.partitions():
+            for row in rows:
+                if format == "csv":
+                    writer.writerow([
+                        value.isoformat() if isinstance(value, datetime) else value
+                        for value in row
+                    ])
+                else:
+                    record = row._asdict()
+                    record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+                    buffer.write(json.dumps(record) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        
+        # En-tête CSV seul si aucun log
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
 
 @router.get("/stats")
-async def get_stats(
+def get_stats(
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
     """
     Obtenir des statistiques sur les accès
     """
-    total_logs = db.query(AccessLog).count()
-    granted_logs = db.query(AccessLog).filter(AccessLog.decision == "granted").count()
-    denied_logs = db.query(AccessLog).filter(AccessLog.decision == "denied").count()
+    # Une seule agrégation conditionnelle sur les rollups journaliers (tous employés)
+    total_logs, granted_logs, denied_logs = db.execute(
+        select(
+            func.coalesce(func.sum(AccessLogRollup.count), 0),
+            func.coalesce(func.sum(AccessLogRollup.count).filter(AccessLogRollup.decision == "granted"), 0),
+            func.coalesce(func.sum(AccessLogRollup.count).filter(AccessLogRollup.decision == "denied"), 0)
+        ).where(
+            AccessLogRollup.granularity == "day",
+            AccessLogRollup.employee_id == ALL_EMPLOYEES
+        )
+    ).one()
+    total_logs, granted_logs, denied_logs = int(total_logs), int(granted_logs), int(denied_logs)
     
     return {
         "total_access_attempts": total_logs,
@@ -60,3 +175,65 @@ async def get_stats(
         "grant_rate": round(granted_logs / total_logs * 100, 2) if total_logs > 0 else 0
     }
 
+def _utc(value: datetime) -> datetime:
+    # Les timestamps des logs sont en UTC sans fuseau
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+@router.get("/stats/histogram", response_model=StatsHistogramResponse)
+def get_stats_histogram(
+    interval: str = Query("hour", pattern="^(hour|day)$"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    employee_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Histogramme des accès par heure ou par jour (par défaut : dernières 24 heures ou
+    derniers 30 jours), lu dans les rollups sans parcourir les logs
+    """
+    step = timedelta(hours=1) if interval == "hour" else timedelta(days=1)
+    end = _utc(end_date) if end_date else datetime.utcnow()
+    start = _utc(start_date) if start_date else end - (24 if interval == "hour" else 30) * step
+    first = bucket_start(start, interval)
+    
+    if end < first:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_date is before start_date")
+    if (end - first) / step >= MAX_HISTOGRAM_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Maximum {MAX_HISTOGRAM_BUCKETS} buckets per histogram"
+        )
+    
+    rows = db.execute(
+        select(
+            AccessLogRollup.bucket,
+            func.sum(AccessLogRollup.count),
+            func.coalesce(func.sum(AccessLogRollup.count).filter(AccessLogRollup.decision == "granted"), 0),
+            func.coalesce(func.sum(AccessLogRollup.count).filter(AccessLogRollup.decision == "denied"), 0)
+        ).where(
+            AccessLogRollup.granularity == interval,
+            AccessLogRollup.employee_id == (employee_id or ALL_EMPLOYEES),
+            AccessLogRollup.bucket >= first,
+            AccessLogRollup.bucket <= end
+        ).group_by(AccessLogRollup.bucket)
+    ).all()
+    counts = {row[0]: row[1:] for row in rows}
+    
+    # Intervalles sans accès inclus à zéro
+    buckets = []
+    bucket = first
+    while bucket <= end:
+        total, granted, denied = counts.get(bucket, (0, 0, 0))
+        buckets.append(StatsBucket(bucket=bucket, total=int(total), granted=int(granted), denied=int(denied)))
+        bucket += step
+    
+    return StatsHistogramResponse(
+        interval=interval,
+        start_date=first,
+        end_date=end,
+        employee_id=employee_id,
+        buckets=buckets
+    )
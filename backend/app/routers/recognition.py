@@ -1,123 +1,483 @@
 """
 Face recognition routes
 """
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from datetime import datetime
-import os
-import shutil
 from pathlib import Path
+from typing import Optional, List, Tuple
+import io
+import asyncio
+import zipfile
+import numpy as np
 
-from app.database import get_db, Employee, AccessLog
-from app.models import RecognitionResponse
+from app.database import get_db, SessionLocal, Employee, AccessLog
+from app.models import (
+    RecognitionResponse, BatchRecognitionItem, BatchRecognitionResponse, StreamFace, StreamFrameResponse
+)
 from app.config import settings
-from app.ml_module.face_recognition import FaceRecognitionService
+from app.ml_module.face_recognition import FaceRecognitionService, get_face_service, is_face_service_ready
+from app.ml_module.tracking import FaceTracker, Track
+from app.ml_module.executor import run_ml
+from app.log_writer import get_log_writer
+from app.probe_store import get_probe_store
 
 router = APIRouter()
 
+async def _log_attempts(
+    background_tasks: Optional[BackgroundTasks],
+    attempts: List[Tuple[dict, bytes]],
+    face_service: FaceRecognitionService
+):
+    """
+    Journaliser les tentatives (log, image) et conserver leurs images si demandé.
+    
+    L'écriture des images (réduction, recompression) se fait dans le pool ML après la
+    réponse ; sans background_tasks (chemin d'erreur, où les tâches ne sont pas exécutées),
+    avant de répondre. image_path ne reste renseigné que si l'image a bien été écrite :
+    les logs non durables sont confiés à l'écrivain après l'écriture de leur image,
+    les logs durables sont écrits tout de suite puis corrigés en cas d'échec.
+    """
+    if not settings.SAVE_PROBE_IMAGES:
+        await _write_logs([log_row for log_row, _ in attempts])
+        return
+    
+    probe_store = get_probe_store()
+    for log_row, _ in attempts:
+        log_row["image_path"] = str(probe_store.reserve(log_row["decision"], log_row["timestamp"]))
+    
+    sync_decisions = get_log_writer().sync_decisions
+    await _write_logs([log_row for log_row, _ in attempts if log_row["decision"] in sync_decisions])
+    
+    if background_tasks is None:
+        await _save_probe_images(attempts, face_service)
+    else:
+        background_tasks.add_task(_save_probe_images, attempts, face_service)
+
+async def _save_probe_images(attempts: List[Tuple[dict, bytes]], face_service: FaceRecognitionService):
+    probe_store = get_probe_store()
+    detect = face_service.detect_faces if probe_store.face_only else None
+    sync_decisions = get_log_writer().sync_decisions
+    
+    pending = []
+    failed_paths = []
+    for log_row, contents in attempts:
+        saved = await run_ml(probe_store.save, Path(log_row["image_path"]), contents, detect)
+        if log_row["decision"] in sync_decisions:
+            if not saved:
+                failed_paths.append(log_row["image_path"])
+            continue
+        if not saved:
+            log_row["image_path"] = None
+        pending.append(log_row)
+    
+    get_log_writer().write_many(pending)
+    if failed_paths:
+        await run_in_threadpool(_clear_image_paths, failed_paths)
+
+def _clear_image_paths(paths: List[str]):
+    """
+    Retirer des logs déjà écrits le chemin d'une image dont l'écriture a échoué
+    """
+    db = SessionLocal()
+    try:
+        db.query(AccessLog).filter(AccessLog.image_path.in_(paths)).update(
+            {AccessLog.image_path: None}, synchronize_session=False
+        )
+        db.commit()
+    except Exception as e:
+        print(f"Error clearing probe image paths: {e}")
+    finally:
+        db.close()
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+async def _read_batch_images(files: List[UploadFile]) -> List[Tuple[str, bytes]]:
+    """
+    Lire les images envoyées en multipart ; une archive zip est dépliée en ses images.
+    Le nombre d'images et la taille de chacune sont vérifiés avant toute décompression.
+    """
+    max_images = settings.RECOGNITION_BATCH_MAX_IMAGES
+    max_bytes = settings.RECOGNITION_BATCH_MAX_IMAGE_BYTES
+    images = []
+    
+    def check(filename: str, size: int):
+        if len(images) >= max_images:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Maximum {max_images} images per batch"
+            )
+        if size > max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Image too large: {filename} (maximum {max_bytes} bytes)"
+            )
+    
+    for file in files:
+        contents = await file.read()
+        filename = file.filename or f"image_{len(images)}"
+        
+        if filename.lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+                    for entry in archive.infolist():
+                        if entry.is_dir() or Path(entry.filename).suffix.lower() not in IMAGE_EXTENSIONS:
+                            continue
+                        # Taille déclarée : la lecture d'une entrée s'arrête à file_size octets
+                        check(entry.filename, entry.file_size)
+                        images.append((entry.filename, archive.read(entry)))
+            except zipfile.BadZipFile:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid zip archive: {filename}"
+                )
+        else:
+            check(filename, len(contents))
+            images.append((filename, contents))
+    
+    return images
+
 @router.post("/recognize", response_model=RecognitionResponse)
 async def recognize_face(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    face_service: FaceRecognitionService = Depends(get_face_service)
 ):
     """
     Reconnaître un visage à partir d'une image
     """
-    # Sauvegarder temporairement l'image
-    temp_dir = Path(settings.UPLOAD_DIR) / "temp"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    
-    temp_path = temp_dir / f"recognition_{datetime.now().timestamp()}.jpg"
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # L'image est décodée directement depuis le corps de la requête
+    contents = await file.read()
     
     try:
-        # Initialiser le service de reconnaissance
-        face_service = FaceRecognitionService()
+        # Inférence et recherche dans le pool ML, journalisation dans le pool de threads
+        embedding = await run_ml(face_service.get_embedding, contents)
+        result = None
+        if embedding is not None:
+            result = await run_ml(face_service.search_in_index, embedding)
+        response, log_row = await run_in_threadpool(_decide_recognition, db, embedding is not None, result)
+    
+    except Exception as e:
+        # En cas d'erreur
+        # Les tâches d'arrière-plan ne sont pas exécutées après une erreur
+        await _log_attempts(None, [(_log_row(None, None, None, "denied"), contents)], face_service)
         
-        # Obtenir l'embedding
-        embedding = face_service.get_embedding(str(temp_path))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Recognition error: {str(e)}"
+        )
+    
+    await _log_attempts(background_tasks, [(log_row, contents)], face_service)
+    return response
+
+def _log_row(
+    employee_id: Optional[int],
+    employee_name: Optional[str],
+    score: Optional[float],
+    decision: str,
+    image_path: Optional[str] = None
+) -> dict:
+    return {
+        "employee_id": employee_id,
+        "employee_name": employee_name,
+        "recognition_score": score,
+        "decision": decision,
+        "timestamp": datetime.utcnow(),
+        "image_path": image_path
+    }
+
+async def _write_logs(log_rows: List[dict]):
+    """
+    Confier les logs à l'écrivain groupé ; n'attendre que ceux dont la décision
+    exige une écriture durable (LOG_SYNC_DECISIONS)
+    """
+    futures = [future for future in get_log_writer().write_many(log_rows) if future is not None]
+    for future in futures:
+        await asyncio.wrap_future(future)
+
+def _decide_recognition(
+    db: Session,
+    face_found: bool,
+    result: Optional[dict]
+) -> Tuple[RecognitionResponse, dict]:
+    """
+    Décider de l'accès à partir du résultat de la recherche ; retourne la réponse et le log de la tentative
+    """
+    if not face_found:
+        # Pas de visage détecté
+        return RecognitionResponse(
+            recognized=False,
+            decision="denied",
+            message="No face detected in the image"
+        ), _log_row(None, None, None, "denied")
+    
+    if result and result['distance'] < settings.SIMILARITY_THRESHOLD:
+        # Visage reconnu
+        employee = db.query(Employee).filter(Employee.id == result['employee_id']).first()
+        score = float(1 - result['distance'])  # Convertir distance en score
         
-        if embedding is None:
-            # Pas de visage détecté
-            log = AccessLog(
-                employee_id=None,
-                employee_name=None,
-                recognition_score=None,
-                decision="denied",
-                image_path=str(temp_path)
-            )
-            db.add(log)
-            db.commit()
-            
-            return RecognitionResponse(
+        return RecognitionResponse(
+            recognized=True,
+            employee_id=employee.id if employee else None,
+            employee_name=employee.name if employee else None,
+            confidence_score=score,
+            decision="granted",
+            message=f"Access granted for {employee.name if employee else 'Unknown'}"
+        ), _log_row(
+            employee.id if employee else None,
+            employee.name if employee else None,
+            score,
+            "granted"
+        )
+    
+    # Visage non reconnu
+    return RecognitionResponse(
+        recognized=False,
+        decision="denied",
+        message="Face not recognized. Access denied."
+    ), _log_row(None, None, float(1 - result['distance']) if result else None, "denied")
+
+@router.post("/recognize/batch", response_model=BatchRecognitionResponse)
+async def recognize_faces_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    face_service: FaceRecognitionService = Depends(get_face_service)
+):
+    """
+    Reconnaître les visages de plusieurs images (multipart ou archive zip) :
+    un seul passage FaceNet, une seule recherche FAISS et logs confiés en un lot à l'écrivain groupé
+    """
+    images = await _read_batch_images(files)
+    
+    # Embeddings de toutes les images puis recherche vectorisée sur la matrice entière
+    embeddings = await run_ml(face_service.get_embeddings, [contents for _, contents in images])
+    found = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    
+    matches: List[Optional[dict]] = [None] * len(images)
+    if found:
+        search_results = await run_ml(face_service.search_batch, np.stack([embeddings[i] for i in found]))
+        for i, result in zip(found, search_results):
+            matches[i] = result
+    
+    # Charger en une requête tous les employés reconnus
+    matched_ids = {
+        match['employee_id'] for match in matches
+        if match and match['distance'] < settings.SIMILARITY_THRESHOLD
+    }
+    employees = await run_in_threadpool(_load_employees, db, matched_ids)
+    
+    results = []
+    attempts = []
+    for i, (filename, contents) in enumerate(images):
+        match = matches[i]
+        score = float(1 - match['distance']) if match else None
+        
+        if embeddings[i] is None:
+            item = BatchRecognitionItem(
+                filename=filename,
                 recognized=False,
                 decision="denied",
                 message="No face detected in the image"
             )
-        
-        # Rechercher dans l'index FAISS
-        result = face_service.search_in_index(embedding)
-        
-        if result and result['distance'] < settings.SIMILARITY_THRESHOLD:
-            # Visage reconnu
-            employee = db.query(Employee).filter(Employee.id == result['employee_id']).first()
-            
-            log = AccessLog(
-                employee_id=employee.id if employee else None,
-                employee_name=employee.name if employee else None,
-                recognition_score=float(1 - result['distance']),  # Convertir distance en score
-                decision="granted",
-                image_path=str(temp_path)
-            )
-            db.add(log)
-            db.commit()
-            
-            return RecognitionResponse(
+        elif match and match['distance'] < settings.SIMILARITY_THRESHOLD:
+            employee = employees.get(match['employee_id'])
+            item = BatchRecognitionItem(
+                filename=filename,
                 recognized=True,
                 employee_id=employee.id if employee else None,
                 employee_name=employee.name if employee else None,
-                confidence_score=float(1 - result['distance']),
+                confidence_score=score,
                 decision="granted",
                 message=f"Access granted for {employee.name if employee else 'Unknown'}"
             )
         else:
-            # Visage non reconnu
-            log = AccessLog(
-                employee_id=None,
-                employee_name=None,
-                recognition_score=float(1 - result['distance']) if result else None,
-                decision="denied",
-                image_path=str(temp_path)
-            )
-            db.add(log)
-            db.commit()
-            
-            return RecognitionResponse(
+            item = BatchRecognitionItem(
+                filename=filename,
                 recognized=False,
                 decision="denied",
                 message="Face not recognized. Access denied."
             )
+        
+        results.append(item)
+        attempts.append((_log_row(item.employee_id, item.employee_name, score, item.decision), contents))
     
-    except Exception as e:
-        # En cas d'erreur
-        log = AccessLog(
-            employee_id=None,
-            employee_name=None,
-            recognition_score=None,
-            decision="denied",
-            image_path=str(temp_path)
-        )
-        db.add(log)
-        db.commit()
+    # Logs confiés à l'écrivain groupé
+    await _log_attempts(background_tasks, attempts, face_service)
+    
+    granted = sum(1 for item in results if item.decision == "granted")
+    return BatchRecognitionResponse(
+        total=len(results),
+        granted=granted,
+        denied=len(results) - granted,
+        results=results
+    )
+
+def _load_employees(db: Session, employee_ids) -> dict:
+    if not employee_ids:
+        return {}
+    return {
+        employee.id: employee
+        for employee in db.query(Employee).filter(Employee.id.in_(employee_ids)).all()
+    }
+
+def _process_stream_frame(
+    contents: bytes,
+    tracker: FaceTracker,
+    face_service: FaceRecognitionService
+) -> List[StreamFace]:
+    """
+    Traiter une image du flux : détection sur chaque image, FaceNet uniquement pour
+    les pistes qui en ont besoin, un log par décision nouvelle d'une piste
+    """
+    frame = face_service.detect_faces(contents)
+    if frame is None:
+        tracker.update(np.empty((0, 4)), np.empty(0))
+        return []
+    
+    visible, to_embed = tracker.update(frame.boxes, frame.probs)
+    
+    if to_embed:
+        # Les visages rejoignent les lots FaceNet partagés avec les autres flux (pool d'inférence s'il existe)
+        futures = [
+            face_service.batcher.submit(face_service.align_face(frame, frame.boxes[d]))
+            for _, d in to_embed
+        ]
+        results = face_service.search_batch(np.stack([future.result() for future in futures]))
         
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Recognition error: {str(e)}"
-        )
+        matched_ids = {
+            result['employee_id'] for result in results
+            if result and result['distance'] < settings.SIMILARITY_THRESHOLD
+        }
+        employees = _load_stream_employees(matched_ids)
+        
+        new_logs = []
+        for (track, _), result in zip(to_embed, results):
+            tracker.mark_embedded(track)
+            track.confidence_score = float(1 - result['distance']) if result else None
+            employee = employees.get(result['employee_id']) if result else None
+            if result and result['distance'] < settings.SIMILARITY_THRESHOLD:
+                track.decision = "granted"
+                track.employee_id = employee.id if employee else None
+                track.employee_name = employee.name if employee else None
+            else:
+                track.decision = "denied"
+                track.employee_id = None
+                track.employee_name = None
+            
+            # Une seule entrée de journal par piste, sauf si la décision change
+            if track.logged_decision != (track.employee_id, track.decision):
+                track.logged_decision = (track.employee_id, track.decision)
+                new_logs.append(_log_row(
+                    track.employee_id, track.employee_name, track.confidence_score, track.decision
+                ))
+        
+        # Attendre les écritures durables avant de répondre pour cette image
+        for future in get_log_writer().write_many(new_logs):
+            if future is not None:
+                future.result()
     
+    return [_stream_face(track) for track in visible]
+
+def _load_stream_employees(employee_ids) -> dict:
+    """
+    Session courte par recherche : un flux ne garde pas de connexion du pool
+    (ni de transaction ouverte) entre deux images
+    """
+    if not employee_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        return _load_employees(db, employee_ids)
     finally:
-        # Nettoyer le fichier temporaire après un délai (optionnel)
-        # Pour l'instant, on garde les images pour debug
-        pass
+        db.close()
+
+def _stream_face(track: Track) -> StreamFace:
+    if track.decision == "granted":
+        message = f"Access granted for {track.employee_name or 'Unknown'}"
+    elif track.decision == "denied":
+        message = "Face not recognized. Access denied."
+    else:
+        message = "Waiting for a clearer view of the face"
+    
+    return StreamFace(
+        track_id=track.track_id,
+        box=[float(v) for v in track.box],
+        recognized=track.decision == "granted",
+        employee_id=track.employee_id,
+        employee_name=track.employee_name,
+        confidence_score=track.confidence_score,
+        decision=track.decision or "pending",
+        message=message
+    )
 
+@router.websocket("/stream")
+async def recognize_stream(
+    websocket: WebSocket
+):
+    """
+    Reconnaissance sur un flux continu : le client envoie chaque image (JPEG) en message
+    binaire et reçoit pour chacune un message JSON (StreamFrameResponse) sur la même socket.
+    
+    Les visages sont suivis d'une image à l'autre ; si le traitement prend du retard,
+    seule l'image la plus récente est traitée.
+    """
+    if not is_face_service_ready():
+        # 1013 : réessayer plus tard (service en cours de chargement)
+        await websocket.close(code=1013)
+        return
+    face_service = get_face_service()
+    
+    await websocket.accept()
+    tracker = FaceTracker(
+        iou_threshold=settings.STREAM_IOU_THRESHOLD,
+        max_missed_frames=settings.STREAM_MAX_MISSED_FRAMES,
+        min_confidence=settings.STREAM_MIN_CONFIDENCE,
+        retry_interval=settings.STREAM_RETRY_INTERVAL
+    )
+    state = {"latest": None, "dropped": 0, "closed": False}
+    frame_ready = asyncio.Event()
+    
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    if state["latest"] is not None:
+                        state["dropped"] += 1
+                    state["latest"] = message["bytes"]
+                    frame_ready.set()
+        finally:
+            state["closed"] = True
+            frame_ready.set()
+    
+    receiver = asyncio.create_task(receive_frames())
+    frame_number = 0
+    try:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if state["closed"]:
+                break
+            
+            contents, state["latest"] = state["latest"], None
+            dropped, state["dropped"] = state["dropped"], 0
+            frame_number += 1
+            
+            try:
+                # Inférence (et journalisation éventuelle) dans le pool ML
+                faces = await run_ml(_process_stream_frame, contents, tracker, face_service)
+                response = StreamFrameResponse(frame=frame_number, dropped_frames=dropped, faces=faces)
+            except Exception as e:
+                print(f"Error processing stream frame: {e}")
+                response = StreamFrameResponse(frame=frame_number, dropped_frames=dropped, faces=[], error=str(e))
+            
+            await websocket.send_json(response.model_dump())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
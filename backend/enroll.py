@@ -0,0 +1,69 @@
+"""
+Bulk enrollment command
+Enrôler en masse les employés d'un répertoire ou d'une archive zip :
+
+    python enroll.py /chemin/vers/site.zip
+    python enroll.py /chemin/vers/photos --manifest employes.csv --processes 8
+
+Le manifeste CSV (employee_id, name, email, role, photos) est lu dans la source
+(manifest.csv) si --manifest n'est pas donné. Relancer la commande reprend un
+enrôlement interrompu.
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from app.config import settings
+from app.database import engine, Base
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bulk employee enrollment")
+    parser.add_argument("source", type=Path, help="Directory or zip archive with the photos")
+    parser.add_argument("--manifest", type=Path, help="CSV manifest (default: manifest.csv in the source)")
+    parser.add_argument("--batch-size", type=int, default=settings.ENROLLMENT_BATCH_SIZE,
+                        help="Photos analysed and committed per batch")
+    parser.add_argument("--processes", type=int, default=-1,
+                        help="Inference processes for decoding and detection (-1 = one per core, 0 = none)")
+    args = parser.parse_args()
+
+    # Avant la création du service : pool de processus d'inférence dédié à la commande
+    settings.INFERENCE_PROCESSES = args.processes
+
+    from app.enrollment import open_source, read_manifest, run_enrollment, MANIFEST_NAME
+    from app.ml_module.face_recognition import init_face_service, shutdown_face_service
+
+    Base.metadata.create_all(bind=engine)
+    source = open_source(args.source)
+    try:
+        if args.manifest:
+            manifest_text = args.manifest.read_text(encoding="utf-8-sig")
+        else:
+            manifest_text = source.read(MANIFEST_NAME).decode("utf-8-sig")
+        rows = read_manifest(manifest_text)
+
+        print(f"Loading models for {len(rows)} employees...")
+        face_service = init_face_service()
+
+        def report(progress):
+            skipped = sum(progress.photos_skipped.values())
+            print(
+                f"{progress.photos_processed}/{progress.photos_total} photos "
+                f"({progress.photos_per_second} photos/s) - {progress.photos_added} added, {skipped} skipped",
+                flush=True
+            )
+
+        progress = run_enrollment(face_service, source, rows, batch_size=args.batch_size, on_progress=report)
+    finally:
+        source.close()
+        shutdown_face_service()
+
+    print(f"Enrollment {progress.status}: {progress.employees_created} employees created, "
+          f"{progress.photos_added} photos added")
+    for reason, count in sorted(progress.photos_skipped.items()):
+        print(f"  skipped ({reason}): {count}")
+    for error in progress.errors:
+        print(f"  error: {error}")
+    return 0 if progress.status == "completed" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,22 +4,42 @@ Système de contrôle d'accès intelligent par reconnaissance faciale
 """
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from contextlib import asynccontextmanager
+import threading
 import uvicorn
 
-from app.database import engine, Base
+from app.database import engine, async_engine, Base, dispose_engines
+from app.db_pool import pool_metrics
 from app.routers import auth, employees, recognition, logs
 from app.config import settings
+from app.auth import get_current_user
+from app.ml_module.face_recognition import (
+    init_face_service, shutdown_face_service, is_face_service_ready, get_face_service, face_service_error
+)
+from app.ml_module.executor import shutdown_ml_executor
+from app.log_writer import start_log_writer, stop_log_writer
+from app.probe_store import start_probe_sweeper, stop_probe_sweeper
 
 # Créer les tables au démarrage
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     Base.metadata.create_all(bind=engine)
+    start_log_writer()
+    start_probe_sweeper()
+    
+    # Charger les modèles et l'index une seule fois, en arrière-plan pour que /health réponde
+    threading.Thread(target=init_face_service, name="face-service-init", daemon=True).start()
     yield
     # Shutdown
-    pass
+    stop_probe_sweeper()
+    shutdown_ml_executor()
+    shutdown_face_service()
+    # Écrire les derniers logs en file
+    stop_log_writer()
+    await dispose_engines()
 
 app = FastAPI(
     title="Face Recognition Access Control System",
@@ -39,6 +59,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -59,6 +80,46 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Prêt uniquement quand les modèles et l'index FAISS sont chargés
+    """
+    error = face_service_error()
+    if error is not None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "failed", "error": error}
+        )
+    if not is_face_service_ready():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "loading"}
+        )
+    return {"status": "ready"}
+
+@app.get("/health/cache")
+async def cache_stats(current_user = Depends(get_current_user)):
+    """
+    Compteurs des caches d'embeddings et de décisions (succès, échecs, évictions), réservés aux administrateurs
+    """
+    if not is_face_service_ready():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "loading"}
+        )
+    return get_face_service().cache_stats()
+
+@app.get("/health/db")
+async def database_pool_stats(current_user = Depends(get_current_user)):
+    """
+    Métriques des pools de connexions (connexions empruntées, attentes, latence d'emprunt), réservées aux administrateurs
+    """
+    stats = {"sync": pool_metrics(engine)}
+    if async_engine is not None:
+        stats["async"] = pool_metrics(async_engine)
+    return stats
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,65 @@
+"""
+Configuration des tests : base SQLite et répertoires temporaires, définis avant
+le premier import de app.config
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+import torch
+
+_work_dir = tempfile.mkdtemp(prefix="face-recognition-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_work_dir}/test.db"
+os.environ["UPLOAD_DIR"] = f"{_work_dir}/uploads"
+os.environ["MODELS_DIR"] = f"{_work_dir}/models"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.ml_module import face_recognition  # noqa: E402
+from app.ml_module.face_recognition import FaceRecognitionService  # noqa: E402
+
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        # Chaque test repart de tables vides
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+        session.commit()
+        session.close()
+
+class _NoModel(torch.nn.Module):
+    """Remplace MTCNN / FaceNet : ces tests n'exécutent aucune inférence"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+@pytest.fixture
+def make_service(monkeypatch, tmp_path):
+    monkeypatch.setattr(face_recognition, "MTCNN", _NoModel)
+    monkeypatch.setattr(face_recognition, "InceptionResnetV1", _NoModel)
+    monkeypatch.setattr(settings, "MODELS_DIR", str(tmp_path / "models"))
+    monkeypatch.setattr(settings, "INFERENCE_PROCESSES", 0)
+    monkeypatch.setattr(settings, "INDEX_WAL_FSYNC", False)
+
+    services = []
+    def make() -> FaceRecognitionService:
+        service = FaceRecognitionService()
+        services.append(service)
+        return service
+    yield make
+    for service in services:
+        service.close()
@@ -0,0 +1,67 @@
+"""
+Cache des principals JWT : invalidation après modification d'un administrateur
+"""
+from datetime import timedelta
+
+from sqlalchemy import update
+
+from app import auth
+from app.auth import create_access_token, invalidate_principals, resolve_principal
+from app.database import AdminUser
+
+def _admin(db, email: str = "admin@example.com") -> AdminUser:
+    admin = AdminUser(email=email, hashed_password="x", is_active=True)
+    db.add(admin)
+    db.commit()
+    return admin
+
+def test_validated_token_is_served_from_cache(db):
+    invalidate_principals()
+    admin = _admin(db)
+    token = create_access_token({"sub": admin.email})
+
+    principal = resolve_principal(token, db)
+    assert principal == auth.Principal(id=admin.id, email=admin.email)
+
+    # Modification hors ORM : invisible pour le cache, qui n'interroge plus la base
+    db.execute(update(AdminUser).values(is_active=False))
+    db.commit()
+    assert resolve_principal(token, db) == principal
+
+def test_deactivating_an_admin_invalidates_cached_tokens(db):
+    invalidate_principals()
+    admin = _admin(db)
+    token = create_access_token({"sub": admin.email})
+    assert resolve_principal(token, db) is not None
+
+    admin.is_active = False
+    db.commit()
+    assert resolve_principal(token, db) is None
+
+def test_deleting_an_admin_invalidates_cached_tokens(db):
+    invalidate_principals()
+    admin = _admin(db)
+    token = create_access_token({"sub": admin.email})
+    assert resolve_principal(token, db) is not None
+
+    db.delete(admin)
+    db.commit()
+    assert resolve_principal(token, db) is None
+
+def test_rolled_back_change_keeps_the_cache(db):
+    invalidate_principals()
+    admin = _admin(db)
+    token = create_access_token({"sub": admin.email})
+    assert resolve_principal(token, db) is not None
+
+    admin.is_active = False
+    db.flush()
+    db.rollback()
+    assert len(auth._principal_cache) == 1
+
+def test_expired_cached_token_is_rejected(db):
+    invalidate_principals()
+    admin = _admin(db)
+    token = create_access_token({"sub": admin.email}, expires_delta=timedelta(seconds=-1))
+    assert resolve_principal(token, db) is None
+    assert len(auth._principal_cache) == 0
@@ -0,0 +1,90 @@
+"""
+Micro-batching des inférences : regroupement, taille maximale, erreurs et arrêt
+"""
+import threading
+
+import pytest
+
+from app.ml_module.batching import BatchScheduler
+
+class _Recorder:
+    """batch_fn qui mémorise les lots reçus et peut être bloqué pour accumuler la file"""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, items):
+        self.gate.wait()
+        self.batches.append(list(items))
+        return [item * 2 for item in items]
+
+def test_concurrent_items_share_one_batch():
+    recorder = _Recorder()
+    scheduler = BatchScheduler(recorder, max_batch_size=8, max_wait_ms=200)
+    try:
+        futures = [scheduler.submit(i) for i in range(5)]
+        assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6, 8]
+        assert recorder.batches == [[0, 1, 2, 3, 4]]
+    finally:
+        scheduler.stop()
+
+def test_batches_are_capped_at_max_size():
+    recorder = _Recorder()
+    recorder.gate.clear()
+    scheduler = BatchScheduler(recorder, max_batch_size=3, max_wait_ms=50)
+    try:
+        # Le premier lot bloque le thread : les suivants s'accumulent dans la file
+        first = scheduler.submit(0)
+        futures = [scheduler.submit(i) for i in range(1, 8)]
+        recorder.gate.set()
+        assert first.result(timeout=5) == 0
+        assert [future.result(timeout=5) for future in futures] == [i * 2 for i in range(1, 8)]
+        assert all(len(batch) <= 3 for batch in recorder.batches)
+        assert sum(recorder.batches, []) == list(range(8))
+    finally:
+        scheduler.stop()
+
+def test_batch_error_is_raised_in_every_caller():
+    def fail(items):
+        raise ValueError("inference failed")
+
+    scheduler = BatchScheduler(fail, max_batch_size=4, max_wait_ms=100)
+    try:
+        futures = [scheduler.submit(i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError, match="inference failed"):
+                future.result(timeout=5)
+    finally:
+        scheduler.stop()
+
+def test_stop_drains_pending_items_and_rejects_new_ones():
+    recorder = _Recorder()
+    recorder.gate.clear()
+    scheduler = BatchScheduler(recorder, max_batch_size=2, max_wait_ms=0)
+    futures = [scheduler.submit(i) for i in range(5)]
+
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+    recorder.gate.set()
+    stopper.join(timeout=5)
+
+    assert [future.result(timeout=0) for future in futures] == [0, 2, 4, 6, 8]
+    with pytest.raises(RuntimeError):
+        scheduler.submit(5)
+
+def test_cancelled_items_are_skipped():
+    recorder = _Recorder()
+    recorder.gate.clear()
+    scheduler = BatchScheduler(recorder, max_batch_size=1, max_wait_ms=0)
+    try:
+        first = scheduler.submit(0)
+        cancelled = scheduler.submit(1)
+        assert cancelled.cancel()
+        last = scheduler.submit(2)
+        recorder.gate.set()
+        assert (first.result(timeout=5), last.result(timeout=5)) == (0, 4)
+        assert [1] not in recorder.batches
+    finally:
+        scheduler.stop()
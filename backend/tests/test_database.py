@@ -0,0 +1,18 @@
+"""
+URL du moteur asynchrone optionnel
+"""
+from app.config import settings
+from app.database import _async_url
+
+def test_async_url_is_derived_for_postgresql_only(monkeypatch):
+    monkeypatch.setattr(settings, "DB_ASYNC_URL", "")
+    monkeypatch.setattr(settings, "DATABASE_URL", "postgresql://user:secret@db:5432/access")
+    assert _async_url() == "postgresql+asyncpg://user:secret@db:5432/access"
+
+    monkeypatch.setattr(settings, "DATABASE_URL", "sqlite:///./access.db")
+    assert _async_url() is None
+
+def test_explicit_async_url_wins(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URL", "sqlite:///./access.db")
+    monkeypatch.setattr(settings, "DB_ASYNC_URL", "sqlite+aiosqlite:///./access.db")
+    assert _async_url() == "sqlite+aiosqlite:///./access.db"
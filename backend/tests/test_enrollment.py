@@ -0,0 +1,175 @@
+"""
+Enrôlement en masse : publication de l'index, chemins confinés à la source, reprise
+"""
+import hashlib
+import zipfile
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from app.config import settings
+from app.database import SessionLocal, EmployeePhoto, IndexState
+from app import enrollment
+from app.enrollment import (
+    DirectorySource, EnrollmentProgress, ZipSource, get_enrollment_job, read_manifest, run_enrollment,
+    start_enrollment_job
+)
+from app.ml_module.face_recognition import PhotoFaces
+
+MANIFEST = "employee_id,name,email\nE1,Alice,alice@example.com\nE2,Bob,bob@example.com\n"
+
+def _embedding(contents: bytes) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(contents).digest()[:4], "little")
+    vector = np.random.default_rng(seed).standard_normal(settings.EMBEDDING_SIZE).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def service(make_service, monkeypatch, tmp_path, db):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    service = make_service()
+    # Un visage par photo, embedding dérivé du contenu
+    service.analyze_photos = lambda images: [PhotoFaces(_embedding(image), 1) for image in images]
+    return service
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "source"
+    for employee_id in ("E1", "E2"):
+        (root / employee_id).mkdir(parents=True)
+        for name in ("front.jpg", "side.jpg"):
+            (root / employee_id / name).write_bytes(f"{employee_id}/{name}".encode())
+    return DirectorySource(root)
+
+def _photo_count() -> int:
+    session = SessionLocal()
+    try:
+        return session.query(EmployeePhoto).count()
+    finally:
+        session.close()
+
+def _published_version():
+    session = SessionLocal()
+    try:
+        state = session.query(IndexState).filter(IndexState.id == 1).first()
+        return (state.generation, state.wal_size) if state else None
+    finally:
+        session.close()
+
+def test_enrollment_indexes_and_publishes_the_snapshot(service, source):
+    progress = run_enrollment(service, source, read_manifest(MANIFEST))
+
+    assert progress.status == "completed"
+    assert (progress.employees_created, progress.photos_added) == (2, 4)
+    assert len(service.id_map) == 4
+    # Le snapshot écrit en fin d'enrôlement est la version publiée
+    assert service.gallery.version[0] >= 1
+    assert _published_version() == service.gallery.version
+
+def test_paths_outside_the_source_are_rejected(service, source, tmp_path):
+    secret = tmp_path / "secret.jpg"
+    secret.write_bytes(b"secret")
+    (source.root / "E1" / "link.jpg").symlink_to(secret)
+    manifest = (
+        "employee_id,name,photos\n"
+        f"E1,Alice,E1/front.jpg;../secret.jpg;{secret};E1/link.jpg\n"
+        "..,Mallory,\n"
+    )
+
+    progress = run_enrollment(service, source, read_manifest(manifest))
+
+    assert progress.status == "completed"
+    assert progress.photos_added == 1
+    assert progress.photos_skipped["outside_source"] == 2
+    # Lien symbolique vers l'extérieur : refusé à la lecture
+    assert progress.photos_skipped["unreadable"] == 1
+    assert any("Employee ..:" in error for error in progress.errors)
+
+@pytest.mark.parametrize("path", ["../manifest.csv", "/etc/passwd", "C:/Windows/win.ini", "E1\\..\\..\\x.jpg"])
+def test_source_relative_path_rejects_escapes(path):
+    with pytest.raises(PermissionError):
+        DirectorySource.relative_path(path)
+
+def test_zip_members_follow_the_same_rule(tmp_path):
+    archive_path = tmp_path / "site.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("E1/front.jpg", b"front")
+        archive.writestr("../evil.jpg", b"evil")
+
+    source = ZipSource(archive_path)
+    try:
+        assert source.read("E1/front.jpg") == b"front"
+        assert source.list_photos("E1") == ["E1/front.jpg"]
+        with pytest.raises(PermissionError):
+            source.read("../evil.jpg")
+        with pytest.raises(PermissionError):
+            source.list_photos("..")
+    finally:
+        source.close()
+
+def test_archive_bounds_are_checked_before_decompression(tmp_path, monkeypatch):
+    archive_path = tmp_path / "site.zip"
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("manifest.csv", MANIFEST)
+        archive.writestr("E1/front.jpg", b"\0" * 4096)
+
+    with pytest.raises(ValueError, match="File too large: E1/front.jpg"):
+        ZipSource(archive_path, max_file_bytes=1024)
+    with pytest.raises(ValueError, match="maximum 1"):
+        ZipSource(archive_path, max_files=1)
+
+    monkeypatch.setattr(settings, "RECOGNITION_BATCH_MAX_IMAGE_BYTES", 1024)
+    with pytest.raises(ValueError):
+        start_enrollment_job(None, archive_path, None, delete_source=True)
+    assert not archive_path.exists()
+
+def test_finished_jobs_expire(monkeypatch):
+    monkeypatch.setattr(settings, "ENROLLMENT_JOB_TTL_S", 60)
+    running, finished, recent = EnrollmentProgress(), EnrollmentProgress(), EnrollmentProgress()
+    finished.finish("completed")
+    finished.finished_at -= timedelta(seconds=120)
+    recent.finish("completed")
+    monkeypatch.setattr(enrollment, "_jobs", {job.job_id: job for job in (running, finished, recent)})
+
+    assert get_enrollment_job(finished.job_id) is None
+    assert get_enrollment_job(running.job_id) is running
+    assert get_enrollment_job(recent.job_id) is recent
+
+def test_interrupted_enrollment_resumes(service, source):
+    rows = read_manifest(MANIFEST)
+
+    # Interruption après la validation des photos, avant leur ajout à l'index
+    add_photos = service.add_photos
+    def interrupted(*args, **kwargs):
+        raise RuntimeError("interrupted")
+    service.add_photos = interrupted
+    first = run_enrollment(service, source, rows)
+    assert first.status == "failed"
+    assert _photo_count() == 4
+    assert len(service.id_map) == 0
+
+    service.add_photos = add_photos
+    second = run_enrollment(service, source, rows)
+    assert second.status == "completed"
+    assert second.employees_created == 0
+    assert second.photos_skipped["already_enrolled"] == 4
+    assert second.photos_added == 0
+    # Les photos validées lors de la première exécution sont indexées à la reprise
+    assert len(service.id_map) == 4
+    assert _photo_count() == 4
+
+def test_same_file_name_in_two_folders_is_two_photos(service, source):
+    (source.root / "E1" / "front").mkdir()
+    (source.root / "E1" / "front" / "1.jpg").write_bytes(b"front")
+    (source.root / "E1" / "side").mkdir()
+    (source.root / "E1" / "side" / "1.jpg").write_bytes(b"side")
+    manifest = "employee_id,name,photos\nE1,Alice,E1/front/1.jpg;E1/side/1.jpg;E1/front/1.jpg\n"
+
+    progress = run_enrollment(service, source, read_manifest(manifest))
+    assert progress.photos_added == 2
+    assert progress.photos_skipped["duplicate_in_manifest"] == 1
+
+    # Reprise : chaque entrée du manifeste, doublon compris, est déjà enregistrée
+    again = run_enrollment(service, source, read_manifest(manifest))
+    assert again.photos_skipped["already_enrolled"] == 3
+    assert again.photos_added == 0
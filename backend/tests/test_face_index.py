@@ -0,0 +1,77 @@
+"""
+Galerie partagée entre processus : rattrapage, rechargement et reconstruction de l'index
+"""
+import numpy as np
+
+from app.config import settings
+from app.database import Employee, EmployeePhoto
+from app.ml_module.face_recognition import FaceRecognitionService, EMBEDDING_VERSION, embedding_to_bytes
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, settings.EMBEDDING_SIZE)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def _photo_ids(service: FaceRecognitionService):
+    return service.gallery.id_map.photo_ids.tolist()
+
+def test_catch_up_before_first_snapshot(make_service):
+    writer, other = make_service(), make_service()
+    vectors = _vectors(2)
+
+    # Aucun snapshot : les deux écrivains partagent le journal de la génération 0
+    writer.add_photos([1], [10], vectors[:1], publish=False)
+    assert writer.store.disk_version() == writer.gallery.version != (0, 0)
+
+    other.add_photos([2], [20], vectors[1:], publish=False)
+    assert _photo_ids(other) == [1, 2]
+
+    # Un nouveau processus rejoue le journal sans snapshot
+    assert _photo_ids(make_service()) == [1, 2]
+
+def test_catch_up_after_snapshot(make_service):
+    writer, other = make_service(), make_service()
+    vectors = _vectors(3)
+
+    writer.add_photos([1, 2], [10, 20], vectors[:2], publish=False)
+    with writer._lock:
+        writer.save_index()
+
+    other.remove_photos([1])
+    other.add_photos([3], [30], vectors[2:], publish=False)
+    assert _photo_ids(other) == [2, 3]
+    assert other.gallery.version[0] == writer.gallery.version[0]
+
+def test_reload_index_picks_up_other_writer(make_service):
+    writer, reader = make_service(), make_service()
+    writer.add_photos([1], [10], _vectors(1), publish=False)
+
+    assert reader.reload_index()
+    assert _photo_ids(reader) == [1]
+    assert reader.gallery.version == writer.gallery.version
+
+    # Version déjà chargée : pas de rechargement
+    assert not reader.reload_index()
+
+def test_rebuild_index_keeps_uncommitted_photos(make_service, db):
+    service = make_service()
+    vectors = _vectors(3)
+
+    employee = Employee(employee_id="E1", name="Alice", email="alice@example.com")
+    db.add(employee)
+    db.commit()
+    for photo_id, vector in zip([1, 2], vectors[:2]):
+        db.add(EmployeePhoto(
+            id=photo_id, employee_id=employee.id, photo_path=f"/missing/{photo_id}.jpg",
+            embedding=embedding_to_bytes(vector), embedding_version=EMBEDDING_VERSION
+        ))
+    db.commit()
+
+    # Photo indexée dont la transaction d'upload n'est pas encore validée
+    service.add_photos([3], [employee.id], vectors[2:], publish=False)
+
+    service.rebuild_index(db)
+    assert _photo_ids(service) == [1, 2, 3]
+    assert service.gallery.version[0] == 1
+
+    # Le snapshot publié contient les trois photos
+    assert _photo_ids(make_service()) == [1, 2, 3]
@@ -0,0 +1,35 @@
+"""
+Service partagé : 503 pendant le chargement, échec du chargement signalé
+"""
+import pytest
+from fastapi import HTTPException
+
+from app.ml_module import face_recognition
+from app.ml_module.face_recognition import face_service_error, get_face_service, init_face_service
+
+@pytest.fixture
+def no_service(monkeypatch):
+    monkeypatch.setattr(face_recognition, "_face_service", None)
+    monkeypatch.setattr(face_recognition, "_face_service_error", None)
+
+def test_loading_service_answers_503_with_retry_after(no_service):
+    with pytest.raises(HTTPException) as excinfo:
+        get_face_service()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers == {"Retry-After": "5"}
+    assert face_service_error() is None
+
+def test_failed_load_is_reported(no_service, monkeypatch):
+    def fail():
+        raise OSError("weights not found")
+    monkeypatch.setattr(face_recognition, "FaceRecognitionService", fail)
+
+    with pytest.raises(OSError):
+        init_face_service()
+    assert face_service_error() == "weights not found"
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_face_service()
+    assert excinfo.value.status_code == 503
+    assert "weights not found" in excinfo.value.detail
+    assert not excinfo.value.headers
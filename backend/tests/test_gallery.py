@@ -0,0 +1,71 @@
+"""
+Galerie : snapshot + rejeu du journal, reprise après un crash pendant l'écriture d'un snapshot
+"""
+import numpy as np
+
+from app.config import settings
+from app.ml_module.gallery import Gallery
+from app.ml_module.index_store import IndexStore, OP_ADD, OP_REMOVE
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, settings.EMBEDDING_SIZE)).astype(np.float32)
+
+def _add(gallery: Gallery, photo_ids, employee_ids, vectors):
+    photo_ids = np.array(photo_ids, dtype=np.int64)
+    employee_ids = np.array(employee_ids, dtype=np.int64)
+    # Journaliser avant d'appliquer en mémoire, comme le service
+    gallery.store.append(OP_ADD, photo_ids, employee_ids, vectors)
+    gallery.apply_add(photo_ids, employee_ids, vectors)
+
+def _remove(gallery: Gallery, photo_ids):
+    photo_ids = np.array(photo_ids, dtype=np.int64)
+    gallery.store.append(OP_REMOVE, photo_ids)
+    gallery.apply_remove(photo_ids)
+
+def _load(directory) -> Gallery:
+    return Gallery.load(IndexStore(directory, fsync=False))
+
+def test_snapshot_then_log_is_replayed(tmp_path):
+    vectors = _vectors(3)
+    gallery = _load(tmp_path)
+    _add(gallery, [1, 2], [10, 20], vectors[:2])
+    gallery.snapshot()
+    _add(gallery, [3], [10], vectors[2:])
+    _remove(gallery, [2])
+
+    loaded = _load(tmp_path)
+    assert loaded.version == gallery.version
+    assert loaded.store.generation == 1
+    assert loaded.id_map.photo_ids.tolist() == [1, 3]
+    assert loaded.id_map.employee_ids.tolist() == [10, 10]
+    assert loaded.index.ntotal == 2
+    np.testing.assert_allclose(loaded.index.reconstruct(3), vectors[2], rtol=1e-6)
+
+def test_snapshot_compacts_the_log(tmp_path):
+    gallery = _load(tmp_path)
+    _add(gallery, [1], [10], _vectors(1))
+
+    gallery.snapshot()
+    store = gallery.store
+    assert (store.wal_records, store.wal_size) == (0, 0)
+    assert store.wal_path(1).stat().st_size == 0
+    # L'ancienne génération est supprimée une fois le manifeste basculé
+    assert not store.wal_path(0).exists()
+    assert not gallery.snapshot_due()
+
+def test_crash_before_manifest_switch_keeps_previous_generation(tmp_path):
+    vectors = _vectors(2)
+    gallery = _load(tmp_path)
+    _add(gallery, [1], [10], vectors[:1])
+    gallery.snapshot()
+    _add(gallery, [2], [20], vectors[1:])
+
+    # Crash après l'écriture des fichiers de la génération 2, avant le manifeste
+    store = gallery.store
+    store.index_path(2).write_bytes(b"partial")
+    store.ids_path(2).write_bytes(b"partial")
+
+    loaded = _load(tmp_path)
+    assert loaded.store.generation == 1
+    assert loaded.id_map.photo_ids.tolist() == [1, 2]
+    assert not loaded.needs_rebuild
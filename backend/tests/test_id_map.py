@@ -0,0 +1,50 @@
+"""
+Mapping photo_id -> employee_id et son format binaire
+"""
+import numpy as np
+import pytest
+
+from app.ml_module.id_map import IdMap
+
+def _sample() -> IdMap:
+    id_map = IdMap()
+    id_map.set_many(np.array([30, 10, 20]), np.array([3, 1, 2]))
+    return id_map
+
+def test_lookup_and_updates():
+    id_map = _sample()
+    assert id_map.photo_ids.tolist() == [10, 20, 30]
+    assert id_map.lookup(np.array([20, 99, 10])).tolist() == [2, -1, 1]
+
+    id_map.set_many(np.array([20, 40]), np.array([7, 4]))
+    assert dict(id_map.items()) == {10: 1, 20: 7, 30: 3, 40: 4}
+
+    id_map.remove_many(np.array([10, 99]))
+    assert id_map.get(10) is None
+    assert id_map.photos_of(7).tolist() == [20]
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_and_load(tmp_path, mmap):
+    path = tmp_path / "ids.bin"
+    _sample().save(path)
+
+    loaded = IdMap.load(path, mmap=mmap)
+    assert isinstance(loaded.photo_ids, np.memmap) == mmap
+    assert dict(loaded.items()) == {10: 1, 20: 2, 30: 3}
+
+    # Un mapping mappé en lecture seule reste modifiable (copie à la première écriture)
+    loaded.set_many(np.array([40]), np.array([4]))
+    loaded.remove_many(np.array([10]))
+    assert dict(loaded.items()) == {20: 2, 30: 3, 40: 4}
+    assert dict(IdMap.load(path).items()) == {10: 1, 20: 2, 30: 3}
+
+def test_empty_map_round_trip(tmp_path):
+    path = tmp_path / "ids.bin"
+    IdMap().save(path)
+    assert len(IdMap.load(path, mmap=True)) == 0
+
+def test_rejects_unknown_format(tmp_path):
+    path = tmp_path / "ids.bin"
+    path.write_bytes(b"\0" * 32)
+    with pytest.raises(ValueError):
+        IdMap.load(path)
@@ -0,0 +1,105 @@
+"""
+Journal des mutations (WAL) et snapshots de l'index
+"""
+import numpy as np
+import faiss
+
+from app.ml_module.index_store import IndexStore, WAL_HEADER, WAL_CRC, OP_ADD, OP_REMOVE
+from app.ml_module.id_map import IdMap
+
+DIM = 8
+
+def _add(store, photo_ids, employee_ids, seed=0):
+    embeddings = np.random.default_rng(seed).standard_normal((len(photo_ids), DIM)).astype(np.float32)
+    store.append(OP_ADD, np.array(photo_ids), np.array(employee_ids), embeddings)
+    return embeddings
+
+def test_wal_round_trip(tmp_path):
+    store = IndexStore(tmp_path, fsync=False)
+    embeddings = _add(store, [1, 2], [10, 20])
+    store.append(OP_REMOVE, np.array([1]))
+
+    reader = IndexStore(tmp_path, fsync=False)
+    records = list(reader.read_wal())
+
+    assert [record.op for record in records] == [OP_ADD, OP_REMOVE]
+    assert records[0].photo_ids.tolist() == [1, 2]
+    assert records[0].employee_ids.tolist() == [10, 20]
+    np.testing.assert_array_equal(records[0].embeddings, embeddings)
+    assert records[1].photo_ids.tolist() == [1]
+    assert records[1].employee_ids is None
+    assert reader.wal_records == 2
+    assert reader.version == store.version
+
+def test_torn_tail_is_ignored_and_truncated(tmp_path):
+    store = IndexStore(tmp_path, fsync=False)
+    _add(store, [1], [10])
+    valid_size = store.wal_size
+    _add(store, [2], [20], seed=1)
+
+    # Écriture interrompue : le dernier enregistrement est incomplet
+    path = store.wal_path(store.generation)
+    with open(path, "r+b") as f:
+        f.truncate(valid_size + WAL_HEADER.size + 5)
+
+    reader = IndexStore(tmp_path, fsync=False)
+    records = list(reader.read_wal(truncate=False))
+    assert [record.photo_ids.tolist() for record in records] == [[1]]
+    assert path.stat().st_size > valid_size
+
+    list(IndexStore(tmp_path, fsync=False).read_wal(truncate=True))
+    assert path.stat().st_size == valid_size
+
+    # Les ajouts suivants restent lisibles après la coupure
+    _add(reader, [3], [30], seed=2)
+    records = list(IndexStore(tmp_path, fsync=False).read_wal())
+    assert [record.photo_ids.tolist() for record in records] == [[1], [3]]
+
+def test_crc_mismatch_stops_replay(tmp_path):
+    store = IndexStore(tmp_path, fsync=False)
+    _add(store, [1], [10])
+    first_size = store.wal_size
+    _add(store, [2], [20], seed=1)
+    _add(store, [3], [30], seed=2)
+
+    # Un octet altéré dans la charge utile du deuxième enregistrement
+    path = store.wal_path(store.generation)
+    data = bytearray(path.read_bytes())
+    data[first_size + WAL_HEADER.size] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    reader = IndexStore(tmp_path, fsync=False)
+    records = list(reader.read_wal(truncate=False))
+    assert [record.photo_ids.tolist() for record in records] == [[1]]
+    assert reader.wal_size == first_size
+
+def test_record_layout(tmp_path):
+    store = IndexStore(tmp_path, fsync=False)
+    _add(store, [1, 2, 3], [10, 10, 20])
+    # En-tête + photo_ids + employee_ids + embeddings + CRC
+    assert store.wal_size == WAL_HEADER.size + 3 * 8 + 3 * 8 + 3 * DIM * 4 + WAL_CRC.size
+
+def test_snapshot_switches_generation(tmp_path):
+    store = IndexStore(tmp_path, fsync=False, embedding_version="v1")
+    _add(store, [1], [10])
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(np.zeros((1, DIM), dtype=np.float32), np.array([1], dtype=np.int64))
+    store.write_snapshot(index, IdMap(np.array([1]), np.array([10])))
+
+    assert store.generation == 1
+    assert store.disk_version() == (1, 0)
+    assert not store.wal_path(0).exists()
+
+    reader = IndexStore(tmp_path, fsync=False, embedding_version="v1")
+    loaded_index, id_map = reader.load_snapshot()
+    assert loaded_index.ntotal == 1
+    assert id_map.get(1) == 10
+    assert not reader.stale_embeddings
+
+def test_snapshot_from_another_embedding_version_is_stale(tmp_path):
+    store = IndexStore(tmp_path, fsync=False, embedding_version="v1")
+    store.write_snapshot(faiss.IndexIDMap2(faiss.IndexFlatL2(DIM)), IdMap())
+
+    reader = IndexStore(tmp_path, fsync=False, embedding_version="v2")
+    reader.load_snapshot()
+    assert reader.stale_embeddings
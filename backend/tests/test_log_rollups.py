@@ -0,0 +1,74 @@
+"""
+Rollups horaires et journaliers des logs d'accès
+"""
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from app.database import AccessLog, AccessLogRollup
+from app.log_rollups import (
+    ALL_EMPLOYEES, BACKFILL_MARKER, apply_rollups, backfill_rollups, bucket_start, rollup_deltas
+)
+
+def _counts(db, granularity):
+    rows = db.execute(
+        select(AccessLogRollup.bucket, AccessLogRollup.employee_id, AccessLogRollup.decision, AccessLogRollup.count)
+        .where(AccessLogRollup.granularity == granularity)
+    )
+    return {(bucket, employee_id, decision): count for bucket, employee_id, decision, count in rows}
+
+def test_bucket_start():
+    timestamp = datetime(2026, 5, 4, 13, 47, 12, 5)
+    assert bucket_start(timestamp, "hour") == datetime(2026, 5, 4, 13)
+    assert bucket_start(timestamp, "day") == datetime(2026, 5, 4)
+
+def test_rollup_deltas():
+    rows = [
+        {"employee_id": 7, "decision": "granted", "timestamp": datetime(2026, 5, 4, 13, 5)},
+        {"employee_id": 7, "decision": "granted", "timestamp": datetime(2026, 5, 4, 13, 55)},
+        {"employee_id": None, "decision": "denied", "timestamp": datetime(2026, 5, 4, 14, 1)},
+    ]
+    deltas = rollup_deltas(rows)
+
+    assert deltas[("hour", datetime(2026, 5, 4, 13), 7, "granted")] == 2
+    assert deltas[("hour", datetime(2026, 5, 4, 13), ALL_EMPLOYEES, "granted")] == 2
+    assert deltas[("day", datetime(2026, 5, 4), ALL_EMPLOYEES, "denied")] == 1
+    # Une tentative non reconnue n'est comptée que sur la ligne tous employés
+    assert not any(key[2] is None for key in deltas)
+    assert len(deltas) == 6
+
+def test_apply_rollups_accumulates(db):
+    row = {"employee_id": 3, "decision": "granted", "timestamp": datetime(2026, 5, 4, 9, 30)}
+    apply_rollups(db, [row])
+    apply_rollups(db, [row, dict(row, decision="denied")])
+    db.commit()
+
+    day = _counts(db, "day")
+    assert day[(datetime(2026, 5, 4), 3, "granted")] == 2
+    assert day[(datetime(2026, 5, 4), ALL_EMPLOYEES, "granted")] == 2
+    assert day[(datetime(2026, 5, 4), ALL_EMPLOYEES, "denied")] == 1
+
+def test_backfill_is_idempotent(db):
+    logs = [
+        {
+            "employee_id": i % 2 or None,
+            "decision": "granted" if i % 3 else "denied",
+            "timestamp": datetime(2026, 5, i % 5 + 1)
+        }
+        for i in range(40)
+    ]
+    db.execute(insert(AccessLog), logs)
+    # Une écriture en direct avant la construction (premier démarrage interrompu)
+    apply_rollups(db, logs[:1])
+    db.commit()
+
+    assert backfill_rollups(db) == 40
+    assert backfill_rollups(db) == 0
+
+    expected = {
+        (key[1], key[2], key[3]): count
+        for key, count in rollup_deltas(logs).items() if key[0] == "day"
+    }
+    assert _counts(db, "day") == expected
+    marker = _counts(db, BACKFILL_MARKER["granularity"])
+    assert list(marker.values()) == [40]
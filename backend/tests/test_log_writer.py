@@ -0,0 +1,59 @@
+"""
+Écrivain d'AccessLog en arrière-plan : lots, durabilité par décision, arrêt
+"""
+import pytest
+
+from app.database import SessionLocal, AccessLog
+from app.log_writer import AccessLogWriter
+
+def _row(decision: str, employee_id=None) -> dict:
+    return {"employee_id": employee_id, "employee_name": None, "recognition_score": 0.5, "decision": decision}
+
+def _count_logs() -> int:
+    # Nouvelle session : seules les lignes validées sont visibles
+    session = SessionLocal()
+    try:
+        return session.query(AccessLog).count()
+    finally:
+        session.close()
+
+@pytest.fixture
+def writer(db):
+    # Intervalle long : seules les écritures durables et l'arrêt déclenchent l'écriture
+    writer = AccessLogWriter(batch_size=100, flush_interval_ms=60_000, sync_decisions=["denied"])
+    writer.start()
+    yield writer
+    writer.stop()
+
+def test_durable_decision_is_committed_when_its_future_resolves(writer):
+    assert writer.write(_row("granted", 1)) is None
+    future = writer.write(_row("denied"))
+
+    future.result(timeout=5)
+    # Le lot durable emporte les logs déjà en file
+    assert _count_logs() == 2
+    assert writer.written == 2
+
+def test_buffered_logs_are_written_on_stop(writer):
+    futures = writer.write_many([_row("granted", i) for i in range(1, 4)])
+    assert futures == [None, None, None]
+    assert _count_logs() == 0
+
+    writer.stop()
+    assert _count_logs() == 3
+
+def test_stopped_writer_writes_immediately(db):
+    writer = AccessLogWriter(batch_size=10, flush_interval_ms=60_000, sync_decisions=[])
+    writer.write(_row("granted", 1))
+    assert _count_logs() == 1
+
+def test_failed_insert_is_reported_to_durable_callers(writer):
+    bad = _row("denied")
+    bad["decision"] = None  # Colonne NOT NULL
+    writer.sync_decisions.add(None)
+    future = writer.write(bad)
+
+    with pytest.raises(Exception):
+        future.result(timeout=5)
+    assert writer.failed == 1
+    assert _count_logs() == 0
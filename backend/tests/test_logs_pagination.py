@@ -0,0 +1,78 @@
+"""
+Pagination par curseur (keyset) des logs d'accès
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import insert
+
+from app.database import AccessLog
+from app.routers.logs import get_logs, _encode_cursor, _decode_cursor
+
+def _page(db, limit, cursor=None, decision=None):
+    response = Response()
+    logs = get_logs(
+        response, start_date=None, end_date=None, employee_id=None, decision=decision,
+        limit=limit, skip=0, cursor=cursor, db=db, current_user=None
+    )
+    return logs, response.headers.get("X-Next-Cursor")
+
+def test_cursor_round_trip():
+    log = AccessLog(id=42, timestamp=datetime(2026, 3, 1, 12, 30, 15, 123456), decision="granted")
+    assert _decode_cursor(_encode_cursor(log)) == (log.timestamp, 42)
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "", "MjAyNi0wMy0wMQ=="])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        _decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+def test_pages_cover_every_log_once(db):
+    start = datetime(2026, 1, 1)
+    # Plusieurs logs par timestamp : l'id départage les égalités
+    db.execute(insert(AccessLog), [
+        {"timestamp": start + timedelta(seconds=i // 3), "decision": "granted" if i % 2 else "denied"}
+        for i in range(25)
+    ])
+    db.commit()
+
+    seen, pages, cursor = [], [], None
+    while True:
+        logs, cursor = _page(db, 10, cursor)
+        pages.append(len(logs))
+        seen.extend((log.timestamp, log.id) for log in logs)
+        if cursor is None:
+            break
+
+    assert pages == [10, 10, 5]
+    assert len(set(seen)) == 25
+    assert seen == sorted(seen, reverse=True)
+
+def test_new_logs_do_not_shift_the_next_page(db):
+    start = datetime(2026, 1, 1)
+    db.execute(insert(AccessLog), [
+        {"timestamp": start + timedelta(minutes=i), "decision": "granted"} for i in range(6)
+    ])
+    db.commit()
+
+    first, cursor = _page(db, 3)
+    db.add(AccessLog(timestamp=start + timedelta(days=1), decision="granted"))
+    db.commit()
+    second, _ = _page(db, 3, cursor)
+
+    assert [log.timestamp for log in first + second] == [start + timedelta(minutes=i) for i in range(5, -1, -1)]
+
+def test_cursor_respects_filters(db):
+    start = datetime(2026, 1, 1)
+    db.execute(insert(AccessLog), [
+        {"timestamp": start + timedelta(minutes=i), "decision": "granted" if i % 2 else "denied"}
+        for i in range(10)
+    ])
+    db.commit()
+
+    first, cursor = _page(db, 3, decision="denied")
+    second, cursor = _page(db, 3, cursor, decision="denied")
+    assert cursor is None
+    assert {log.decision for log in first + second} == {"denied"}
+    assert len(first + second) == 5
@@ -0,0 +1,57 @@
+"""
+Image de la tentative : image_path n'est journalisé que si l'image a été écrite
+"""
+import asyncio
+import io
+
+import pytest
+from fastapi import BackgroundTasks
+from PIL import Image
+
+from app.config import settings
+from app.database import SessionLocal, AccessLog
+from app.probe_store import ProbeImageStore
+from app.routers import recognition
+from app.routers.recognition import _log_attempts, _log_row
+
+def _jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (200, 120, 80)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def _image_paths():
+    session = SessionLocal()
+    try:
+        return {log.decision: log.image_path for log in session.query(AccessLog).all()}
+    finally:
+        session.close()
+
+@pytest.fixture
+def probe_store(monkeypatch, tmp_path, db):
+    store = ProbeImageStore(tmp_path / "probes", tmp_path / "archive")
+    monkeypatch.setattr(settings, "SAVE_PROBE_IMAGES", True)
+    monkeypatch.setattr(recognition, "get_probe_store", lambda: store)
+    return store
+
+def _run(background_tasks, attempts):
+    async def run():
+        await _log_attempts(background_tasks, attempts, face_service=None)
+        if background_tasks is not None:
+            await background_tasks()
+    asyncio.run(run())
+
+@pytest.mark.parametrize("background", [True, False])
+def test_written_probe_is_logged(probe_store, background):
+    _run(BackgroundTasks() if background else None, [(_log_row(1, "Alice", 0.9, "granted"), _jpeg())])
+
+    path = _image_paths()["granted"]
+    assert path is not None
+    assert Image.open(path).format == "JPEG"
+
+@pytest.mark.parametrize("decision", ["granted", "denied"])
+def test_failed_probe_write_is_not_logged(probe_store, decision):
+    # Image illisible : l'écriture échoue, y compris pour un log durable déjà écrit
+    _run(BackgroundTasks(), [(_log_row(None, None, None, decision), b"not an image")])
+
+    assert _image_paths() == {decision: None}
+    assert not any(path.is_file() for path in probe_store.root.rglob("*"))
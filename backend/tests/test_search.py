@@ -0,0 +1,38 @@
+"""
+Agrégation des distances par employé
+"""
+import numpy as np
+
+from app.config import settings
+
+def _aggregate(service, candidates):
+    photo_ids = np.arange(1, len(candidates) + 1, dtype=np.int64)
+    employee_ids = np.array([employee_id for employee_id, _ in candidates], dtype=np.int64)
+    distances = np.array([distance for _, distance in candidates], dtype=np.float32)
+    return service._aggregate(photo_ids, employee_ids, distances)
+
+def test_single_close_photo_does_not_beat_consistent_matches(make_service, monkeypatch):
+    monkeypatch.setattr(settings, "AGGREGATE_TOP_PHOTOS", 3)
+    service = make_service()
+
+    # Employé 1 : trois photos proches ; employé 2 : une seule photo, un peu plus proche
+    best = _aggregate(service, [(1, 0.30), (1, 0.32), (1, 0.34), (2, 0.28), (3, 0.90)])
+    assert best["employee_id"] == 1
+    assert abs(best["distance"] - (0.30 + 0.32 + 0.34) / 3) < 1e-6
+
+def test_missing_photos_are_padded_with_the_worst_candidate(make_service, monkeypatch):
+    monkeypatch.setattr(settings, "AGGREGATE_TOP_PHOTOS", 3)
+    service = make_service()
+
+    best = _aggregate(service, [(2, 0.10), (3, 0.90)])
+    assert best["employee_id"] == 2
+    assert best["photo_distance"] == np.float32(0.10)
+    assert abs(best["distance"] - (0.10 + 2 * 0.90) / 3) < 1e-6
+
+def test_a_single_candidate_keeps_its_distance(make_service, monkeypatch):
+    monkeypatch.setattr(settings, "AGGREGATE_TOP_PHOTOS", 3)
+    service = make_service()
+
+    best = _aggregate(service, [(4, 0.25)])
+    assert best["employee_id"] == 4
+    assert abs(best["distance"] - 0.25) < 1e-6
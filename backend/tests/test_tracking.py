@@ -0,0 +1,77 @@
+"""
+Suivi des visages d'un flux : appariement IoU et visages à ré-identifier
+"""
+import numpy as np
+
+from app.ml_module.tracking import FaceTracker, box_iou
+
+def _embed(tracker: FaceTracker, to_embed, decision: str = "granted"):
+    # Ce que fait le flux après le passage FaceNet
+    for track, _ in to_embed:
+        tracker.mark_embedded(track)
+        track.decision = decision
+
+def test_box_iou():
+    boxes = np.array([[0, 0, 10, 10], [5, 0, 15, 10]], dtype=np.float32)
+    iou = box_iou(boxes, boxes)
+    np.testing.assert_allclose(np.diag(iou), [1.0, 1.0])
+    np.testing.assert_allclose(iou[0, 1], 50 / 150)
+
+def test_moving_face_keeps_its_track_and_is_embedded_once():
+    tracker = FaceTracker()
+    visible, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    assert [track for track, _ in to_embed] == visible
+    _embed(tracker, to_embed)
+
+    visible2, to_embed2 = tracker.update([[5, 5, 105, 105]], [0.99])
+    assert visible2[0] is visible[0]
+    assert to_embed2 == []
+
+def test_new_face_gets_a_new_track():
+    tracker = FaceTracker()
+    visible, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    _embed(tracker, to_embed)
+
+    visible, to_embed = tracker.update([[0, 0, 100, 100], [300, 300, 400, 400]], [0.99, 0.99])
+    assert [track.track_id for track in visible] == [1, 2]
+    assert [(track.track_id, d) for track, d in to_embed] == [(2, 1)]
+
+def test_low_confidence_waits_for_a_reliable_view():
+    tracker = FaceTracker(min_confidence=0.9)
+    visible, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    _embed(tracker, to_embed)
+
+    _, to_embed = tracker.update([[0, 0, 100, 100]], [0.5])
+    assert to_embed == []
+    assert visible[0].unstable
+
+    # Retour d'une détection fiable : nouvel embedding
+    _, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    assert [track for track, _ in to_embed] == visible
+
+def test_denied_track_is_retried_periodically():
+    tracker = FaceTracker(retry_interval=3)
+    _, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    _embed(tracker, to_embed, decision="denied")
+
+    retried = []
+    for _ in range(6):
+        _, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+        retried.append(bool(to_embed))
+        _embed(tracker, to_embed, decision="denied")
+    assert retried == [False, False, True, False, False, True]
+
+def test_lost_tracks_are_forgotten():
+    tracker = FaceTracker(max_missed_frames=2)
+    tracker.update([[0, 0, 100, 100]], [0.99])
+    for _ in range(2):
+        tracker.update(np.empty((0, 4)), np.empty(0))
+    assert len(tracker.tracks) == 1
+
+    tracker.update(np.empty((0, 4)), np.empty(0))
+    assert tracker.tracks == []
+
+    # Le visage qui réapparaît est une nouvelle piste
+    visible, to_embed = tracker.update([[0, 0, 100, 100]], [0.99])
+    assert visible[0].track_id == 2
+    assert len(to_embed) == 1
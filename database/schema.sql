@@ -28,9 +28,15 @@ CREATE TABLE IF NOT EXISTS employee_photos (
     employee_id INTEGER REFERENCES employees(id) ON DELETE CASCADE,
     photo_path VARCHAR(500) NOT NULL,
     embedding_path VARCHAR(500),
+    embedding BYTEA, -- float32[512] stocké pour reconstruire l'index sans relancer le CNN
+    embedding_version VARCHAR(100),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Migration des bases existantes
+ALTER TABLE employee_photos ADD COLUMN IF NOT EXISTS embedding BYTEA;
+ALTER TABLE employee_photos ADD COLUMN IF NOT EXISTS embedding_version VARCHAR(100);
+
 -- Table des logs d'accès
 CREATE TABLE IF NOT EXISTS access_logs (
     id SERIAL PRIMARY KEY,
@@ -42,12 +48,31 @@ CREATE TABLE IF NOT EXISTS access_logs (
     image_path VARCHAR(500)
 );
 
+-- Compteurs des logs par heure / jour, employé (0 = tous) et décision
+CREATE TABLE IF NOT EXISTS access_log_rollups (
+    granularity VARCHAR(5) NOT NULL, -- 'hour', 'day' or 'state' (backfill completion marker)
+    bucket TIMESTAMP NOT NULL,
+    employee_id INTEGER NOT NULL,
+    decision VARCHAR(20) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (granularity, bucket, employee_id, decision)
+);
+
+-- Version de l'index FAISS partagée par les processus et les nœuds (une seule ligne)
+CREATE TABLE IF NOT EXISTS index_state (
+    id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    wal_size BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Index pour améliorer les performances
 CREATE INDEX IF NOT EXISTS idx_employees_employee_id ON employees(employee_id);
 CREATE INDEX IF NOT EXISTS idx_employees_email ON employees(email);
 CREATE INDEX IF NOT EXISTS idx_employee_photos_employee_id ON employee_photos(employee_id);
 CREATE INDEX IF NOT EXISTS idx_access_logs_employee_id ON access_logs(employee_id);
 CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp ON access_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp_id ON access_logs(timestamp, id);
 CREATE INDEX IF NOT EXISTS idx_access_logs_decision ON access_logs(decision);
 
 -- Fonction pour mettre à jour updated_at automatiquement